@@ -0,0 +1,287 @@
+"""Prebuilt, compressed database artifacts
+
+A build step packs a finished ``ciqual.db`` (and its matrix sidecar when
+present) into compressed files described by a JSON manifest. Nodes install
+the artifact by streaming it through the decompressor into a temporary file
+while hashing it, then renaming it into place: no XML download or parsing.
+
+Layout of an artifact directory::
+
+    ciqual-<record_id>.json          manifest
+    ciqual-<record_id>.db.xz         compressed database
+    ciqual-<record_id>.matrix.xz     compressed matrix sidecar (optional)
+
+xz (stdlib ``lzma``) is always available; zstd requires the optional
+``zstandard`` package.
+"""
+
+import hashlib
+import json
+import lzma
+import os
+import sqlite3
+import tempfile
+import time
+from pathlib import Path
+
+from matrix import matrix_path
+
+ARTIFACT_FORMAT_VERSION = 1
+
+# Compressor name -> file extension
+COMPRESSIONS = {"xz": "xz", "zstd": "zst"}
+
+# Bytes per read/write while streaming
+STREAM_CHUNK = 1024 * 1024
+
+class ArtifactError(Exception):
+    """Raised for unreadable manifests and checksum or integrity failures"""
+
+def _zstandard():
+    try:
+        import zstandard
+    except ImportError as e:
+        raise ArtifactError("zstd artifacts require the 'zstandard' package") from e
+    return zstandard
+
+def _open_compressed(file, mode, compression):
+    """Open a compressed path or file object for streaming reads ('rb') or writes ('wb')"""
+    if compression == "xz":
+        return lzma.open(file, mode, preset=6) if mode == "wb" else lzma.open(file, mode)
+    if compression == "zstd":
+        zstandard = _zstandard()
+        raw = open(file, mode) if isinstance(file, (str, os.PathLike)) else file
+        if mode == "wb":
+            return zstandard.ZstdCompressor(level=19, threads=-1).stream_writer(raw, closefd=True)
+        return zstandard.ZstdDecompressor().stream_reader(raw, closefd=True)
+    raise ArtifactError(f"Unknown compression: {compression}")
+
+def _decompression_errors(compression):
+    """Exception types raised by the decompressor on corrupt input"""
+    if compression == "zstd":
+        return (_zstandard().ZstdError, EOFError)
+    return (lzma.LZMAError, EOFError)
+
+def _sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(STREAM_CHUNK), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def _compress(source, dest, compression):
+    """Compress ``source`` into ``dest`` and describe the result for the manifest"""
+    with open(source, "rb") as src, _open_compressed(dest, "wb", compression) as out:
+        for chunk in iter(lambda: src.read(STREAM_CHUNK), b""):
+            out.write(chunk)
+    return {
+        "name": dest.name,
+        "sha256": _sha256(dest),
+        "size": os.path.getsize(source),
+    }
+
+def build_artifact(db_path, out_dir, compression="xz"):
+    """Pack a database (and its matrix sidecar) into a compressed artifact
+
+    Args:
+        db_path: Finished database built by ``initialize_database``
+        out_dir: Directory receiving the manifest and compressed files
+        compression: 'xz' or 'zstd'
+
+    Returns:
+        Path of the manifest
+    """
+    if compression not in COMPRESSIONS:
+        raise ArtifactError(f"Unknown compression: {compression}")
+    db_path = Path(db_path)
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+
+    conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    try:
+        metadata = dict(conn.execute(
+            "SELECT key, value FROM metadata WHERE key IN ('zenodo_record_id', 'zenodo_version')"
+        ).fetchall())
+    finally:
+        conn.close()
+    record_id = metadata.get("zenodo_record_id")
+    if not record_id:
+        raise ArtifactError(f"{db_path} has no zenodo_record_id; build it with initialize_database first")
+
+    stem = f"ciqual-{record_id}"
+    extension = COMPRESSIONS[compression]
+    files = {"db": _compress(db_path, out_dir / f"{stem}.db.{extension}", compression)}
+    sidecar = matrix_path(db_path)
+    if sidecar.exists():
+        files["matrix"] = _compress(sidecar, out_dir / f"{stem}.matrix.{extension}", compression)
+
+    manifest = {
+        "format": ARTIFACT_FORMAT_VERSION,
+        "record_id": record_id,
+        "version": metadata.get("zenodo_version"),
+        "compression": compression,
+        "built_at": time.time(),
+        "files": files,
+    }
+    manifest_path = out_dir / f"{stem}.json"
+    manifest_path.write_text(json.dumps(manifest, indent=2))
+    return manifest_path
+
+def find_artifact(location=None):
+    """Locate an artifact manifest
+
+    Args:
+        location: Manifest file or directory containing one; defaults to the
+            CIQUAL_ARTIFACT environment variable
+
+    Returns:
+        Path of the newest manifest found, or None
+    """
+    location = location or os.environ.get("CIQUAL_ARTIFACT")
+    if not location:
+        return None
+    location = Path(location)
+    if location.is_file():
+        return location
+    if location.is_dir():
+        manifests = sorted(location.glob("ciqual-*.json"), key=os.path.getmtime)
+        if manifests:
+            return manifests[-1]
+    return None
+
+def read_manifest(manifest_path):
+    """Load and validate an artifact manifest
+
+    Raises:
+        ArtifactError: If the manifest is unreadable or of an unknown format
+    """
+    try:
+        manifest = json.loads(Path(manifest_path).read_text())
+    except (OSError, ValueError) as e:
+        raise ArtifactError(f"Cannot read artifact manifest {manifest_path}: {e}") from e
+    if manifest.get("format") != ARTIFACT_FORMAT_VERSION or "db" not in manifest.get("files", {}):
+        raise ArtifactError(f"Unsupported artifact manifest: {manifest_path}")
+    return manifest
+
+def _install_file(source, dest, entry, compression):
+    """Stream-decompress ``source`` to ``dest`` after verifying its checksum
+
+    The compressed bytes are hashed as they are read; the output goes to a
+    temporary file that is only renamed over ``dest`` once both the checksum
+    and the decompressed size match the manifest.
+    """
+    fd, tmp_name = tempfile.mkstemp(prefix=".ciqual-", suffix=".part", dir=dest.parent)
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        with os.fdopen(fd, "wb") as out, open(source, "rb") as raw:
+            reader = _HashingReader(raw, digest)
+            try:
+                with _open_compressed(reader, "rb", compression) as stream:
+                    for chunk in iter(lambda: stream.read(STREAM_CHUNK), b""):
+                        out.write(chunk)
+                        size += len(chunk)
+            except _decompression_errors(compression) as e:
+                raise ArtifactError(f"Corrupt artifact file {source.name}: {e}") from e
+            # Hash any trailing bytes the decompressor did not consume
+            while reader.read(STREAM_CHUNK):
+                pass
+        if digest.hexdigest() != entry["sha256"]:
+            raise ArtifactError(f"Checksum mismatch for {source.name}")
+        if size != entry["size"]:
+            raise ArtifactError(f"Size mismatch for {source.name}: expected {entry['size']}, got {size}")
+        os.replace(tmp_name, dest)
+    except BaseException:
+        try:
+            os.unlink(tmp_name)
+        except OSError:
+            pass
+        raise
+
+class _HashingReader:
+    """File wrapper feeding every byte read into a hash"""
+
+    def __init__(self, raw, digest):
+        self._raw = raw
+        self._digest = digest
+
+    def read(self, size=-1):
+        data = self._raw.read(size)
+        self._digest.update(data)
+        return data
+
+    def readable(self):
+        return True
+
+    def close(self):
+        pass
+
+def install_artifact(manifest_path, db_path):
+    """Install a prebuilt database artifact as ``db_path``
+
+    Args:
+        manifest_path: Artifact manifest (see ``build_artifact``)
+        db_path: Target database file
+
+    Returns:
+        The manifest dict
+
+    Raises:
+        ArtifactError: On checksum, size or integrity failure; the current
+            database is left untouched
+    """
+    manifest_path = Path(manifest_path)
+    manifest = read_manifest(manifest_path)
+    compression = manifest["compression"]
+    db_path = Path(db_path)
+    db_path.parent.mkdir(parents=True, exist_ok=True)
+
+    # Decompress next to the target, check, then swap in atomically
+    staged = db_path.with_name(f".{db_path.name}.artifact")
+    _install_file(manifest_path.parent / manifest["files"]["db"]["name"], staged, manifest["files"]["db"], compression)
+    try:
+        conn = sqlite3.connect(staged)
+        try:
+            result = conn.execute("PRAGMA quick_check").fetchall()
+        finally:
+            conn.close()
+        if result != [("ok",)]:
+            raise ArtifactError(f"Artifact database failed integrity check: {result[:5]}")
+        os.replace(staged, db_path)
+    except BaseException:
+        try:
+            staged.unlink()
+        except OSError:
+            pass
+        raise
+
+    if "matrix" in manifest["files"]:
+        entry = manifest["files"]["matrix"]
+        _install_file(manifest_path.parent / entry["name"], matrix_path(db_path), entry, compression)
+    return manifest
+
+def main(argv=None):
+    """Command line entry point: ``python artifact.py build|install ...``"""
+    import argparse
+    parser = argparse.ArgumentParser(description="Build or install a prebuilt CIQUAL database artifact")
+    commands = parser.add_subparsers(dest="command", required=True)
+    build = commands.add_parser("build", help="compress a database into an artifact directory")
+    build.add_argument("out_dir", help="directory receiving the artifact")
+    build.add_argument("--db-path", default=str(Path.home() / ".ciqual" / "ciqual.db"))
+    build.add_argument("--compression", choices=sorted(COMPRESSIONS), default="xz")
+    install = commands.add_parser("install", help="install an artifact as the local database")
+    install.add_argument("manifest", help="manifest file or directory containing one")
+    install.add_argument("--db-path", default=str(Path.home() / ".ciqual" / "ciqual.db"))
+    args = parser.parse_args(argv)
+
+    if args.command == "build":
+        print(build_artifact(args.db_path, args.out_dir, args.compression))
+    else:
+        manifest_path = find_artifact(args.manifest)
+        if manifest_path is None:
+            parser.error(f"No artifact manifest found at {args.manifest}")
+        manifest = install_artifact(manifest_path, args.db_path)
+        print(f"Installed CIQUAL record {manifest['record_id']} into {args.db_path}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""Per-query execution budget enforced with SQLite's progress handler
+
+SQLite calls the progress handler every ``interval`` virtual machine
+instructions; returning a non-zero value aborts the running statement. This
+is used to cap both wall-clock time and VM instruction count so runaway
+LLM-generated SQL (e.g. an accidental cartesian join over ``composition``)
+cannot pin a core indefinitely.
+"""
+
+import time
+from contextlib import contextmanager
+
+# VM instructions between two progress handler calls
+PROGRESS_INTERVAL = 10_000
+
+class QueryCancelled(Exception):
+    """Raised when a statement exceeded its time or instruction budget
+
+    Attributes:
+        reason: 'timeout' or 'vm_steps'
+        elapsed_ms: Wall-clock time spent before cancellation
+        vm_steps: Approximate number of VM instructions executed
+    """
+
+    def __init__(self, reason, elapsed_ms, vm_steps):
+        self.reason = reason
+        self.elapsed_ms = elapsed_ms
+        self.vm_steps = vm_steps
+        super().__init__(
+            f"Query cancelled ({reason}) after {elapsed_ms:.0f} ms "
+            f"and ~{vm_steps} VM steps"
+        )
+
+    def to_dict(self):
+        """Structured error payload returned to MCP clients"""
+        return {
+            "error": f"{self}. Add a LIMIT, narrow the WHERE clause or avoid cross joins.",
+            "cancelled": True,
+            "reason": self.reason,
+            "elapsed_ms": round(self.elapsed_ms, 1),
+            "vm_steps": self.vm_steps,
+        }
+
+class QueryBudget:
+    """Wall-clock and VM-step limits for a single statement
+
+    Args:
+        timeout: Maximum seconds a statement may run (0 disables)
+        max_steps: Maximum VM instructions (0 disables)
+        interval: VM instructions between budget checks
+    """
+
+    def __init__(self, timeout=10.0, max_steps=0, interval=PROGRESS_INTERVAL):
+        self.timeout = timeout
+        self.max_steps = max_steps
+        self.interval = max(1, int(interval))
+
+    @contextmanager
+    def enforce(self, conn):
+        """Install the budget on ``conn`` for the duration of a ``with`` block
+
+        Raises:
+            QueryCancelled: If the statement was aborted by the budget
+        """
+        start = time.perf_counter()
+        deadline = start + self.timeout if self.timeout else None
+        state = {"steps": 0, "reason": None}
+
+        def handler():
+            state["steps"] += self.interval
+            if self.max_steps and state["steps"] > self.max_steps:
+                state["reason"] = "vm_steps"
+                return 1
+            if deadline is not None and time.perf_counter() > deadline:
+                state["reason"] = "timeout"
+                return 1
+            return 0
+
+        conn.set_progress_handler(handler, self.interval)
+        try:
+            yield state
+        except Exception as e:
+            if state["reason"] is not None and "interrupted" in str(e):
+                elapsed_ms = (time.perf_counter() - start) * 1000
+                raise QueryCancelled(state["reason"], elapsed_ms, state["steps"]) from e
+            raise
+        finally:
+            conn.set_progress_handler(None, 0)
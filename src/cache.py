@@ -0,0 +1,116 @@
+"""In-process LRU cache for query results
+
+LLM clients repeat the same handful of queries (often copied verbatim from
+the tool docstring), so results are cached keyed by normalized SQL text and
+evicted least-recently-used once the cache exceeds its byte budget.
+"""
+
+import json
+import re
+import threading
+from collections import OrderedDict
+
+# String literals, quoted identifiers, comments and whitespace runs
+_SQL_TOKEN_RE = re.compile(
+    r"""('(?:[^']|'')*')"""
+    r'''|("(?:[^"]|"")*")'''
+    r"|(--[^\n]*|/\*.*?\*/)"
+    r"|(\s+)",
+    re.DOTALL,
+)
+
+def normalize_sql(sql):
+    """Normalize SQL text for use as a cache key
+
+    Collapses whitespace and strips comments and trailing semicolons outside
+    of quoted literals. Case is preserved since column aliases become result
+    keys.
+
+    Example:
+        >>> normalize_sql("SELECT  *\\n FROM foods -- all;\\n;")
+        'SELECT * FROM foods'
+    """
+    parts = []
+    pos = 0
+    for match in _SQL_TOKEN_RE.finditer(sql):
+        if match.start() > pos:
+            parts.append(sql[pos:match.start()])
+        literal, identifier, _, _ = match.groups()
+        if literal or identifier:
+            parts.append(match.group(0))
+        elif parts and parts[-1] != " ":
+            parts.append(" ")
+        pos = match.end()
+    parts.append(sql[pos:])
+    text = "".join(parts).strip()
+    while text.endswith(";"):
+        text = text[:-1].rstrip()
+    return text
+
+def estimate_size(value):
+    """Approximate the memory footprint of a result by its JSON length"""
+    return len(json.dumps(value, default=str, ensure_ascii=False))
+
+class ResultCache:
+    """Thread-safe LRU cache bounded by total (estimated) bytes
+
+    Args:
+        max_bytes: Total budget; 0 disables caching
+        max_entry_bytes: Results larger than this are never cached
+            (defaults to a quarter of ``max_bytes``)
+    """
+
+    def __init__(self, max_bytes=32 * 1024 * 1024, max_entry_bytes=None):
+        self.max_bytes = max(0, int(max_bytes))
+        self.max_entry_bytes = max_entry_bytes if max_entry_bytes is not None else self.max_bytes // 4
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """Return the cached value for ``key`` or None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value, size=None):
+        """Store ``value`` under ``key``, evicting old entries as needed"""
+        if not self.max_bytes:
+            return
+        if size is None:
+            size = estimate_size(value)
+        if size > self.max_entry_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+            self._entries[key] = (value, size)
+            self._bytes += size
+            while self._bytes > self.max_bytes and self._entries:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+
+    def clear(self):
+        """Drop every entry"""
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        """Return a snapshot of cache usage"""
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
@@ -5,22 +5,30 @@ into a local SQLite database with proper indexing and FTS support.
 """
 
 import sqlite3
-try:
-    from lxml import etree as ET
-except ImportError:
-    import xml.etree.ElementTree as ET
+import os
 from pathlib import Path
 import urllib.request
-import io
+import urllib.error
+import hashlib
 import re
 import json
 import tempfile
 import time
-from database import SCHEMA_SQL
+import shutil
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+from database import TABLES_SQL, INDEXES_SQL, INSERT_SQL, BULK_LOAD_PRAGMAS, PRIMARY_KEYS
+from matrix import NutrientMatrix, dataset_stamp, matrix_path
+from refresh import checked_recently, record_update_check
+from artifact import find_artifact, install_artifact
+from search import index_consistent
 
 ZENODO_CONCEPT_RECORD = "17550132"
 ZENODO_API_URL = f"https://zenodo.org/api/records/{ZENODO_CONCEPT_RECORD}/versions/latest"
 
+# Bytes per read when streaming downloads to disk
+DOWNLOAD_CHUNK = 1024 * 1024
+
 # File prefix patterns for matching Zenodo files
 FILE_PREFIXES = {
     "alim": "alim_",
@@ -98,7 +106,7 @@ def _fetch_zenodo_metadata():
     """Fetch latest version metadata from Zenodo API.
 
     Returns:
-        dict with keys: record_id, version, files (list of {name, download_url})
+        dict with keys: record_id, version, files (list of {name, download_url, checksum})
     """
     req = urllib.request.Request(ZENODO_API_URL)
     req.add_header("Accept", "application/json")
@@ -109,7 +117,7 @@ def _fetch_zenodo_metadata():
     for f in data.get("files", []):
         name = f.get("key", "")
         download_url = f.get("links", {}).get("self", "")
-        files.append({"name": name, "download_url": download_url})
+        files.append({"name": name, "download_url": download_url, "checksum": f.get("checksum")})
 
     return {
         "record_id": str(data["id"]),
@@ -128,32 +136,432 @@ def _find_file(files, prefix):
             return f
     return None
 
-def _download_xml(url):
-    """Download and parse an XML file from a URL.
+class _ControlCharFilter:
+    """File-like wrapper dropping ASCII control characters (except tab/CR/LF)
 
-    Tries UTF-8 first, falls back to windows-1252.
-    Returns the root element.
+    Used with the stdlib parser, which unlike lxml cannot recover from them.
+    The filtered bytes are the same in UTF-8 and windows-1252.
     """
-    with urllib.request.urlopen(url) as response:
-        raw = response.read()
 
-    # Try UTF-8 first, fallback to windows-1252
-    for encoding in ("utf-8", "windows-1252"):
-        try:
-            try:
-                from lxml import etree
-                parser = etree.XMLParser(encoding=encoding, recover=True)
-                root = etree.fromstring(raw, parser)
-                return root
-            except ImportError:
-                content = raw.decode(encoding, errors="ignore")
-                # Remove control characters except tab, newline, carriage return
-                content = re.sub(r'[\x00-\x08\x0B\x0C\x0E-\x1F\x7F]', '', content)
-                return ET.fromstring(content)
-        except Exception:
+    _CONTROL = bytes(c for c in range(32) if c not in (9, 10, 13)) + b"\x7f"
+
+    def __init__(self, stream):
+        self._stream = stream
+
+    def read(self, size=-1):
+        return self._stream.read(size).translate(None, self._CONTROL)
+
+def iter_xml_elements(source, tag):
+    """Incrementally parse ``tag`` elements from an XML byte stream
+
+    Args:
+        source: Binary file-like object (e.g. an HTTP response)
+        tag: Record element name, e.g. 'COMPO'
+
+    Yields:
+        Each complete ``tag`` element. Elements are cleared once the caller
+        moves on, so memory stays bounded regardless of file size.
+
+    Note:
+        Decoding follows the XML declaration (CIQUAL files declare
+        windows-1252 or UTF-8).
+    """
+    try:
+        from lxml import etree
+    except ImportError:
+        etree = None
+
+    if etree is not None:
+        context = etree.iterparse(source, events=("end",), tag=tag, recover=True, huge_tree=True)
+        for _, elem in context:
+            yield elem
+            elem.clear()
+            # Drop already-processed siblings still referenced by the parent
+            while elem.getprevious() is not None:
+                del elem.getparent()[0]
+        del context
+        return
+
+    import xml.etree.ElementTree as ET
+    root = None
+    for event, elem in ET.iterparse(_ControlCharFilter(source), events=("start", "end")):
+        if event == "start":
+            if root is None:
+                root = elem
             continue
+        if elem.tag == tag:
+            yield elem
+            root.clear()
+
+def file_md5(path):
+    """Hex MD5 digest of a file, read in chunks"""
+    digest = hashlib.md5()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(DOWNLOAD_CHUNK), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def _download_file(url, dest, etag=None):
+    """Stream a URL to ``dest`` (written to a temp name, then renamed)
+
+    Args:
+        url: File URL
+        dest: Destination path
+        etag: ETag of the copy already at ``dest``; sent as If-None-Match so
+            an unchanged file is answered with 304 and not transferred again
+
+    Returns:
+        Path of the downloaded (or still valid) file. The response ETag, if
+        any, is stored next to it in ``<dest>.etag``.
+    """
+    dest = Path(dest)
+    request = urllib.request.Request(url)
+    if etag and dest.exists():
+        request.add_header("If-None-Match", etag)
+    # Unique temp name: concurrent loaders may fetch into the same cache
+    out = tempfile.NamedTemporaryFile(dir=dest.parent, prefix=f".{dest.name}.", suffix=".part", delete=False)
+    try:
+        with out, urllib.request.urlopen(request) as response:
+            shutil.copyfileobj(response, out, DOWNLOAD_CHUNK)
+            new_etag = response.headers.get("ETag")
+        os.replace(out.name, dest)
+    except urllib.error.HTTPError as e:
+        os.unlink(out.name)
+        if e.code == 304:
+            return dest
+        raise
+    except BaseException:
+        os.unlink(out.name)
+        raise
+    if new_etag:
+        Path(f"{dest}.etag").write_text(new_etag)
+    return dest
+
+def _cache_path(f, cache_dir):
+    """Cache location of a Zenodo file
+
+    Files with a known checksum are content-addressed
+    (``cache/md5-<hex>/<name>``); others are keyed by name and revalidated
+    with their ETag.
+    """
+    checksum = f.get("checksum")
+    if checksum and ":" in checksum:
+        algorithm, value = checksum.split(":", 1)
+        return cache_dir / f"{algorithm}-{value}" / f["name"]
+    return cache_dir / f["name"]
+
+def _fetch_cached(f, cache_dir):
+    """Return a local copy of a Zenodo file, downloading only when needed
+
+    Raises:
+        Exception: If the downloaded file does not match the published checksum
+    """
+    if f.get("path"):
+        return Path(f["path"])
+
+    path = _cache_path(f, cache_dir)
+    checksum = f.get("checksum") or ""
+    expected_md5 = checksum[4:] if checksum.startswith("md5:") else None
+
+    etag_file = Path(f"{path}.etag")
+    if expected_md5 and path.exists():
+        if file_md5(path) == expected_md5:
+            print(f"Using cached {f['name']}")
+            return path
+        # Corrupt copy: drop its ETag too, or the server would answer 304 and keep it
+        path.unlink()
+        etag_file.unlink(missing_ok=True)
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    etag = etag_file.read_text().strip() if etag_file.exists() else None
+    path = _download_file(f["download_url"], path, etag=etag)
+
+    if expected_md5:
+        actual = file_md5(path)
+        if actual != expected_md5:
+            path.unlink()
+            etag_file.unlink(missing_ok=True)
+            raise Exception(f"Checksum mismatch for {f['name']}: expected {expected_md5}, got {actual}")
+    return path
+
+def _iter_xml_file(path, tag):
+    """Yield ``tag`` elements from a local XML file."""
+    with open(path, "rb") as f:
+        yield from iter_xml_elements(f, tag)
+
+def nutrient_rows(elements):
+    """Yield nutrients table rows from CONST elements"""
+    for const in elements:
+        const_code = clean_text(_get_element_text(const, "const_code"))
+        const_nom_fr = _get_element_text(const, "const_nom_fr")
+        const_nom_eng = _get_element_text(const, "const_nom_eng")
+        code_infoods = clean_text(_get_element_text(const, "code_INFOODS"))
+
+        if const_code:
+            unit = extract_unit(const_nom_fr) or extract_unit(const_nom_eng)
+            yield (int(const_code), const_nom_fr, const_nom_eng, unit, code_infoods)
+
+def food_group_rows(elements):
+    """Yield food_groups table rows from ALIM_GRP elements"""
+    for grp in elements:
+        alim_grp_code = clean_text(_get_element_text(grp, "alim_grp_code"))
+        alim_grp_nom_fr = _get_element_text(grp, "alim_grp_nom_fr")
+        alim_grp_nom_eng = _get_element_text(grp, "alim_grp_nom_eng")
+        alim_ssgrp_code = clean_text(_get_element_text(grp, "alim_ssgrp_code"))
+        alim_ssgrp_nom_fr = _get_element_text(grp, "alim_ssgrp_nom_fr")
+        alim_ssgrp_nom_eng = _get_element_text(grp, "alim_ssgrp_nom_eng")
+        alim_ssssgrp_code = clean_text(_get_element_text(grp, "alim_ssssgrp_code"))
+        alim_ssssgrp_nom_fr = _get_element_text(grp, "alim_ssssgrp_nom_fr")
+        alim_ssssgrp_nom_eng = _get_element_text(grp, "alim_ssssgrp_nom_eng")
+
+        if alim_grp_code:
+            yield (alim_grp_code, alim_grp_nom_fr, alim_grp_nom_eng,
+                   alim_ssgrp_code or "", alim_ssgrp_nom_fr, alim_ssgrp_nom_eng,
+                   alim_ssssgrp_code or "", alim_ssssgrp_nom_fr, alim_ssssgrp_nom_eng)
+
+def source_rows(elements):
+    """Yield sources table rows from SOURCE elements"""
+    for src in elements:
+        source_code = clean_text(_get_element_text(src, "source_code"))
+        ref_citation = _get_element_text(src, "ref_citation")
+
+        if source_code:
+            yield (int(source_code), ref_citation)
+
+def food_rows(elements):
+    """Yield foods table rows from ALIM elements"""
+    for alim in elements:
+        alim_code = clean_text(_get_element_text(alim, "alim_code"))
+        alim_nom_fr = _get_element_text(alim, "alim_nom_fr")
+        alim_nom_eng = _get_element_text(alim, "alim_nom_eng")
+        alim_grp_code = clean_text(_get_element_text(alim, "alim_grp_code"))
+        alim_nom_sci = _get_element_text(alim, "alim_nom_sci")
+        alim_ssgrp_code = clean_text(_get_element_text(alim, "alim_ssgrp_code"))
+        alim_ssssgrp_code = clean_text(_get_element_text(alim, "alim_ssssgrp_code"))
+        facteur_jones = parse_number(_get_element_text(alim, "facteur_Jones"))
+
+        if alim_code:
+            yield (int(alim_code), alim_nom_fr, alim_nom_eng, alim_grp_code,
+                   alim_nom_sci, alim_ssgrp_code, alim_ssssgrp_code, facteur_jones)
+
+def composition_rows(elements):
+    """Yield composition table rows from COMPO elements
+
+    Rows without a numeric teneur are skipped.
+    """
+    for compo in elements:
+        alim_code = clean_text(_get_element_text(compo, "alim_code"))
+        const_code = clean_text(_get_element_text(compo, "const_code"))
+        teneur = _get_element_text(compo, "teneur")
+        code_confiance = clean_text(_get_element_text(compo, "code_confiance"))
+        min_val = parse_number(_get_element_text(compo, "min"))
+        max_val = parse_number(_get_element_text(compo, "max"))
+        source_code_val = clean_text(_get_element_text(compo, "source_code"))
+
+        if alim_code and const_code:
+            teneur_value = parse_number(teneur)
+            if teneur_value is not None:
+                sc = int(source_code_val) if source_code_val else None
+                yield (int(alim_code), int(const_code), teneur_value,
+                       code_confiance, min_val, max_val, sc)
+
+# Zenodo files to import: (file prefix, record tag, table, row parser, required)
+XML_FILES = (
+    ("const_", "CONST", "nutrients", nutrient_rows, True),
+    ("alim_grp_", "ALIM_GRP", "food_groups", food_group_rows, False),
+    ("sources_", "SOURCE", "sources", source_rows, False),
+    ("alim_", "ALIM", "foods", food_rows, True),
+    ("compo_", "COMPO", "composition", composition_rows, True),
+)
+
+def _select_xml_files(files):
+    """Match Zenodo files to the tables they load
+
+    Returns:
+        List of (file, tag, table, row parser) for every file present
+
+    Raises:
+        Exception: If a required file is missing
+    """
+    selected = []
+    for prefix, tag, table, parse_rows, required in XML_FILES:
+        f = _find_file(files, prefix)
+        if f is None:
+            if required:
+                raise Exception("Required XML files not found in Zenodo record")
+            continue
+        selected.append((f, tag, table, parse_rows))
+    return selected
+
+def _load_tables(conn, selected, cache_dir, timings):
+    """Fetch all XML files concurrently and load each as soon as it lands
+
+    Tables have no enforced foreign keys, so they are loaded in arrival
+    order; the next download keeps running while a file is being parsed.
+    Files already in the cache (or given as local paths) are not downloaded.
+    """
+    cursor = conn.cursor()
+    with ThreadPoolExecutor(max_workers=len(selected), thread_name_prefix="ciqual-download") as pool:
+        futures = {
+            pool.submit(_fetch_cached, f, cache_dir): (f, tag, table, parse_rows)
+            for f, tag, table, parse_rows in selected
+        }
+        try:
+            for future in as_completed(futures):
+                f, tag, table, parse_rows = futures[future]
+                path = future.result()
+                with _phase(timings, table, f"Loading {table} from {f['name']}..."):
+                    cursor.executemany(INSERT_SQL[table], parse_rows(_iter_xml_file(path, tag)))
+                print(f"Loaded {cursor.rowcount} {table} rows")
+        except BaseException:
+            for future in futures:
+                future.cancel()
+            raise
+
+# Columns indexed by foods_fts; only foods whose values change here are reindexed
+FTS_COLUMNS = ("alim_code", "alim_nom_fr", "alim_nom_eng", "alim_nom_sci")
+
+def _table_columns(conn, table, schema="main"):
+    return [row[1] for row in conn.execute(f"PRAGMA {schema}.table_info({table})")]
+
+def _can_apply_delta(db_path):
+    """Check that the live database holds a dataset with the current schema
+
+    Returns:
+        True if a new release can be applied to it as a delta: same table
+        columns, a recorded zenodo_record_id and a consistent FTS index
+    """
+    if not db_path.exists():
+        return False
+    reference = sqlite3.connect(":memory:")
+    try:
+        reference.executescript(TABLES_SQL)
+        conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+        try:
+            for table in PRIMARY_KEYS:
+                if _table_columns(conn, table) != _table_columns(reference, table):
+                    return False
+            row = conn.execute("SELECT value FROM metadata WHERE key = 'zenodo_record_id'").fetchone()
+            if row is None:
+                return False
+        finally:
+            conn.close()
+        # The delta reindexes foods by alim_code rowid, which older or corrupt
+        # indexes do not use; those databases get a full rebuild instead.
+        # (FTS5's integrity-check needs a writable connection; it writes nothing.)
+        conn = sqlite3.connect(db_path)
+        try:
+            return index_consistent(conn)
+        finally:
+            conn.close()
+    except sqlite3.Error:
+        return False
+    finally:
+        reference.close()
 
-    raise ValueError("Failed to parse XML with both UTF-8 and windows-1252 encodings")
+def _apply_delta(conn, selected, cache_dir, timings):
+    """Bring the tables in ``conn`` up to date with a new release
+
+    The XML files are loaded into a separate staging database, which is then
+    diffed against the current tables by primary key and full row value.
+    Only the rows that differ are deleted, inserted or replaced, in a single
+    transaction, and only the FTS entries of foods whose indexed columns
+    changed are rewritten.
+
+    Args:
+        conn: Connection to a copy of the current database
+        selected: Files to load, as returned by ``_select_xml_files``
+        cache_dir: Download cache directory
+        timings: Dict receiving phase durations
+
+    Returns:
+        Dict mapping each table to its {"inserted", "updated", "deleted"} counts
+    """
+    fd, stage_name = tempfile.mkstemp(prefix=".ciqual-stage-", suffix=".db", dir=cache_dir)
+    os.close(fd)
+    stage = sqlite3.connect(stage_name)
+    try:
+        for pragma in BULK_LOAD_PRAGMAS:
+            stage.execute(pragma)
+        stage.executescript(TABLES_SQL)
+        with _phase(timings, "download_and_load", "Downloading XML files..."):
+            _load_tables(stage, selected, cache_dir, timings)
+        stage.commit()
+        stage.close()
+
+        conn.execute("ATTACH DATABASE ? AS stage", (stage_name,))
+        delta = {}
+        with _phase(timings, "delta", "Applying changes..."):
+            conn.execute("BEGIN")
+            fts_columns = ", ".join(FTS_COLUMNS)
+            if any(table == "foods" for _, _, table, _ in selected):
+                # Foods removed or with changed names; their old FTS entries must
+                # be deleted with the old values, before the rows change
+                conn.execute(f"""
+                    CREATE TEMP TABLE fts_affected AS
+                    SELECT alim_code FROM (
+                        SELECT {fts_columns} FROM main.foods
+                        EXCEPT SELECT {fts_columns} FROM stage.foods
+                    )
+                    UNION SELECT alim_code FROM (
+                        SELECT {fts_columns} FROM stage.foods
+                        EXCEPT SELECT {fts_columns} FROM main.foods
+                    )
+                """)
+                conn.execute(f"""
+                    INSERT INTO foods_fts(foods_fts, rowid, {fts_columns})
+                    SELECT 'delete', alim_code, {fts_columns} FROM main.foods
+                    WHERE alim_code IN (SELECT alim_code FROM fts_affected)
+                """)
+
+            for _, _, table, _ in selected:
+                match = " AND ".join(f"s.{c} IS m.{c}" for c in PRIMARY_KEYS[table])
+                conn.execute(f"""
+                    CREATE TEMP TABLE delta_{table} AS
+                    SELECT * FROM stage.{table} EXCEPT SELECT * FROM main.{table}
+                """)
+                changed = conn.execute(f"SELECT COUNT(*) FROM delta_{table}").fetchone()[0]
+                updated = conn.execute(f"""
+                    SELECT COUNT(*) FROM delta_{table} s
+                    WHERE EXISTS (SELECT 1 FROM main.{table} m WHERE {match})
+                """).fetchone()[0]
+                deleted = conn.execute(f"""
+                    DELETE FROM main.{table} AS m
+                    WHERE NOT EXISTS (SELECT 1 FROM stage.{table} s WHERE {match})
+                """).rowcount
+                # Delete-then-insert instead of REPLACE: food_groups keys may contain NULLs
+                conn.execute(f"""
+                    DELETE FROM main.{table} AS m
+                    WHERE EXISTS (SELECT 1 FROM delta_{table} s WHERE {match})
+                """)
+                conn.execute(f"INSERT INTO main.{table} SELECT * FROM delta_{table}")
+                conn.execute(f"DROP TABLE delta_{table}")
+                delta[table] = {"inserted": changed - updated, "updated": updated, "deleted": deleted}
+
+            if any(table == "foods" for _, _, table, _ in selected):
+                conn.execute(f"""
+                    INSERT INTO foods_fts(rowid, {fts_columns})
+                    SELECT alim_code, {fts_columns} FROM main.foods
+                    WHERE alim_code IN (SELECT alim_code FROM fts_affected)
+                """)
+                delta["foods_fts"] = conn.execute("SELECT COUNT(*) FROM fts_affected").fetchone()[0]
+                conn.execute("DROP TABLE fts_affected")
+            conn.commit()
+        conn.execute("DETACH DATABASE stage")
+        return delta
+    finally:
+        stage.close()
+        _remove_file(stage_name)
+
+@contextmanager
+def _phase(timings, name, message):
+    """Print ``message`` and record the wall-clock duration of a load phase"""
+    print(message)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[name] = round(time.perf_counter() - start, 3)
 
 def should_update_database(db_path):
     """Check if database needs updating by comparing Zenodo record IDs.
@@ -177,15 +585,10 @@ def should_update_database(db_path):
             conn.close()
             return True
 
-        # Check last update check timestamp (skip API call if checked recently)
-        cursor.execute("SELECT value FROM metadata WHERE key = 'last_update_check'")
-        row = cursor.fetchone()
-        if row:
-            last_check = float(row[0])
-            days_since_check = (time.time() - last_check) / (24 * 3600)
-            if days_since_check < 30:
-                conn.close()
-                return False
+        # Skip API call if checked recently
+        if checked_recently(db_path):
+            conn.close()
+            return False
 
         # Get stored record ID
         cursor.execute("SELECT value FROM metadata WHERE key = 'zenodo_record_id'")
@@ -197,14 +600,8 @@ def should_update_database(db_path):
         metadata = _fetch_zenodo_metadata()
         latest_record_id = metadata["record_id"]
 
-        # Update last check timestamp
-        conn = sqlite3.connect(db_path)
-        conn.execute(
-            "INSERT OR REPLACE INTO metadata (key, value) VALUES ('last_update_check', ?)",
-            (str(time.time()),)
-        )
-        conn.commit()
-        conn.close()
+        # Update last check timestamp (next to, not inside, the live database)
+        record_update_check(db_path)
 
         return stored_record_id != latest_record_id
 
@@ -212,195 +609,156 @@ def should_update_database(db_path):
         # If anything fails, trigger an update
         return True
 
-def initialize_database(force_update=False):
+def _verify_database(conn):
+    """Run integrity checks on a freshly built database before it is swapped in
+
+    Raises:
+        Exception: If SQLite or the FTS5 index reports a problem
+    """
+    result = conn.execute("PRAGMA integrity_check").fetchall()
+    if result != [("ok",)]:
+        raise Exception(f"Database integrity check failed: {result[:5]}")
+    # Raises sqlite3.DatabaseError if the index does not match the foods table
+    conn.execute("INSERT INTO foods_fts(foods_fts, rank) VALUES ('integrity-check', 1)")
+
+def _remove_file(path):
+    """Delete a file if it exists, ignoring errors"""
+    try:
+        Path(path).unlink()
+    except OSError:
+        pass
+
+def _local_source_metadata(source_dir):
+    """Describe a directory of CIQUAL XML files like a Zenodo record
+
+    The record id is derived from the file contents, so re-importing the
+    same files yields the same id.
+    """
+    source_dir = Path(source_dir)
+    paths = sorted(source_dir.glob("*.xml"))
+    if not paths:
+        raise Exception(f"No XML files found in {source_dir}")
+    digest = hashlib.md5()
+    files = []
+    for path in paths:
+        md5 = file_md5(path)
+        digest.update(f"{path.name}:{md5}\n".encode("utf-8"))
+        files.append({"name": path.name, "path": str(path), "checksum": f"md5:{md5}"})
+    return {
+        "record_id": f"local-{digest.hexdigest()[:12]}",
+        "version": "local",
+        "files": files,
+    }
+
+def initialize_database(force_update=False, db_path=None, source_dir=None, incremental=True, artifact=None):
     """Download and import Ciqual data from Zenodo into SQLite database
 
     Args:
         force_update: Force database update even if cache is valid
+        db_path: Target database file (defaults to ~/.ciqual/ciqual.db)
+        source_dir: Import from local CIQUAL XML files in this directory
+            instead of Zenodo (offline/air-gapped installs); implies a rebuild
+        incremental: Apply a new release as a delta against the existing
+            database when its schema is current (False forces a full rebuild)
+        artifact: Install this prebuilt artifact (manifest file or directory)
+            instead of importing XML. On first run, an artifact named by
+            CIQUAL_ARTIFACT is used automatically.
 
     Raises:
         Exception: If data download or import fails and no existing database
 
     Note:
         Creates database at ~/.ciqual/ciqual.db
-        Downloads XML data from Zenodo (CIQUAL 2024 dataset)
+        Downloads XML data from Zenodo (CIQUAL 2024 dataset) into a
+        checksum-addressed cache under ~/.ciqual/cache/, so unchanged files
+        are never downloaded twice
+        The data is imported into a temporary file in the same directory,
+        checked, then atomically renamed over the live database, so running
+        servers never see a half-built database. For an update, that file
+        starts as a copy of the live database and only the changed rows are
+        written; the per-table delta is stored in metadata 'last_delta'.
     """
 
     # Setup paths
-    db_path = Path.home() / ".ciqual" / "ciqual.db"
+    db_path = Path(db_path) if db_path else Path.home() / ".ciqual" / "ciqual.db"
     db_path.parent.mkdir(parents=True, exist_ok=True)
 
+    # Prebuilt artifact: explicit, or the environment's one on first run
+    manifest_path = None
+    if artifact:
+        manifest_path = find_artifact(artifact)
+        if manifest_path is None:
+            raise Exception(f"No artifact manifest found at {artifact}")
+    elif not source_dir and not db_path.exists():
+        manifest_path = find_artifact()
+    if manifest_path:
+        print(f"Installing prebuilt database from {manifest_path}...")
+        start = time.perf_counter()
+        manifest = install_artifact(manifest_path, db_path)
+        print(f"Installed CIQUAL record {manifest['record_id']} in {time.perf_counter() - start:.2f}s")
+        return
+
     # Check if update is needed
-    if not force_update and db_path.exists() and not should_update_database(db_path):
+    if not source_dir and not force_update and db_path.exists() and not should_update_database(db_path):
         print("Database is up to date")
         return
 
-    print("Fetching CIQUAL data metadata from Zenodo...")
-    zenodo_meta = _fetch_zenodo_metadata()
-    files = zenodo_meta["files"]
+    if source_dir:
+        print(f"Importing CIQUAL XML files from {source_dir}...")
+        zenodo_meta = _local_source_metadata(source_dir)
+    else:
+        print("Fetching CIQUAL data metadata from Zenodo...")
+        zenodo_meta = _fetch_zenodo_metadata()
 
-    # Find required XML files
-    alim_file = _find_file(files, "alim_")
-    const_file = _find_file(files, "const_")
-    compo_file = _find_file(files, "compo_")
-    grp_file = _find_file(files, "alim_grp_")
-    sources_file = _find_file(files, "sources_")
+    selected = _select_xml_files(zenodo_meta["files"])
+    incremental = incremental and _can_apply_delta(db_path)
+    cache_dir = db_path.parent / "cache"
+    cache_dir.mkdir(exist_ok=True)
 
-    if not alim_file or not const_file or not compo_file:
-        raise Exception("Required XML files not found in Zenodo record")
+    # Build into a temporary database next to the live one (same filesystem)
+    fd, tmp_name = tempfile.mkstemp(prefix=".ciqual-", suffix=".db", dir=db_path.parent)
+    os.close(fd)
+    tmp_path = Path(tmp_name)
+    conn = sqlite3.connect(tmp_path)
+    swapped = False
 
-    # Connect to database
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
+    timings = {}
 
     try:
-        # Drop old tables for clean reimport
-        print("Creating database schema...")
-        conn.executescript("""
-            DROP TABLE IF EXISTS foods_fts;
-            DROP TABLE IF EXISTS composition;
-            DROP TABLE IF EXISTS foods;
-            DROP TABLE IF EXISTS nutrients;
-            DROP TABLE IF EXISTS food_groups;
-            DROP TABLE IF EXISTS sources;
-        """)
-        conn.executescript(SCHEMA_SQL)
-
-        # Load nutrients
-        print("Downloading and loading nutrients...")
-        root = _download_xml(const_file["download_url"])
-
-        for const in root.findall("CONST"):
-            const_code = clean_text(_get_element_text(const, "const_code"))
-            const_nom_fr = _get_element_text(const, "const_nom_fr")
-            const_nom_eng = _get_element_text(const, "const_nom_eng")
-            code_infoods = clean_text(_get_element_text(const, "code_INFOODS"))
-
-            if const_code:
-                unit = extract_unit(const_nom_fr) or extract_unit(const_nom_eng)
-                cursor.execute(
-                    "INSERT OR REPLACE INTO nutrients (const_code, const_nom_fr, const_nom_eng, unit, code_infoods) VALUES (?, ?, ?, ?, ?)",
-                    (int(const_code), const_nom_fr, const_nom_eng, unit, code_infoods)
-                )
-
-        # Load food groups
-        if grp_file:
-            print("Downloading and loading food groups...")
-            root = _download_xml(grp_file["download_url"])
-
-            for grp in root.findall("ALIM_GRP"):
-                alim_grp_code = clean_text(_get_element_text(grp, "alim_grp_code"))
-                alim_grp_nom_fr = _get_element_text(grp, "alim_grp_nom_fr")
-                alim_grp_nom_eng = _get_element_text(grp, "alim_grp_nom_eng")
-                alim_ssgrp_code = clean_text(_get_element_text(grp, "alim_ssgrp_code"))
-                alim_ssgrp_nom_fr = _get_element_text(grp, "alim_ssgrp_nom_fr")
-                alim_ssgrp_nom_eng = _get_element_text(grp, "alim_ssgrp_nom_eng")
-                alim_ssssgrp_code = clean_text(_get_element_text(grp, "alim_ssssgrp_code"))
-                alim_ssssgrp_nom_fr = _get_element_text(grp, "alim_ssssgrp_nom_fr")
-                alim_ssssgrp_nom_eng = _get_element_text(grp, "alim_ssssgrp_nom_eng")
-
-                if alim_grp_code:
-                    cursor.execute(
-                        """INSERT OR REPLACE INTO food_groups
-                        (alim_grp_code, alim_grp_nom_fr, alim_grp_nom_eng,
-                         alim_ssgrp_code, alim_ssgrp_nom_fr, alim_ssgrp_nom_eng,
-                         alim_ssssgrp_code, alim_ssssgrp_nom_fr, alim_ssssgrp_nom_eng)
-                        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)""",
-                        (alim_grp_code, alim_grp_nom_fr, alim_grp_nom_eng,
-                         alim_ssgrp_code or "", alim_ssgrp_nom_fr, alim_ssgrp_nom_eng,
-                         alim_ssssgrp_code or "", alim_ssssgrp_nom_fr, alim_ssssgrp_nom_eng)
-                    )
-
-        # Load sources
-        if sources_file:
-            print("Downloading and loading sources...")
-            root = _download_xml(sources_file["download_url"])
-
-            for src in root.findall("SOURCE"):
-                source_code = clean_text(_get_element_text(src, "source_code"))
-                ref_citation = _get_element_text(src, "ref_citation")
-
-                if source_code:
-                    cursor.execute(
-                        "INSERT OR REPLACE INTO sources (source_code, ref_citation) VALUES (?, ?)",
-                        (int(source_code), ref_citation)
-                    )
-
-        # Load foods
-        print("Downloading and loading foods...")
-        root = _download_xml(alim_file["download_url"])
-
-        food_count = 0
-        for alim in root.findall("ALIM"):
-            alim_code = clean_text(_get_element_text(alim, "alim_code"))
-            alim_nom_fr = _get_element_text(alim, "alim_nom_fr")
-            alim_nom_eng = _get_element_text(alim, "alim_nom_eng")
-            alim_grp_code = clean_text(_get_element_text(alim, "alim_grp_code"))
-            alim_nom_sci = _get_element_text(alim, "alim_nom_sci")
-            alim_ssgrp_code = clean_text(_get_element_text(alim, "alim_ssgrp_code"))
-            alim_ssssgrp_code = clean_text(_get_element_text(alim, "alim_ssssgrp_code"))
-            facteur_jones = parse_number(_get_element_text(alim, "facteur_Jones"))
-
-            if alim_code:
-                cursor.execute(
-                    """INSERT OR REPLACE INTO foods
-                    (alim_code, alim_nom_fr, alim_nom_eng, alim_grp_code,
-                     alim_nom_sci, alim_ssgrp_code, alim_ssssgrp_code, facteur_Jones)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)""",
-                    (int(alim_code), alim_nom_fr, alim_nom_eng, alim_grp_code,
-                     alim_nom_sci, alim_ssgrp_code, alim_ssssgrp_code, facteur_jones)
-                )
-                food_count += 1
-
-        print(f"Loaded {food_count} foods")
-
-        # Load composition data
-        print("Downloading and loading nutritional composition data (this may take a minute)...")
-        root = _download_xml(compo_file["download_url"])
-
-        compo_count = 0
-        batch = []
-        for compo in root.findall("COMPO"):
-            alim_code = clean_text(_get_element_text(compo, "alim_code"))
-            const_code = clean_text(_get_element_text(compo, "const_code"))
-            teneur = _get_element_text(compo, "teneur")
-            code_confiance = clean_text(_get_element_text(compo, "code_confiance"))
-            min_val = parse_number(_get_element_text(compo, "min"))
-            max_val = parse_number(_get_element_text(compo, "max"))
-            source_code_val = clean_text(_get_element_text(compo, "source_code"))
-
-            if alim_code and const_code:
-                teneur_value = parse_number(teneur)
-                if teneur_value is not None:
-                    sc = int(source_code_val) if source_code_val else None
-                    batch.append((int(alim_code), int(const_code), teneur_value,
-                                  code_confiance, min_val, max_val, sc))
-
-                    if len(batch) >= 1000:
-                        cursor.executemany(
-                            "INSERT OR REPLACE INTO composition (alim_code, const_code, teneur, code_confiance, min, max, source_code) VALUES (?, ?, ?, ?, ?, ?, ?)",
-                            batch
-                        )
-                        compo_count += len(batch)
-                        batch = []
-
-        # Insert remaining batch
-        if batch:
-            cursor.executemany(
-                "INSERT OR REPLACE INTO composition (alim_code, const_code, teneur, code_confiance, min, max, source_code) VALUES (?, ?, ?, ?, ?, ?, ?)",
-                batch
+        for pragma in BULK_LOAD_PRAGMAS:
+            conn.execute(pragma)
+
+        if incremental:
+            with _phase(timings, "copy", "Copying current database..."):
+                live = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+                try:
+                    live.backup(conn)
+                finally:
+                    live.close()
+
+            delta = _apply_delta(conn, selected, cache_dir, timings)
+            conn.execute(
+                "INSERT OR REPLACE INTO metadata (key, value) VALUES ('last_delta', ?)",
+                (json.dumps(delta),)
             )
-            compo_count += len(batch)
+            print("Delta: " + ", ".join(
+                f"{table} +{d['inserted']} ~{d['updated']} -{d['deleted']}"
+                for table, d in delta.items() if isinstance(d, dict)
+            ))
+        else:
+            with _phase(timings, "schema", "Creating database schema..."):
+                conn.executescript(TABLES_SQL)
 
-        print(f"Loaded {compo_count} nutritional values")
+            with _phase(timings, "download_and_load", "Downloading XML files..."):
+                _load_tables(conn, selected, cache_dir, timings)
 
-        # Populate FTS table
-        print("Building full-text search index...")
-        try:
-            conn.execute("DELETE FROM foods_fts")
-        except Exception:
-            pass  # Table might not exist or be empty
-        conn.execute("INSERT INTO foods_fts SELECT alim_code, alim_nom_fr, alim_nom_eng, alim_nom_sci FROM foods")
+            # Indexes are built once over the loaded data rather than per insert
+            with _phase(timings, "indexes", "Creating indexes..."):
+                conn.executescript(INDEXES_SQL)
+
+            with _phase(timings, "fts", "Building full-text search index..."):
+                # 'rebuild' indexes foods by rowid (= alim_code), as the external content table expects
+                conn.execute("INSERT INTO foods_fts(foods_fts) VALUES ('rebuild')")
 
         # Store version metadata
         conn.execute(
@@ -419,6 +777,10 @@ def initialize_database(force_update=False):
             "INSERT OR REPLACE INTO metadata (key, value) VALUES ('last_update_check', ?)",
             (str(time.time()),)
         )
+        conn.execute(
+            "INSERT OR REPLACE INTO metadata (key, value) VALUES ('import_timings', ?)",
+            (json.dumps(timings),)
+        )
 
         # Commit and verify
         conn.commit()
@@ -435,11 +797,46 @@ def initialize_database(force_update=False):
         if food_count == 0:
             raise Exception("No data was loaded into the database")
 
+        with _phase(timings, "verify", "Verifying database integrity..."):
+            _verify_database(conn)
+        matrix = NutrientMatrix.from_connection(conn)
+        stamp = dataset_stamp(conn)
+        conn.close()
+
+        # Atomic swap: readers see either the old or the new file, never a mix
+        os.replace(tmp_path, db_path)
+        swapped = True
+        print(f"Database swapped into {db_path}")
+
+        # Prebuilt matrix sidecar, mapped read-only by server processes
+        with _phase(timings, "matrix", "Writing nutrient matrix sidecar..."):
+            matrix.save(matrix_path(db_path), stamp)
+
+        print("Import timings: " + ", ".join(f"{k} {v:.2f}s" for k, v in timings.items()))
+
     except Exception as e:
-        conn.rollback()
+        try:
+            conn.rollback()
+        except sqlite3.Error:
+            pass  # Connection already closed after the build completed
         raise e
     finally:
         conn.close()
+        if not swapped:
+            _remove_file(tmp_path)
+            _remove_file(f"{tmp_path}-journal")
+
+def main(argv=None):
+    """Command line entry point: ``python data_loader.py [SOURCE_DIR]``"""
+    import argparse
+    parser = argparse.ArgumentParser(description="Download and import the CIQUAL database")
+    parser.add_argument("source_dir", nargs="?", help="directory of CIQUAL XML files for an offline import")
+    parser.add_argument("--db-path", help="target database file (default ~/.ciqual/ciqual.db)")
+    parser.add_argument("--force", action="store_true", help="skip the Zenodo version check")
+    parser.add_argument("--artifact", help="install a prebuilt artifact (manifest file or directory)")
+    args = parser.parse_args(argv)
+    initialize_database(force_update=args.force, db_path=args.db_path, source_dir=args.source_dir,
+                        artifact=args.artifact)
 
 if __name__ == "__main__":
-    initialize_database()
+    main()
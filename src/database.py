@@ -1,6 +1,6 @@
 """SQLite database schema for Ciqual data"""
 
-SCHEMA_SQL = """
+TABLES_SQL = """
 -- Core tables
 CREATE TABLE IF NOT EXISTS foods (
     alim_code INTEGER PRIMARY KEY,
@@ -66,7 +66,10 @@ CREATE VIRTUAL TABLE IF NOT EXISTS foods_fts USING fts5(
     content=foods,
     tokenize='unicode61 remove_diacritics 1'
 );
+"""
 
+# Created after bulk loading so inserts don't maintain the B-trees row by row
+INDEXES_SQL = """
 -- Performance indexes
 CREATE INDEX IF NOT EXISTS idx_composition_nutrient ON composition(const_code);
 CREATE INDEX IF NOT EXISTS idx_composition_source ON composition(source_code);
@@ -74,3 +77,45 @@ CREATE INDEX IF NOT EXISTS idx_foods_group ON foods(alim_grp_code);
 CREATE INDEX IF NOT EXISTS idx_foods_name_fr ON foods(alim_nom_fr);
 CREATE INDEX IF NOT EXISTS idx_foods_name_eng ON foods(alim_nom_eng);
 """
+
+SCHEMA_SQL = TABLES_SQL + INDEXES_SQL
+
+# Pragmas for building a fresh database file that nobody reads until it is
+# swapped in: no rollback journal, no fsync, large page cache
+BULK_LOAD_PRAGMAS = (
+    "PRAGMA journal_mode = OFF",
+    "PRAGMA synchronous = OFF",
+    "PRAGMA cache_size = -65536",
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA locking_mode = EXCLUSIVE",
+)
+
+INSERT_SQL = {
+    "nutrients": """INSERT OR REPLACE INTO nutrients
+        (const_code, const_nom_fr, const_nom_eng, unit, code_infoods)
+        VALUES (?, ?, ?, ?, ?)""",
+    "food_groups": """INSERT OR REPLACE INTO food_groups
+        (alim_grp_code, alim_grp_nom_fr, alim_grp_nom_eng,
+         alim_ssgrp_code, alim_ssgrp_nom_fr, alim_ssgrp_nom_eng,
+         alim_ssssgrp_code, alim_ssssgrp_nom_fr, alim_ssssgrp_nom_eng)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+    "sources": """INSERT OR REPLACE INTO sources (source_code, ref_citation)
+        VALUES (?, ?)""",
+    "foods": """INSERT OR REPLACE INTO foods
+        (alim_code, alim_nom_fr, alim_nom_eng, alim_grp_code,
+         alim_nom_sci, alim_ssgrp_code, alim_ssssgrp_code, facteur_Jones)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)""",
+    "composition": """INSERT OR REPLACE INTO composition
+        (alim_code, const_code, teneur, code_confiance, min, max, source_code)
+        VALUES (?, ?, ?, ?, ?, ?, ?)""",
+}
+
+# Primary key columns, used to match rows when diffing a new release
+# against the current tables
+PRIMARY_KEYS = {
+    "nutrients": ("const_code",),
+    "food_groups": ("alim_grp_code", "alim_ssgrp_code", "alim_ssssgrp_code"),
+    "sources": ("source_code",),
+    "foods": ("alim_code",),
+    "composition": ("alim_code", "const_code"),
+}
@@ -0,0 +1,299 @@
+"""Diet optimization: linear programs over the food × nutrient matrix
+
+Finds the grams of each food that minimize (or maximize) an objective while
+keeping nutrient totals within bounds:
+
+    minimize    c · x
+    subject to  lo_k <= sum_i v_ik x_i <= hi_k   for each constrained nutrient k
+                0 <= x_i <= max_grams / 100
+
+where x_i is in units of 100 g, matching CIQUAL's per-100 g values. Foods
+without a value for a constrained nutrient are left out rather than counted
+as zero.
+
+SciPy's HiGHS solver is used when SciPy is installed; otherwise a bundled
+bounded-variable simplex in NumPy solves the problem. With only a handful
+of nutrient rows, its tableau stays small however many foods are allowed.
+"""
+
+from functools import lru_cache
+
+import numpy as np
+
+# Nutrient optimized by the default objective (energy, kcal)
+ENERGY_CODE = 328
+
+_EPS = 1e-9
+_MAX_ITERATIONS = 10_000
+
+class DietInfeasible(ValueError):
+    """Raised when no combination of foods satisfies the constraints"""
+
+@lru_cache(maxsize=32)
+def candidate_block(matrix, const_codes, groups=None, alim_codes=None):
+    """Foods eligible for a problem and their constrained nutrient values
+
+    Cached per (matrix, nutrients, groups, codes), so repeated calls with new
+    bounds or objectives skip the column gathering. The server clears the
+    cache when it loads a new matrix, so replaced matrices are not kept alive.
+
+    Args:
+        matrix: NutrientMatrix
+        const_codes: Tuple of nutrients that appear in constraints/objective
+        groups: Tuple of food group codes (any level) or None for all foods
+        alim_codes: Tuple of allowed alim_codes or None
+
+    Returns:
+        Tuple (row indices, values array [nutrients, foods]), read-only
+    """
+    mask = np.ones(len(matrix.food_codes), dtype=bool)
+    if groups:
+        mask = np.zeros(len(matrix.food_codes), dtype=bool)
+        for group in groups:
+            mask |= matrix.group_mask(group)
+    if alim_codes:
+        mask &= matrix.food_mask(alim_codes)
+    columns = [matrix.nutrient_column(code) for code in const_codes]
+    if columns:
+        mask &= ~np.isnan(matrix.values[:, columns]).any(axis=1)
+    rows = np.flatnonzero(mask)
+    values = np.ascontiguousarray(matrix.values[np.ix_(rows, columns)].T)
+    rows.setflags(write=False)
+    values.setflags(write=False)
+    return rows, values
+
+def _solve_scipy(c, A, lo, hi, upper):
+    from scipy.optimize import linprog
+    finite_hi = np.isfinite(hi)
+    finite_lo = np.isfinite(lo)
+    A_ub = np.vstack([A[finite_hi], -A[finite_lo]])
+    b_ub = np.concatenate([hi[finite_hi], -lo[finite_lo]])
+    result = linprog(c, A_ub=A_ub if len(b_ub) else None, b_ub=b_ub if len(b_ub) else None,
+                     bounds=list(zip(np.zeros_like(upper), upper)), method="highs")
+    if result.status == 2:
+        raise DietInfeasible("No combination of the allowed foods meets the constraints")
+    if result.status != 0:
+        raise RuntimeError(f"LP solver failed: {result.message}")
+    return result.x
+
+def simplex(c, A, lo, hi, upper):
+    """Solve ``min c·x, lo <= A x <= hi, 0 <= x <= upper`` with a bounded-variable simplex
+
+    Two-phase primal simplex on a dense tableau. Each range constraint gets
+    a slack variable, so the tableau has one row per constraint and upper
+    bounds are handled by bound flipping rather than extra rows.
+
+    Args:
+        c: Objective coefficients (n)
+        A: Constraint matrix (m × n)
+        lo, hi: Row bounds (m), -inf/inf when absent
+        upper: Variable upper bounds (n), finite
+
+    Returns:
+        Optimal x (n)
+
+    Raises:
+        DietInfeasible: If the constraints cannot be met
+    """
+    m, n = A.shape
+    # Row k: A_k x - s_k = 0 with lo_k <= s_k <= hi_k, shifted so s' = s - lo >= 0
+    # (rows without a lower bound use hi as the reference point instead)
+    has_lo = np.isfinite(lo)
+    ref = np.where(has_lo, lo, hi)
+    sign = np.where(has_lo, 1.0, -1.0)
+    slack_upper = np.where(has_lo, hi - lo, np.inf)
+    slack_upper[~np.isfinite(slack_upper)] = np.inf
+
+    # Scale rows so nutrients in mg and g are comparable
+    scale = np.abs(A).max(axis=1)
+    scale[scale == 0] = 1.0
+    A = A / scale[:, None]
+    ref = ref / scale
+    slack_upper = slack_upper / scale
+
+    # Columns: x (n), slack s' (m), artificial (m); A x - sign*s' = ref
+    b = ref.copy()
+    flip = b < 0
+    rows = np.hstack([A, -np.diag(sign)])
+    rows[flip] *= -1
+    b[flip] *= -1
+    T = np.hstack([rows, np.eye(m)])
+    upper_all = np.concatenate([upper, slack_upper, np.full(m, np.inf)])
+    basis = np.arange(n + m, n + 2 * m)
+    at_upper = np.zeros(n + 2 * m, dtype=bool)
+    x_basic = b.copy()
+
+    def iterate(cost, allowed):
+        degenerate = 0
+        for _ in range(_MAX_ITERATIONS):
+            reduced = cost - cost[basis] @ T
+            reduced[basis] = 0.0
+            candidates = allowed & (
+                (~at_upper & (reduced < -_EPS)) | (at_upper & (reduced > _EPS))
+            )
+            candidates[basis] = False
+            if not candidates.any():
+                return
+            if degenerate > 50:
+                j = int(np.flatnonzero(candidates)[0])  # Bland's rule against cycling
+            else:
+                j = int(np.argmax(np.where(candidates, np.abs(reduced), -1.0)))
+            direction = -1.0 if at_upper[j] else 1.0
+            alpha = direction * T[:, j]
+
+            step = upper_all[j]
+            leave = -1
+            leave_to_upper = False
+            for i in range(m):
+                if alpha[i] > _EPS:
+                    t = x_basic[i] / alpha[i]
+                    to_upper = False
+                elif alpha[i] < -_EPS and np.isfinite(upper_all[basis[i]]):
+                    t = (upper_all[basis[i]] - x_basic[i]) / -alpha[i]
+                    to_upper = True
+                else:
+                    continue
+                if t < step - _EPS or (leave < 0 and t <= step):
+                    step, leave, leave_to_upper = max(t, 0.0), i, to_upper
+            if not np.isfinite(step):
+                raise RuntimeError("LP is unbounded")
+            degenerate = degenerate + 1 if step <= _EPS else 0
+
+            x_basic[:] -= step * alpha
+            if leave < 0:
+                at_upper[j] = not at_upper[j]  # bound flip, basis unchanged
+                continue
+            entering_value = (upper_all[j] if at_upper[j] else 0.0) + direction * step
+            leaving = basis[leave]
+            at_upper[leaving] = leave_to_upper
+            at_upper[j] = False
+            pivot = T[leave] / T[leave, j]
+            T[:] -= np.outer(T[:, j], pivot)
+            T[leave] = pivot
+            basis[leave] = j
+            x_basic[leave] = entering_value
+        raise RuntimeError("LP solver did not converge")
+
+    # Phase 1: drive the artificials to zero
+    allowed = np.ones(n + 2 * m, dtype=bool)
+    phase1 = np.concatenate([np.zeros(n + m), np.ones(m)])
+    iterate(phase1, allowed)
+    artificial = basis >= n + m
+    if np.any(x_basic[artificial] > 1e-7) or np.any(at_upper[n + m:]):
+        raise DietInfeasible("No combination of the allowed foods meets the constraints")
+
+    # Phase 2: artificials may never re-enter
+    allowed[n + m:] = False
+    upper_all[n + m:] = 0.0
+    iterate(np.concatenate([c, np.zeros(2 * m)]), allowed)
+
+    values = np.where(at_upper, upper_all, 0.0)
+    values[basis] = x_basic
+    return np.clip(values[:n], 0.0, upper)
+
+def solve(c, A, lo, hi, upper):
+    """Solve the diet LP, with SciPy when available"""
+    try:
+        import scipy.optimize  # noqa: F401
+    except ImportError:
+        return simplex(c, A, lo, hi, upper)
+    return _solve_scipy(c, A, lo, hi, upper)
+
+def _parse_costs(costs):
+    """Convert {"<alim_code>": cost per 100 g} to {alim_code: float}
+
+    Raises:
+        ValueError: Naming the first invalid alim_code or cost
+    """
+    if not isinstance(costs, dict):
+        raise ValueError(f"costs must map alim_code to a cost per 100 g, got {costs!r}")
+    parsed = {}
+    for code, value in costs.items():
+        try:
+            alim_code = int(code)
+        except (TypeError, ValueError):
+            raise ValueError(f"Invalid alim_code in costs: {code!r}")
+        if isinstance(value, bool) or not isinstance(value, (int, float)) or not np.isfinite(value):
+            raise ValueError(f"Invalid cost for {code}: expected a number, got {value!r}")
+        parsed[alim_code] = float(value)
+    return parsed
+
+def optimize_diet(matrix, constraints, objective="energy", groups=None, alim_codes=None,
+                  max_grams=300.0, costs=None):
+    """Choose food quantities meeting nutrient bounds at the best objective
+
+    Args:
+        matrix: NutrientMatrix
+        constraints: Mapping const_code -> (low, high) on the diet's totals
+        objective: 'energy' (min kcal), 'weight' (min grams), 'cost' (min
+            sum of ``costs``), 'min:<const_code>' or 'max:<const_code>'
+        groups: Food group codes the foods must belong to
+        alim_codes: Foods allowed (default: all)
+        max_grams: Upper bound per food, in grams
+        costs: Mapping alim_code -> cost per 100 g (objective 'cost'; foods
+            without a cost are excluded)
+
+    Returns:
+        dict with foods [(row, grams)], totals {const_code: value} and
+        the objective value
+
+    Raises:
+        ValueError: For an unknown objective or missing costs
+        KeyError: For unknown nutrients
+        DietInfeasible: If no diet satisfies the constraints
+    """
+    objective_code = None
+    sense = 1.0
+    if not isinstance(objective, str):
+        raise ValueError(f"Unknown objective: {objective!r}")
+    if objective == "energy":
+        objective_code = ENERGY_CODE
+    elif objective.startswith(("min:", "max:")):
+        try:
+            objective_code = int(objective[4:])
+        except ValueError:
+            raise ValueError(f"Invalid objective {objective!r}: expected 'min:<const_code>' or 'max:<const_code>'")
+        sense = -1.0 if objective.startswith("max:") else 1.0
+    elif objective == "cost":
+        if not costs:
+            raise ValueError("objective 'cost' needs costs per 100 g for the allowed foods")
+        costs = _parse_costs(costs)
+        alim_codes = tuple(sorted(set(alim_codes or costs) & set(costs)))
+    elif objective != "weight":
+        raise ValueError(f"Unknown objective: {objective}")
+
+    const_codes = [int(code) for code in constraints]
+    if objective_code is not None and objective_code not in const_codes:
+        const_codes.append(objective_code)
+    rows, values = candidate_block(
+        matrix,
+        tuple(const_codes),
+        tuple(sorted(groups)) if groups else None,
+        tuple(sorted(int(code) for code in alim_codes)) if alim_codes else None,
+    )
+    if not len(rows):
+        raise DietInfeasible("No foods match the allowed groups/codes with values for every constrained nutrient")
+
+    if objective_code is not None:
+        c = sense * values[const_codes.index(objective_code)]
+    elif objective == "cost":
+        c = np.array([costs[int(matrix.food_codes[row])] for row in rows])
+    else:
+        c = np.ones(len(rows))
+
+    count = len(constraints)
+    A = values[:count]
+    lo = np.array([-np.inf if low is None else low for low, _ in constraints.values()], dtype=float)
+    hi = np.array([np.inf if high is None else high for _, high in constraints.values()], dtype=float)
+    upper = np.full(len(rows), max_grams / 100.0)
+    x = solve(c, A, lo, hi, upper) if count else np.zeros(len(rows))
+
+    chosen = np.flatnonzero(x > 1e-6)
+    chosen = chosen[np.argsort(-x[chosen], kind="stable")]
+    totals = values @ x
+    return {
+        "foods": [(int(rows[i]), float(x[i] * 100.0)) for i in chosen],
+        "totals": {code: float(total) for code, total in zip(const_codes, totals)},
+        "total_grams": float(x.sum() * 100.0),
+        "objective_value": float((c @ x) * (sense if objective_code is not None else 1.0)),
+    }
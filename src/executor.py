@@ -0,0 +1,111 @@
+"""Dedicated executor for running SQL off the MCP event loop
+
+SQLite calls are blocking, so running them directly inside an ``async`` tool
+stalls every other request served by the event loop. QueryExecutor hands
+the work to a bounded thread pool and keeps counters so the queue depth can
+be reported.
+"""
+
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+class QueryExecutor:
+    """Bounded thread pool for blocking database work
+
+    Args:
+        max_workers: Number of queries allowed to run at the same time
+        max_queue: Maximum number of queries waiting for a worker; further
+            submissions are rejected with :class:`ExecutorBusy`
+
+    Note:
+        Threads are sufficient here: sqlite3 releases the GIL while a
+        statement is running, so queries execute in parallel.
+    """
+
+    def __init__(self, max_workers=4, max_queue=64):
+        self.max_workers = max(1, int(max_workers))
+        self.max_queue = max(0, int(max_queue))
+        self._pool = None
+        self._lock = threading.Lock()
+        self._running = 0
+        self._queued = 0
+        self._completed = 0
+        self._rejected = 0
+
+    def _get_pool(self):
+        with self._lock:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(
+                    max_workers=self.max_workers,
+                    thread_name_prefix="ciqual-query",
+                )
+            return self._pool
+
+    def _wrap(self, func, args):
+        with self._lock:
+            self._queued -= 1
+            self._running += 1
+        try:
+            return func(*args)
+        finally:
+            with self._lock:
+                self._running -= 1
+                self._completed += 1
+
+    async def run(self, func, *args):
+        """Run ``func(*args)`` on a worker thread and await its result
+
+        Raises:
+            ExecutorBusy: If the wait queue is already full
+        """
+        pool = self._get_pool()
+        with self._lock:
+            if self._queued + self._running >= self.max_workers + self.max_queue:
+                self._rejected += 1
+                raise ExecutorBusy(
+                    f"Too many queries in flight ({self._running} running, "
+                    f"{self._queued} queued)"
+                )
+            self._queued += 1
+        try:
+            future = pool.submit(self._wrap, func, args)
+        except RuntimeError:
+            # Pool was shut down before the work could be submitted
+            with self._lock:
+                self._queued -= 1
+            raise
+        # A caller cancelled while still queued cancels the work too, and
+        # _wrap never runs to take it off the queue count
+        future.add_done_callback(self._forget_cancelled)
+        return await asyncio.wrap_future(future)
+
+    def _forget_cancelled(self, future):
+        if future.cancelled():
+            with self._lock:
+                self._queued -= 1
+
+    def stats(self):
+        """Return a snapshot of executor load"""
+        with self._lock:
+            return {
+                "max_workers": self.max_workers,
+                "max_queue": self.max_queue,
+                "running": self._running,
+                "queued": self._queued,
+                "completed": self._completed,
+                "rejected": self._rejected,
+            }
+
+    def shutdown(self, wait=True):
+        """Stop the worker threads"""
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=wait)
+
+class ExecutorBusy(RuntimeError):
+    """Raised when the query queue is full"""
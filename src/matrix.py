@@ -0,0 +1,552 @@
+"""Dense in-memory food × nutrient matrix
+
+The whole ``composition`` table (~3,100 foods × ~67 nutrients) fits in a
+few MB as NumPy arrays, so nutrient filtering, ranking and aggregation can
+be answered with vectorized operations instead of SQLite joins and
+``MAX(CASE WHEN ...)`` pivots. Missing values are NaN.
+
+The matrix is also written to a versioned binary sidecar next to the
+database (``ciqual.matrix``) that server processes map read-only, so many
+concurrent processes share one page-cached copy with no parse cost.
+"""
+
+import json
+import mmap
+import os
+import struct
+import tempfile
+import warnings
+from pathlib import Path
+
+import numpy as np
+
+# code_confiance letters stored as small integers (0 = unknown)
+CONFIDENCE_CODES = {"A": 1, "B": 2, "C": 3, "D": 4}
+CONFIDENCE_LETTERS = {v: k for k, v in CONFIDENCE_CODES.items()}
+
+# Sidecar layout: magic, uint32 header length, JSON header, 64-byte aligned arrays
+MATRIX_MAGIC = b"CIQMTX01"
+MATRIX_FORMAT_VERSION = 1
+_ALIGNMENT = 64
+_ARRAYS = ("food_codes", "nutrient_codes", "values", "mins", "maxs", "confidence")
+
+def matrix_path(db_path):
+    """Location of the matrix sidecar for a database file"""
+    return Path(db_path).with_suffix(".matrix")
+
+def dataset_stamp(conn):
+    """Identify the dataset stored in a database
+
+    Returns:
+        dict with zenodo_record_id and downloaded_at (None when absent)
+    """
+    stamp = {"zenodo_record_id": None, "downloaded_at": None}
+    try:
+        for key, value in conn.execute(
+            "SELECT key, value FROM metadata WHERE key IN ('zenodo_record_id', 'downloaded_at')"
+        ):
+            stamp[key] = value
+    except Exception:
+        pass
+    return stamp
+
+class NutrientMatrix:
+    """Food × nutrient arrays loaded from the ``composition`` table
+
+    Attributes:
+        food_codes: int64 array of alim_code, one per row
+        nutrient_codes: int64 array of const_code, one per column
+        values: float64 [foods, nutrients] teneur per 100 g (NaN if missing)
+        mins, maxs: float64 [foods, nutrients] lower/upper bounds (NaN if missing)
+        confidence: uint8 [foods, nutrients] code_confiance (1=A .. 4=D, 0=none)
+        food_names: dict with 'fr' and 'eng' name arrays
+        food_groups: dict with 'grp', 'ssgrp' and 'ssssgrp' code arrays
+        nutrients: list of {const_code, const_nom_fr, const_nom_eng, unit}
+        version: zenodo_record_id of the source database
+    """
+
+    def __init__(self, food_codes, nutrient_codes, values, mins, maxs, confidence,
+                 food_names, food_groups, nutrients, version=None):
+        self.food_codes = np.asarray(food_codes, dtype=np.int64)
+        self.nutrient_codes = np.asarray(nutrient_codes, dtype=np.int64)
+        self.values = values
+        self.mins = mins
+        self.maxs = maxs
+        self.confidence = confidence
+        self.food_names = food_names
+        self.food_groups = food_groups
+        self.nutrients = nutrients
+        self.version = version
+        self.food_index = {int(code): i for i, code in enumerate(self.food_codes)}
+        self.nutrient_index = {int(code): j for j, code in enumerate(self.nutrient_codes)}
+        # Per-nutrient row orders (NaN last) and value counts, for O(n) top-N
+        with np.errstate(invalid="ignore"):
+            self.order_desc = np.argsort(-values, axis=0, kind="stable").astype(np.int32)
+        self.order_asc = np.argsort(values, axis=0, kind="stable").astype(np.int32)
+        self.value_counts = np.count_nonzero(~np.isnan(values), axis=0)
+        self._group_masks = {}
+        self._scaled = None
+
+    @classmethod
+    def from_connection(cls, conn):
+        """Build the matrix from an open SQLite connection
+
+        Args:
+            conn: sqlite3 connection to a Ciqual database
+
+        Returns:
+            NutrientMatrix instance
+        """
+        foods = conn.execute(
+            """SELECT alim_code, alim_nom_fr, alim_nom_eng, alim_grp_code,
+                      alim_ssgrp_code, alim_ssssgrp_code
+               FROM foods ORDER BY alim_code"""
+        ).fetchall()
+        nutrients = conn.execute(
+            """SELECT const_code, const_nom_fr, const_nom_eng, unit
+               FROM nutrients ORDER BY const_code"""
+        ).fetchall()
+
+        food_codes = [row[0] for row in foods]
+        nutrient_codes = [row[0] for row in nutrients]
+        food_index = {code: i for i, code in enumerate(food_codes)}
+        nutrient_index = {code: j for j, code in enumerate(nutrient_codes)}
+
+        shape = (len(food_codes), len(nutrient_codes))
+        values = np.full(shape, np.nan)
+        mins = np.full(shape, np.nan)
+        maxs = np.full(shape, np.nan)
+        confidence = np.zeros(shape, dtype=np.uint8)
+
+        rows = conn.execute(
+            "SELECT alim_code, const_code, teneur, min, max, code_confiance FROM composition"
+        ).fetchall()
+        if rows:
+            i = np.fromiter((food_index.get(r[0], -1) for r in rows), dtype=np.int64, count=len(rows))
+            j = np.fromiter((nutrient_index.get(r[1], -1) for r in rows), dtype=np.int64, count=len(rows))
+            known = (i >= 0) & (j >= 0)
+
+            def column(k):
+                return np.array([np.nan if r[k] is None else r[k] for r in rows], dtype=np.float64)
+
+            values[i[known], j[known]] = column(2)[known]
+            mins[i[known], j[known]] = column(3)[known]
+            maxs[i[known], j[known]] = column(4)[known]
+            conf = np.fromiter((CONFIDENCE_CODES.get(r[5], 0) for r in rows), dtype=np.uint8, count=len(rows))
+            confidence[i[known], j[known]] = conf[known]
+
+        version = None
+        try:
+            row = conn.execute("SELECT value FROM metadata WHERE key = 'zenodo_record_id'").fetchone()
+            version = row[0] if row else None
+        except Exception:
+            pass
+
+        return cls(
+            food_codes,
+            nutrient_codes,
+            values,
+            mins,
+            maxs,
+            confidence,
+            food_names={
+                "fr": np.array([row[1] or "" for row in foods], dtype=object),
+                "eng": np.array([row[2] or "" for row in foods], dtype=object),
+            },
+            food_groups={
+                "grp": np.array([row[3] or "" for row in foods], dtype=object),
+                "ssgrp": np.array([row[4] or "" for row in foods], dtype=object),
+                "ssssgrp": np.array([row[5] or "" for row in foods], dtype=object),
+            },
+            nutrients=[
+                {"const_code": row[0], "const_nom_fr": row[1], "const_nom_eng": row[2], "unit": row[3]}
+                for row in nutrients
+            ],
+            version=version,
+        )
+
+    def save(self, path, stamp):
+        """Write the matrix to a sidecar file atomically
+
+        Args:
+            path: Destination file
+            stamp: dataset_stamp() of the database the matrix was built from
+        """
+        path = Path(path)
+        arrays = {name: np.ascontiguousarray(getattr(self, name)) for name in _ARRAYS}
+        header = {
+            "format": MATRIX_FORMAT_VERSION,
+            "dataset": stamp,
+            "version": self.version,
+            "arrays": {},
+            "food_names": {k: list(v) for k, v in self.food_names.items()},
+            "food_groups": {k: list(v) for k, v in self.food_groups.items()},
+            "nutrients": self.nutrients,
+        }
+        # Offsets depend on the header size, so lay out arrays relative to 0 first
+        offset = 0
+        for name, array in arrays.items():
+            offset = -(-offset // _ALIGNMENT) * _ALIGNMENT
+            header["arrays"][name] = {
+                "dtype": array.dtype.str,
+                "shape": list(array.shape),
+                "offset": offset,
+            }
+            offset += array.nbytes
+        header_bytes = json.dumps(header, ensure_ascii=False).encode("utf-8")
+        data_start = len(MATRIX_MAGIC) + 4 + len(header_bytes)
+        data_start = -(-data_start // _ALIGNMENT) * _ALIGNMENT
+
+        fd, tmp_name = tempfile.mkstemp(prefix=".matrix-", dir=path.parent)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(MATRIX_MAGIC)
+                f.write(struct.pack("<I", len(header_bytes)))
+                f.write(header_bytes)
+                for name, array in arrays.items():
+                    f.seek(data_start + header["arrays"][name]["offset"])
+                    f.write(array.tobytes())
+            os.replace(tmp_name, path)
+        except BaseException:
+            try:
+                os.unlink(tmp_name)
+            except OSError:
+                pass
+            raise
+
+    @classmethod
+    def load(cls, path):
+        """Map a sidecar file read-only
+
+        Returns:
+            Tuple (matrix, dataset stamp). Numeric arrays are read-only views
+            over the shared page cache.
+
+        Raises:
+            ValueError: If the file is not a matrix sidecar of a known format
+        """
+        with open(path, "rb") as f:
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if buffer[:len(MATRIX_MAGIC)] != MATRIX_MAGIC:
+            buffer.close()
+            raise ValueError(f"Not a Ciqual matrix file: {path}")
+        (header_len,) = struct.unpack_from("<I", buffer, len(MATRIX_MAGIC))
+        header_start = len(MATRIX_MAGIC) + 4
+        header = json.loads(buffer[header_start:header_start + header_len].decode("utf-8"))
+        if header.get("format") != MATRIX_FORMAT_VERSION:
+            buffer.close()
+            raise ValueError(f"Unsupported matrix format: {header.get('format')}")
+        data_start = -(-(header_start + header_len) // _ALIGNMENT) * _ALIGNMENT
+
+        arrays = {}
+        for name in _ARRAYS:
+            spec = header["arrays"][name]
+            dtype = np.dtype(spec["dtype"])
+            count = int(np.prod(spec["shape"]))
+            arrays[name] = np.frombuffer(
+                buffer, dtype=dtype, count=count, offset=data_start + spec["offset"]
+            ).reshape(spec["shape"])
+
+        matrix = cls(
+            arrays["food_codes"],
+            arrays["nutrient_codes"],
+            arrays["values"],
+            arrays["mins"],
+            arrays["maxs"],
+            arrays["confidence"],
+            food_names={k: np.array(v, dtype=object) for k, v in header["food_names"].items()},
+            food_groups={k: np.array(v, dtype=object) for k, v in header["food_groups"].items()},
+            nutrients=header["nutrients"],
+            version=header.get("version"),
+        )
+        matrix._buffer = buffer
+        return matrix, header.get("dataset")
+
+    @classmethod
+    def load_or_build(cls, conn, path):
+        """Map the sidecar if it matches the database, else rebuild it
+
+        The rebuilt matrix is written back best-effort so the next process
+        can map it.
+        """
+        stamp = dataset_stamp(conn)
+        path = Path(path)
+        if path.exists():
+            try:
+                matrix, sidecar_stamp = cls.load(path)
+                if sidecar_stamp == stamp:
+                    return matrix
+            except (OSError, ValueError, KeyError):
+                pass
+        matrix = cls.from_connection(conn)
+        try:
+            matrix.save(path, stamp)
+        except OSError:
+            pass
+        return matrix
+
+    @property
+    def shape(self):
+        return self.values.shape
+
+    def nutrient_column(self, const_code):
+        """Return the column index of ``const_code``
+
+        Raises:
+            KeyError: If the nutrient is not in the matrix
+        """
+        try:
+            return self.nutrient_index[int(const_code)]
+        except (KeyError, ValueError, TypeError):
+            raise KeyError(f"Unknown nutrient const_code: {const_code}")
+
+    def group_mask(self, group):
+        """Boolean mask of foods in a group, subgroup or sub-subgroup code
+
+        Masks are computed once per code and returned read-only; combine
+        them with ``&`` rather than in place.
+        """
+        if not group:
+            return np.ones(len(self.food_codes), dtype=bool)
+        group = str(group)
+        mask = self._group_masks.get(group)
+        if mask is None:
+            mask = (
+                (self.food_groups["grp"] == group)
+                | (self.food_groups["ssgrp"] == group)
+                | (self.food_groups["ssssgrp"] == group)
+            )
+            mask.setflags(write=False)
+            self._group_masks[group] = mask
+        return mask
+
+    def food_mask(self, alim_codes):
+        """Boolean mask selecting the given alim_codes (unknown codes ignored)"""
+        mask = np.zeros(len(self.food_codes), dtype=bool)
+        rows = [self.food_index[c] for c in (int(code) for code in alim_codes) if c in self.food_index]
+        mask[rows] = True
+        return mask
+
+    def filter(self, conditions, mask=None):
+        """Select foods whose nutrient values fall within bounds
+
+        Args:
+            conditions: Mapping const_code -> (low, high); either bound may be None
+            mask: Optional boolean mask to start from
+
+        Returns:
+            Boolean mask over foods. Foods missing a constrained value are excluded.
+        """
+        result = np.ones(len(self.food_codes), dtype=bool) if mask is None else mask.copy()
+        for const_code, (low, high) in conditions.items():
+            column = self.values[:, self.nutrient_column(const_code)]
+            result &= ~np.isnan(column)
+            with np.errstate(invalid="ignore"):
+                if low is not None:
+                    result &= column >= low
+                if high is not None:
+                    result &= column <= high
+        return result
+
+    def rank(self, const_code, mask=None, n=20, descending=True):
+        """Return row indices of the top ``n`` foods by one nutrient
+
+        Walks the presorted order of the nutrient's column, so an unfiltered
+        query costs O(n). With a mask, the order is scanned in growing
+        chunks until ``n`` selected foods are found. Foods without a value
+        for the nutrient are never returned.
+        """
+        j = self.nutrient_column(const_code)
+        order = (self.order_desc if descending else self.order_asc)[:self.value_counts[j], j]
+        if mask is None:
+            return order[:n].astype(np.intp)
+        found = []
+        total = 0
+        start = 0
+        chunk = max(4 * n, 256)
+        while start < len(order) and total < n:
+            rows = order[start:start + chunk]
+            rows = rows[mask[rows]]
+            found.append(rows)
+            total += len(rows)
+            start += chunk
+            chunk *= 2
+        if not found:
+            return np.empty(0, dtype=np.intp)
+        return np.concatenate(found)[:n].astype(np.intp)
+
+    def scaled_values(self):
+        """Values divided by each nutrient's standard deviation (NaN kept)
+
+        Puts nutrients measured in g, mg and kcal on a comparable scale
+        before distances are computed. Computed once and cached.
+        """
+        if self._scaled is None:
+            with np.errstate(invalid="ignore"), warnings.catch_warnings():
+                warnings.simplefilter("ignore", RuntimeWarning)
+                std = np.nanstd(self.values, axis=0)
+            std = np.where(np.isfinite(std) & (std > 0), std, 1.0)
+            self._scaled = self.values / std
+        return self._scaled
+
+    def similar(self, alim_code, k=10, const_codes=None, metric="cosine"):
+        """Nearest foods to ``alim_code`` by nutrient profile
+
+        Only nutrients known for the reference food are compared, and each
+        candidate is scored on the nutrients it shares with it; candidates
+        sharing fewer than half of them are skipped.
+
+        Args:
+            alim_code: Reference food
+            k: Number of neighbours
+            const_codes: Nutrients to compare (default: all)
+            metric: 'cosine' (1 - cosine similarity) or 'euclidean' (RMS
+                difference in standard deviations per shared nutrient)
+
+        Returns:
+            List of (row, distance, shared nutrient count), nearest first
+
+        Raises:
+            KeyError: For an unknown food or nutrient
+            ValueError: For an unknown metric or a reference with no values
+        """
+        if metric not in ("cosine", "euclidean"):
+            raise ValueError(f"Unknown metric: {metric}")
+        try:
+            target_row = self.food_index[int(alim_code)]
+        except (KeyError, ValueError, TypeError):
+            raise KeyError(f"Unknown alim_code: {alim_code}")
+        columns = (
+            np.array([self.nutrient_column(code) for code in const_codes], dtype=np.intp)
+            if const_codes else np.arange(len(self.nutrient_codes))
+        )
+        scaled = self.scaled_values()
+        target = scaled[target_row, columns]
+        known = ~np.isnan(target)
+        columns, target = columns[known], target[known]
+        if not len(columns):
+            raise ValueError(f"Food {alim_code} has no values for the requested nutrients")
+
+        candidates = scaled[:, columns]
+        present = ~np.isnan(candidates)
+        filled = np.where(present, candidates, 0.0)
+        shared = present.sum(axis=1)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            if metric == "cosine":
+                dot = filled @ target
+                norms = np.sqrt((filled ** 2).sum(axis=1)) * np.sqrt(present @ (target ** 2))
+                distance = 1.0 - dot / norms
+            else:
+                squared = np.where(present, (candidates - target) ** 2, 0.0).sum(axis=1)
+                distance = np.sqrt(squared / shared)
+
+        eligible = (shared * 2 >= len(columns)) & np.isfinite(distance)
+        eligible[target_row] = False
+        rows = np.flatnonzero(eligible)
+        if k < len(rows):
+            rows = rows[np.argpartition(distance[rows], k)[:k]]
+        rows = rows[np.argsort(distance[rows], kind="stable")]
+        return [(int(row), float(distance[row]), int(shared[row])) for row in rows]
+
+    def aggregate(self, const_codes=None, mask=None):
+        """Summary statistics per nutrient over the selected foods
+
+        Returns:
+            List of dicts with const_code, unit, count, mean, median, min, max, std
+        """
+        columns = (
+            [self.nutrient_column(code) for code in const_codes]
+            if const_codes else list(range(len(self.nutrient_codes)))
+        )
+        subset = self.values if mask is None else self.values[mask]
+        stats = []
+        for j in columns:
+            column = subset[:, j]
+            column = column[~np.isnan(column)]
+            entry = {
+                "const_code": int(self.nutrient_codes[j]),
+                "const_nom_fr": self.nutrients[j]["const_nom_fr"],
+                "unit": self.nutrients[j]["unit"],
+                "count": int(column.size),
+            }
+            if column.size:
+                entry.update(
+                    mean=round(float(column.mean()), 4),
+                    median=round(float(np.median(column)), 4),
+                    min=float(column.min()),
+                    max=float(column.max()),
+                    std=round(float(column.std()), 4),
+                )
+            stats.append(entry)
+        return stats
+
+    def food_profiles(self, alim_codes, const_codes=None):
+        """Nutrient vectors for many foods, gathered in one fancy-indexing pass
+
+        Args:
+            alim_codes: Foods to return, in order (duplicates and unknown codes dropped)
+            const_codes: Nutrients to include (default: all)
+
+        Returns:
+            dict with ``nutrients`` (the column order: const_code, names, unit),
+            ``foods`` ([{alim_code, alim_nom_fr, alim_nom_eng, alim_grp_code,
+            values}] where values is aligned with ``nutrients``, None if missing)
+            and ``not_found`` (unknown alim_codes)
+        """
+        columns = (
+            [self.nutrient_column(code) for code in const_codes]
+            if const_codes else list(range(len(self.nutrient_codes)))
+        )
+        rows, seen, not_found = [], set(), []
+        for code in alim_codes:
+            code = int(code)
+            if code in seen:
+                continue
+            seen.add(code)
+            if code in self.food_index:
+                rows.append(self.food_index[code])
+            else:
+                not_found.append(code)
+
+        block = self.values[np.ix_(rows, columns)]
+        cells = block.astype(object)
+        cells[np.isnan(block)] = None
+        foods = [
+            {
+                "alim_code": int(self.food_codes[row]),
+                "alim_nom_fr": self.food_names["fr"][row],
+                "alim_nom_eng": self.food_names["eng"][row],
+                "alim_grp_code": self.food_groups["grp"][row],
+                "values": values,
+            }
+            for row, values in zip(rows, cells.tolist())
+        ]
+        return {
+            "nutrients": [
+                {
+                    "const_code": int(self.nutrient_codes[j]),
+                    "const_nom_fr": self.nutrients[j]["const_nom_fr"],
+                    "const_nom_eng": self.nutrients[j]["const_nom_eng"],
+                    "unit": self.nutrients[j]["unit"],
+                }
+                for j in columns
+            ],
+            "foods": foods,
+            "not_found": not_found,
+        }
+
+    def food_record(self, row, const_codes=None):
+        """Compact record for one food row with the requested nutrient values"""
+        record = {
+            "alim_code": int(self.food_codes[row]),
+            "alim_nom_fr": self.food_names["fr"][row],
+            "alim_nom_eng": self.food_names["eng"][row],
+            "alim_grp_code": self.food_groups["grp"][row],
+        }
+        if const_codes is not None:
+            values = {}
+            for code in const_codes:
+                value = self.values[row, self.nutrient_column(code)]
+                values[str(code)] = None if np.isnan(value) else float(value)
+            record["values"] = values
+        return record
@@ -0,0 +1,255 @@
+"""Nutrient totals for meals and recipes
+
+A meal is a list of foods with portion weights. Its totals are one
+weighted sum over rows of the nutrient matrix: values are per 100 g, so
+each row is scaled by grams / 100. ``min``/``max`` bounds are carried
+through the same sum, with the mean value standing in for a missing bound.
+
+Batches of recipes (``iter_recipe_totals`` and the command line entry
+point) are evaluated as a sparse recipe × food weight matrix times the
+dense food × nutrient matrix, chunk by chunk, so output is streamed and
+memory stays bounded whatever the number of recipes.
+"""
+
+import csv
+import itertools
+import json
+
+import numpy as np
+
+def total_unit(unit):
+    """Unit of a total, e.g. 'mg/100g' -> 'mg'"""
+    if not unit:
+        return unit
+    return unit.replace("/100 g", "").replace("/100g", "")
+
+def meal_totals(matrix, rows, grams, const_codes=None):
+    """Sum nutrient values over weighted food rows
+
+    Args:
+        matrix: NutrientMatrix
+        rows: Matrix row index of each ingredient
+        grams: Portion weight of each ingredient, in grams
+        const_codes: Nutrients to total (default: all)
+
+    Returns:
+        List of {const_code, const_nom_fr, unit, total, min, max} plus
+        ``missing`` (alim_codes without a value, when any). total/min/max
+        are None when no ingredient has a value for the nutrient.
+    """
+    columns = (
+        [matrix.nutrient_column(code) for code in const_codes]
+        if const_codes else list(range(len(matrix.nutrient_codes)))
+    )
+    rows = np.asarray(rows, dtype=np.intp)
+    weights = np.asarray(grams, dtype=np.float64) / 100.0
+    block = np.ix_(rows, columns)
+
+    values = matrix.values[block]
+    present = ~np.isnan(values)
+    filled = np.where(present, values, 0.0)
+    lows = np.where(np.isnan(matrix.mins[block]), filled, matrix.mins[block])
+    highs = np.where(np.isnan(matrix.maxs[block]), filled, matrix.maxs[block])
+
+    totals = weights @ filled
+    total_lows = weights @ np.where(present, lows, 0.0)
+    total_highs = weights @ np.where(present, highs, 0.0)
+    known = present.any(axis=0)
+
+    results = []
+    for k, j in enumerate(columns):
+        entry = {
+            "const_code": int(matrix.nutrient_codes[j]),
+            "const_nom_fr": matrix.nutrients[j]["const_nom_fr"],
+            "unit": total_unit(matrix.nutrients[j]["unit"]),
+            "total": round(float(totals[k]), 4) if known[k] else None,
+            "min": round(float(total_lows[k]), 4) if known[k] else None,
+            "max": round(float(total_highs[k]), 4) if known[k] else None,
+        }
+        if known[k] and not present[:, k].all():
+            entry["missing"] = sorted({int(matrix.food_codes[rows[i]]) for i in np.flatnonzero(~present[:, k])})
+        results.append(entry)
+    return results
+
+# Recipes multiplied per batch; bounds memory to one chunk of rows
+RECIPE_CHUNK = 1024
+
+def recipe_tuple(recipe, default_id=None):
+    """Convert ``{"id": ..., "foods": {"<alim_code>": grams, ...}}`` to (id, alim_codes, grams)
+
+    Raises:
+        ValueError: If the record is malformed
+    """
+    try:
+        foods = recipe["foods"]
+        return (
+            recipe.get("id", default_id),
+            [int(code) for code in foods],
+            [float(weight) for weight in foods.values()],
+        )
+    except (ValueError, KeyError, TypeError, AttributeError) as e:
+        raise ValueError(f"Invalid recipe {recipe!r:.100}: {e}") from e
+
+def read_jsonl_recipes(lines):
+    """Parse JSON lines holding one ``recipe_tuple`` record each
+
+    Yields:
+        Tuples (recipe id, alim_codes, grams); the id defaults to the line number
+    """
+    for number, line in enumerate(lines, start=1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            recipe = json.loads(line)
+        except ValueError as e:
+            raise ValueError(f"Invalid JSON on line {number}: {e}") from e
+        yield recipe_tuple(recipe, number)
+
+def read_csv_recipes(lines):
+    """Parse CSV triplets ``recipe_id,alim_code,grams`` (one row per ingredient)
+
+    Rows of a recipe must be consecutive; a header row is skipped.
+
+    Yields:
+        Tuples (recipe id, alim_codes, grams)
+    """
+    current, codes, grams = None, [], []
+    for number, row in enumerate(csv.reader(lines), start=1):
+        if not row or (number == 1 and row[0].strip().lower() in ("recipe_id", "id")):
+            continue
+        try:
+            recipe_id, code, weight = row[0], int(row[1]), float(row[2])
+        except (IndexError, ValueError) as e:
+            raise ValueError(f"Invalid CSV row {number}: {row}") from e
+        if recipe_id != current and current is not None:
+            yield current, codes, grams
+            codes, grams = [], []
+        current = recipe_id
+        codes.append(code)
+        grams.append(weight)
+    if current is not None:
+        yield current, codes, grams
+
+def _chunk_totals(matrix, chunk, columns, dense, present):
+    """Recipe × nutrient totals for one chunk as a CSR × dense product"""
+    indptr = [0]
+    indices = []
+    data = []
+    unknown = []
+    for _, codes, grams in chunk:
+        missing = []
+        for code, weight in zip(codes, grams):
+            row = matrix.food_index.get(code)
+            if row is None:
+                missing.append(code)
+                continue
+            indices.append(row)
+            data.append(weight / 100.0)
+        indptr.append(len(indices))
+        unknown.append(missing)
+
+    indptr = np.asarray(indptr, dtype=np.intp)
+    indices = np.asarray(indices, dtype=np.intp)
+    data = np.asarray(data, dtype=np.float64)
+    totals = np.zeros((len(chunk), len(columns)))
+    known = np.zeros((len(chunk), len(columns)), dtype=bool)
+    nonempty = np.flatnonzero(np.diff(indptr) > 0)
+    if len(nonempty):
+        # Segments between consecutive non-empty row starts are exactly those rows
+        starts = indptr[nonempty]
+        totals[nonempty] = np.add.reduceat(data[:, None] * dense[indices], starts, axis=0)
+        known[nonempty] = np.logical_or.reduceat(present[indices], starts, axis=0)
+    return totals, known, unknown
+
+def iter_recipe_totals(matrix, recipes, const_codes=None, chunk_size=RECIPE_CHUNK):
+    """Stream nutrient totals for many recipes
+
+    Recipes are consumed ``chunk_size`` at a time; each chunk is turned into
+    a sparse recipe × food weight matrix and multiplied with the dense
+    food × nutrient matrix in one pass.
+
+    Args:
+        matrix: NutrientMatrix
+        recipes: Iterable of (recipe id, alim_codes, grams)
+        const_codes: Nutrients to total (default: all)
+        chunk_size: Recipes per multiply
+
+    Yields:
+        Tuples (recipe id, totals list aligned with the nutrient columns,
+        None where no ingredient has a value; unknown alim_codes)
+    """
+    columns = (
+        [matrix.nutrient_column(code) for code in const_codes]
+        if const_codes else list(range(len(matrix.nutrient_codes)))
+    )
+    values = matrix.values[:, columns]
+    present = ~np.isnan(values)
+    dense = np.where(present, values, 0.0)
+
+    chunk = []
+    for recipe in itertools.chain(recipes, [None]):
+        if recipe is not None:
+            chunk.append(recipe)
+            if len(chunk) < chunk_size:
+                continue
+        if not chunk:
+            break
+        totals, known, unknown = _chunk_totals(matrix, chunk, columns, dense, present)
+        cells = np.round(totals, 4).astype(object)
+        cells[~known] = None
+        for (recipe_id, _, _), row, missing in zip(chunk, cells.tolist(), unknown):
+            yield recipe_id, row, missing
+        chunk = []
+
+def main(argv=None):
+    """Command line entry point: ``python meals.py RECIPES [--format jsonl|csv]``
+
+    Writes one JSON line per recipe ({"id", "totals": {const_code: value}})
+    or, with ``--output-format csv``, a CSV table with one column per nutrient.
+    """
+    import argparse
+    import sqlite3
+    import sys
+    from pathlib import Path
+
+    from matrix import NutrientMatrix, matrix_path
+
+    parser = argparse.ArgumentParser(description="Compute nutrient totals for a batch of recipes")
+    parser.add_argument("recipes", help="recipes file ('-' for stdin)")
+    parser.add_argument("--format", choices=("jsonl", "csv"), help="input format (default: from extension)")
+    parser.add_argument("--output-format", choices=("jsonl", "csv"), default="jsonl")
+    parser.add_argument("--nutrients", help="comma separated const_codes (default: all)")
+    parser.add_argument("--db-path", default=str(Path.home() / ".ciqual" / "ciqual.db"))
+    args = parser.parse_args(argv)
+
+    conn = sqlite3.connect(f"file:{args.db_path}?mode=ro", uri=True)
+    try:
+        matrix = NutrientMatrix.load_or_build(conn, matrix_path(args.db_path))
+    finally:
+        conn.close()
+    const_codes = [int(code) for code in args.nutrients.split(",")] if args.nutrients else None
+    codes = const_codes or [int(code) for code in matrix.nutrient_codes]
+
+    input_format = args.format or ("csv" if args.recipes.endswith(".csv") else "jsonl")
+    source = sys.stdin if args.recipes == "-" else open(args.recipes, newline="", encoding="utf-8")
+    reader = read_csv_recipes if input_format == "csv" else read_jsonl_recipes
+    out = sys.stdout
+    writer = csv.writer(out) if args.output_format == "csv" else None
+    if writer:
+        writer.writerow(["id"] + codes)
+    try:
+        for recipe_id, totals, unknown in iter_recipe_totals(matrix, reader(source), const_codes):
+            if writer:
+                writer.writerow([recipe_id] + ["" if v is None else v for v in totals])
+            else:
+                record = {"id": recipe_id, "totals": dict(zip(map(str, codes), totals))}
+                if unknown:
+                    record["unknown"] = unknown
+                out.write(json.dumps(record) + "\n")
+    finally:
+        if source is not sys.stdin:
+            source.close()
+
+if __name__ == "__main__":
+    main()
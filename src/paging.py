@@ -0,0 +1,89 @@
+"""Row/byte budgets and continuation cursors for the query tool
+
+Large result sets are never materialized in full: rows are pulled from the
+SQLite cursor with ``fetchmany`` until the page budget is reached. When more
+rows remain, the client receives an opaque continuation token that encodes
+the offset, a hash of the SQL and the dataset version. Pages are stateless
+on the server: a follow-up call re-runs the statement and skips ahead.
+"""
+
+import base64
+import hashlib
+import json
+
+from cache import estimate_size
+
+# Rows pulled from SQLite per fetchmany call
+FETCH_CHUNK = 256
+
+class InvalidCursor(ValueError):
+    """Raised for malformed, mismatched or stale continuation tokens"""
+
+def _sql_digest(normalized_sql):
+    return hashlib.sha1(normalized_sql.encode("utf-8")).hexdigest()[:16]
+
+def encode_cursor(normalized_sql, offset, version):
+    """Build a continuation token for the page starting at ``offset``"""
+    payload = json.dumps(
+        {"o": offset, "h": _sql_digest(normalized_sql), "v": version},
+        separators=(",", ":"),
+    )
+    return base64.urlsafe_b64encode(payload.encode("utf-8")).decode("ascii").rstrip("=")
+
+def decode_cursor(token, normalized_sql, version):
+    """Return the row offset encoded in ``token``
+
+    Raises:
+        InvalidCursor: If the token is malformed, was issued for another
+            query or for a previous version of the database
+    """
+    try:
+        padded = token + "=" * (-len(token) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+        offset = int(payload["o"])
+        digest = payload["h"]
+        token_version = payload.get("v")
+    except (ValueError, KeyError, TypeError) as e:
+        raise InvalidCursor("Malformed cursor") from e
+    if offset < 0 or digest != _sql_digest(normalized_sql):
+        raise InvalidCursor("Cursor does not belong to this query")
+    if token_version != version:
+        raise InvalidCursor("Cursor expired: the database was updated")
+    return offset
+
+def fetch_page(cursor, offset=0, max_rows=500, max_bytes=256 * 1024, convert=dict):
+    """Read one page of rows from an executed SQLite cursor
+
+    Args:
+        cursor: Cursor returned by ``conn.execute``
+        offset: Number of leading rows to skip
+        max_rows: Maximum rows in the page
+        max_bytes: Maximum estimated JSON size of the page
+        convert: Function turning a raw row into its output form
+
+    Returns:
+        Tuple (rows, size, has_more). At least one row is returned when
+        available, even if it alone exceeds ``max_bytes``.
+    """
+    skipped = 0
+    while skipped < offset:
+        chunk = cursor.fetchmany(min(FETCH_CHUNK, offset - skipped))
+        if not chunk:
+            return [], 0, False
+        skipped += len(chunk)
+
+    rows = []
+    size = 0
+    while True:
+        chunk = cursor.fetchmany(FETCH_CHUNK)
+        if not chunk:
+            return rows, size, False
+        for raw in chunk:
+            if len(rows) >= max_rows:
+                return rows, size, True
+            row = convert(raw)
+            row_size = estimate_size(row)
+            if rows and size + row_size > max_bytes:
+                return rows, size, True
+            rows.append(row)
+            size += row_size
@@ -0,0 +1,249 @@
+"""Read-only SQLite connection pool for the Ciqual database
+
+Keeps a bounded set of pre-opened, pre-configured read-only connections so
+each tool call reuses a warm page cache instead of paying for connection
+setup and schema parsing. Connections are recycled when the database file
+is replaced on disk (new inode or modification time).
+
+In memory mode the database file is snapshotted once per version and every
+pooled connection serves from a RAM copy of it, so queries never touch the
+disk.
+"""
+
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Applied to every pooled connection right after it is opened
+CONNECTION_PRAGMAS = (
+    "PRAGMA query_only = ON",
+    "PRAGMA temp_store = MEMORY",
+)
+
+# File-backed connections read pages through mmap instead of read() calls
+MMAP_SIZE = 256 * 1024 * 1024
+
+def db_signature(db_path):
+    """Identify the current database file on disk
+
+    Args:
+        db_path: Path to the SQLite database file
+
+    Returns:
+        Tuple (device, inode, mtime_ns, size), or None if the file is missing
+
+    Note:
+        A rebuilt or swapped-in database gets a new signature, which is how
+        pooled connections and caches know they are stale.
+    """
+    try:
+        st = os.stat(db_path)
+    except OSError:
+        return None
+    return (st.st_dev, st.st_ino, st.st_mtime_ns, st.st_size)
+
+class ConnectionPool:
+    """Bounded pool of read-only SQLite connections
+
+    Connections are opened lazily up to ``size`` and handed out exclusively
+    through :meth:`connection`. A caller blocks (up to ``timeout`` seconds)
+    when every connection is leased.
+
+    With ``in_memory=True`` the file is copied once per generation (through
+    the backup API, so the snapshot is consistent) and each connection is
+    deserialized from that image. Every connection holds a private copy:
+    a shared-cache memory database would serialize readers on its mutex.
+
+    Example:
+        >>> pool = ConnectionPool(Path("ciqual.db"), size=4)
+        >>> with pool.connection() as conn:
+        ...     conn.execute("SELECT COUNT(*) FROM foods").fetchone()
+    """
+
+    def __init__(self, db_path, size=4, timeout=30.0, in_memory=False):
+        self.db_path = db_path
+        self.size = max(1, int(size))
+        self.timeout = timeout
+        self.in_memory = in_memory
+        self._image = None
+        self._idle = queue.LifoQueue()
+        self._lock = threading.RLock()
+        # Notified whenever a connection is returned or a slot frees up
+        self._available = threading.Condition(self._lock)
+        self._opened = 0
+        self._signature = None
+        self._generation = 0
+
+    @property
+    def generation(self):
+        """Counter bumped every time the underlying database file changes"""
+        self._check_signature()
+        return self._generation
+
+    def _open_file(self):
+        return sqlite3.connect(
+            f"file:{self.db_path}?mode=ro",
+            uri=True,
+            check_same_thread=False,
+        )
+
+    def _memory_image(self, generation):
+        """Serialized snapshot of the database file for ``generation``"""
+        with self._lock:
+            if self._image is None or self._image[0] != generation:
+                source = self._open_file()
+                snapshot = sqlite3.connect(":memory:")
+                try:
+                    source.backup(snapshot)
+                    self._image = (generation, snapshot.serialize())
+                finally:
+                    snapshot.close()
+                    source.close()
+                logger.info("Loaded %d byte database image into memory", len(self._image[1]))
+            return self._image[1]
+
+    def _open(self, generation):
+        if self.in_memory and hasattr(sqlite3.Connection, "deserialize"):
+            conn = sqlite3.connect(":memory:", check_same_thread=False)
+            conn.deserialize(self._memory_image(generation))
+        elif self.in_memory:
+            # Python < 3.11: copy straight from the file into each connection
+            conn = sqlite3.connect(":memory:", check_same_thread=False)
+            source = self._open_file()
+            try:
+                source.backup(conn)
+            finally:
+                source.close()
+        else:
+            conn = self._open_file()
+            conn.execute(f"PRAGMA mmap_size = {MMAP_SIZE}")
+        conn.row_factory = sqlite3.Row
+        for pragma in CONNECTION_PRAGMAS:
+            conn.execute(pragma)
+        return conn
+
+    def _check_signature(self):
+        """Drop idle connections if the database file was replaced"""
+        signature = db_signature(self.db_path)
+        if signature == self._signature:
+            return
+        with self._lock:
+            if signature == self._signature:
+                return
+            if self._signature is not None:
+                logger.info("Database file changed, recycling pooled connections")
+            self._signature = signature
+            self._generation += 1
+            self._image = None
+            self._drain_idle()
+
+    def _drain_idle(self):
+        while True:
+            try:
+                conn, _ = self._idle.get_nowait()
+            except queue.Empty:
+                return
+            self._discard(conn)
+
+    def _discard(self, conn):
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+        self._free_slot()
+
+    def _free_slot(self):
+        """Give back the capacity of a closed connection and wake one waiter"""
+        with self._available:
+            self._opened -= 1
+            self._available.notify()
+
+    def _acquire(self):
+        deadline = time.monotonic() + self.timeout
+        while True:
+            self._check_signature()
+            generation = self._generation
+
+            # Reuse an idle connection from the current generation if possible
+            while True:
+                try:
+                    conn, conn_generation = self._idle.get_nowait()
+                except queue.Empty:
+                    break
+                if conn_generation == generation and self._is_healthy(conn):
+                    return conn, generation
+                self._discard(conn)
+
+            with self._available:
+                can_open = self._opened < self.size
+                if can_open:
+                    self._opened += 1
+                elif self._idle.empty():
+                    # Pool exhausted: wait until a connection is released or discarded
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise sqlite3.OperationalError("Timed out waiting for a database connection")
+                    self._available.wait(remaining)
+                    continue
+            if can_open:
+                try:
+                    return self._open(generation), generation
+                except Exception:
+                    self._free_slot()
+                    raise
+
+    @staticmethod
+    def _is_healthy(conn):
+        try:
+            conn.execute("SELECT 1").fetchone()
+            return True
+        except sqlite3.Error:
+            return False
+
+    def _release(self, conn, generation, broken=False):
+        if broken or generation != self._generation:
+            self._discard(conn)
+            return
+        with self._available:
+            self._idle.put((conn, generation))
+            self._available.notify()
+
+    @contextmanager
+    def connection(self):
+        """Lease a read-only connection for the duration of a ``with`` block"""
+        conn, generation = self._acquire()
+        broken = False
+        try:
+            yield conn
+        except sqlite3.DatabaseError as e:
+            # Connections that hit corruption or I/O errors are not reused
+            broken = not isinstance(e, sqlite3.OperationalError)
+            raise
+        finally:
+            self._release(conn, generation, broken)
+
+    def stats(self):
+        """Return a snapshot of pool usage"""
+        image = self._image
+        return {
+            "size": self.size,
+            "open": self._opened,
+            "idle": self._idle.qsize(),
+            "generation": self._generation,
+            "in_memory": self.in_memory,
+            "image_bytes": len(image[1]) if image else 0,
+        }
+
+    def close(self):
+        """Close every idle connection; leased ones are closed on release"""
+        with self._lock:
+            self._generation += 1
+            self._signature = None
+            self._image = None
+        self._drain_idle()
@@ -0,0 +1,129 @@
+"""Background version check and rebuild of the Ciqual database
+
+The server starts answering from the existing database immediately; the
+Zenodo version check and any rebuild run on a worker thread. The loader
+swaps the new file in atomically and the connection pool notices the new
+file on its next checkout, so no restart is needed.
+"""
+
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+# Zenodo is asked for a new release at most this often
+UPDATE_CHECK_INTERVAL = 30 * 24 * 3600
+
+# Refresh life cycle, as reported by ``DatabaseRefresh.status``
+STATES = ("idle", "checking", "updating", "up_to_date", "updated", "failed")
+
+def check_stamp_path(db_path):
+    """Sidecar file holding the time of the last version check"""
+    return Path(db_path).with_suffix(".checked")
+
+def record_update_check(db_path):
+    """Remember that the database was just compared against Zenodo
+
+    Kept in a sidecar rather than the database: writing the live file would
+    change its signature and make every server recycle its pooled
+    connections, memory image and result cache for unchanged data.
+    """
+    path = check_stamp_path(db_path)
+    tmp = path.with_name(f".{path.name}.{os.getpid()}")
+    tmp.write_text(str(time.time()))
+    os.replace(tmp, path)
+
+def checked_recently(db_path, max_age=UPDATE_CHECK_INTERVAL):
+    """Check whether the database was compared against Zenodo recently
+
+    Reads the sidecar written by ``record_update_check``, falling back to
+    the ``last_update_check`` metadata entry stored when the database was
+    built, so it is cheap enough for the server's startup path.
+
+    Returns:
+        True if the last check is less than ``max_age`` seconds old
+    """
+    try:
+        last_check = float(check_stamp_path(db_path).read_text())
+    except (OSError, ValueError):
+        try:
+            conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+            try:
+                row = conn.execute("SELECT value FROM metadata WHERE key = 'last_update_check'").fetchone()
+            finally:
+                conn.close()
+            last_check = float(row[0]) if row else None
+        except (sqlite3.Error, ValueError):
+            return False
+    return last_check is not None and time.time() - last_check < max_age
+
+class DatabaseRefresh:
+    """Run a version check and, if needed, an update on a daemon thread
+
+    Args:
+        db_path: Database file being served
+        check: Callable(db_path) returning True when an update is needed;
+            not called when the database does not exist yet
+        update: Callable(progress) rebuilding the database; ``progress`` is
+            called with human readable status lines
+    """
+
+    def __init__(self, db_path, check, update):
+        self.db_path = db_path
+        self._check = check
+        self._update = update
+        self._lock = threading.Lock()
+        self._thread = None
+        self._status = {
+            "state": "idle",
+            "message": None,
+            "error": None,
+            "started_at": None,
+            "finished_at": None,
+        }
+
+    def start(self):
+        """Start the refresh thread (no-op if it is already running)"""
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return self._thread
+            self._status.update(state="checking", message=None, error=None, started_at=time.time(), finished_at=None)
+            self._thread = threading.Thread(target=self._run, name="ciqual-refresh", daemon=True)
+            self._thread.start()
+            return self._thread
+
+    def wait(self, timeout=None):
+        """Block until the refresh thread finishes; returns False on timeout"""
+        thread = self._thread
+        if thread is not None:
+            thread.join(timeout)
+            return not thread.is_alive()
+        return True
+
+    @property
+    def running(self):
+        return self._status["state"] in ("checking", "updating")
+
+    def status(self):
+        """Return a snapshot of the refresh state"""
+        with self._lock:
+            return dict(self._status)
+
+    def _set(self, **fields):
+        with self._lock:
+            self._status.update(fields)
+
+    def _progress(self, message):
+        self._set(message=message)
+
+    def _run(self):
+        try:
+            if self.db_path.exists() and not self._check(self.db_path):
+                self._set(state="up_to_date", finished_at=time.time())
+                return
+            self._set(state="updating")
+            self._update(self._progress)
+            self._set(state="updated", finished_at=time.time())
+        except Exception as e:
+            self._set(state="failed", error=str(e), finished_at=time.time())
@@ -0,0 +1,110 @@
+"""Ranked food name search on the ``foods_fts`` index
+
+Free text from the client is reduced to plain word tokens (so FTS5 syntax
+characters can never produce a query error), restricted to the name columns
+of the requested language and ranked with bm25. The SQL text is constant,
+so SQLite's per-connection statement cache reuses the prepared statement.
+"""
+
+import re
+import sqlite3
+
+# Indexed name columns searched for each ``lang`` value (scientific names always)
+LANG_COLUMNS = {
+    "fr": ("alim_nom_fr", "alim_nom_sci"),
+    "eng": ("alim_nom_eng", "alim_nom_sci"),
+    "any": ("alim_nom_fr", "alim_nom_eng", "alim_nom_sci"),
+}
+
+MAX_SEARCH_LIMIT = 100
+
+# foods_fts rowid is alim_code; ties go to the shorter (more generic) name
+SEARCH_SQL = """
+    SELECT f.alim_code, f.alim_nom_fr, f.alim_nom_eng, f.alim_grp_code,
+           round(-bm25(foods_fts), 3) AS score
+    FROM foods_fts
+    JOIN foods f ON f.alim_code = foods_fts.rowid
+    WHERE foods_fts MATCH ?
+    ORDER BY bm25(foods_fts), length(f.alim_nom_fr)
+    LIMIT ?
+"""
+
+def index_consistent(conn):
+    """Check that ``foods_fts`` matches the foods table it indexes
+
+    Runs FTS5's integrity-check against the content table, which also fails
+    for indexes whose rowids are not alim_codes (databases built by older
+    loaders numbered them 1..N, so ``SEARCH_SQL`` would join nothing).
+
+    Note:
+        The check is issued as an INSERT, so ``conn`` must be writable
+        (nothing is written).
+
+    Returns:
+        False if the index is corrupt or stale and needs a 'rebuild'
+    """
+    try:
+        conn.execute("INSERT INTO foods_fts(foods_fts, rank) VALUES ('integrity-check', 1)")
+    except sqlite3.OperationalError as e:
+        if "locked" in str(e) or "busy" in str(e):
+            return True  # a writer holds the database; it cannot be checked now
+        return False
+    except sqlite3.DatabaseError:
+        return False
+    return True
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+def search_terms(text):
+    """Lowercased word tokens of a search string, in order and de-duplicated"""
+    terms = []
+    for token in _TOKEN_RE.findall(text.lower()):
+        if token not in terms:
+            terms.append(token)
+    return tuple(terms)
+
+def match_expression(terms, lang="fr", any_term=False):
+    """Build an FTS5 MATCH expression for ``terms``
+
+    Args:
+        terms: Tokens from ``search_terms``
+        lang: Key of ``LANG_COLUMNS``
+        any_term: Join terms with OR instead of AND
+
+    Returns:
+        Expression such as ``{alim_nom_fr alim_nom_sci} : ("pomme" AND "cru"*)``.
+        The last term is a prefix query so partially typed words match.
+    """
+    phrases = [f'"{term}"' for term in terms]
+    phrases[-1] += "*"
+    columns = " ".join(LANG_COLUMNS[lang])
+    joiner = " OR " if any_term else " AND "
+    return f"{{{columns}}} : ({joiner.join(phrases)})"
+
+def search_foods(conn, terms, lang="fr", limit=20):
+    """Rank foods whose names match ``terms``
+
+    All terms must match; when nothing does, foods matching any term are
+    returned instead.
+
+    Returns:
+        List of {alim_code, alim_nom_fr, alim_nom_eng, alim_grp_code, score},
+        best match first
+    """
+    cursor = conn.cursor()
+    cursor.row_factory = None
+    for any_term in (False, True):
+        rows = cursor.execute(SEARCH_SQL, (match_expression(terms, lang, any_term), limit)).fetchall()
+        if rows or len(terms) == 1:
+            break
+    cursor.close()
+    return [
+        {
+            "alim_code": code,
+            "alim_nom_fr": name_fr,
+            "alim_nom_eng": name_eng,
+            "alim_grp_code": group,
+            "score": score,
+        }
+        for code, name_fr, name_eng, group, score in rows
+    ]
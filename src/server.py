@@ -13,6 +13,17 @@ import sys
 import logging
 import fcntl
 import time
+import threading
+import subprocess
+from contextlib import contextmanager
+
+from pool import ConnectionPool
+from executor import QueryExecutor, ExecutorBusy
+from budget import QueryBudget, QueryCancelled
+from cache import ResultCache, normalize_sql
+from paging import InvalidCursor, encode_cursor, decode_cursor, fetch_page
+from refresh import DatabaseRefresh, checked_recently
+import search
 
 # Configure logging
 logging.basicConfig(
@@ -25,8 +36,198 @@ mcp = FastMCP("ANSES Ciqual")
 
 DB_PATH = Path.home() / ".ciqual" / "ciqual.db"
 
+# Number of read-only connections kept open for the query tool
+POOL_SIZE = int(os.environ.get("CIQUAL_POOL_SIZE", "4"))
+
+# Serve queries from RAM copies of the database instead of the file
+IN_MEMORY = os.environ.get("CIQUAL_IN_MEMORY", "0").lower() in ("1", "true", "yes")
+
+# Worker threads running SQL off the event loop, and how many may wait
+QUERY_WORKERS = int(os.environ.get("CIQUAL_QUERY_WORKERS", str(POOL_SIZE)))
+QUERY_QUEUE = int(os.environ.get("CIQUAL_QUERY_QUEUE", "64"))
+
+executor = QueryExecutor(max_workers=QUERY_WORKERS, max_queue=QUERY_QUEUE)
+
+# Per-statement budget: wall-clock seconds and SQLite VM instructions (0 = unlimited)
+QUERY_TIMEOUT = float(os.environ.get("CIQUAL_QUERY_TIMEOUT", "10"))
+QUERY_MAX_STEPS = int(os.environ.get("CIQUAL_QUERY_MAX_STEPS", "500000000"))
+
+budget = QueryBudget(timeout=QUERY_TIMEOUT, max_steps=QUERY_MAX_STEPS)
+
+# Cost of queries cancelled by the budget, reported by server_status
+cancelled_stats = {"count": 0, "elapsed_ms": 0.0, "vm_steps": 0}
+
+# Byte budget of the in-process query result cache (0 disables)
+CACHE_BYTES = int(os.environ.get("CIQUAL_CACHE_BYTES", str(32 * 1024 * 1024)))
+
+result_cache = ResultCache(max_bytes=CACHE_BYTES)
+
+# Server-enforced page budget for query results
+MAX_ROWS = int(os.environ.get("CIQUAL_MAX_ROWS", "500"))
+MAX_BYTES = int(os.environ.get("CIQUAL_MAX_BYTES", str(256 * 1024)))
+
+_pool = None
+_pool_lock = threading.Lock()
+_dataset = {"generation": None, "record_id": None}
+_matrix = {"generation": None, "matrix": None}
+_matrix_lock = threading.Lock()
+_refresh = None
+
+def get_pool():
+    """Return the shared connection pool, rebuilding it if DB_PATH changed"""
+    global _pool
+    with _pool_lock:
+        if _pool is None or _pool.db_path != DB_PATH:
+            if _pool is not None:
+                _pool.close()
+            _pool = ConnectionPool(DB_PATH, size=POOL_SIZE, in_memory=IN_MEMORY)
+        return _pool
+
+def dataset_version():
+    """Return the zenodo_record_id of the database currently served
+
+    Looked up once per pool generation; a change of database file also
+    clears the result cache.
+    """
+    pool = get_pool()
+    generation = pool.generation
+    if _dataset["generation"] != generation:
+        record_id = None
+        try:
+            with pool.connection() as conn:
+                row = conn.execute(
+                    "SELECT value FROM metadata WHERE key = 'zenodo_record_id'"
+                ).fetchone()
+                record_id = row[0] if row else None
+        except sqlite3.Error:
+            pass
+        result_cache.clear()
+        _dataset.update(generation=generation, record_id=record_id)
+    return _dataset["record_id"]
+
+def get_matrix():
+    """Return the food × nutrient matrix for the database currently served
+
+    Mapped from the prebuilt sidecar when it matches the database, otherwise
+    built from SQLite; reloaded whenever the database file changes.
+    """
+    # numpy is only imported once a matrix tool is used
+    from matrix import NutrientMatrix, matrix_path
+    pool = get_pool()
+    with _matrix_lock:
+        generation = pool.generation
+        if _matrix["generation"] != generation or _matrix["matrix"] is None:
+            # Cached LP blocks reference the previous matrix; drop them with it
+            import diet
+            diet.candidate_block.cache_clear()
+            with pool.connection() as conn:
+                _matrix["matrix"] = NutrientMatrix.load_or_build(conn, matrix_path(DB_PATH))
+            _matrix["generation"] = generation
+            logger.info("Loaded nutrient matrix %s", _matrix["matrix"].shape)
+        return _matrix["matrix"]
+
+def _database_missing():
+    """Error payload for tool calls made before the database exists, else None"""
+    if DB_PATH.exists():
+        return None
+    logger.warning("Database not found at %s", DB_PATH)
+    if _refresh is not None and _refresh.running:
+        return [{"error": "The Ciqual database is still being downloaded. Check refresh_status and retry shortly."}]
+    return [{"error": "Database not initialized. Please run the server first to download data."}]
+
+def _needs_update(db_path):
+    """Ask Zenodo for a new release (the loader is only imported here)"""
+    from data_loader import should_update_database
+    return should_update_database(db_path)
+
+def _run_loader(progress):
+    """Rebuild DB_PATH in a child process
+
+    The loader prints progress on stdout, which carries the MCP protocol, and
+    parses XML under the GIL; a separate process keeps both away from the
+    server. Its output lines are forwarded to ``progress``. The run holds the
+    database's file lock, so servers started together update one at a time.
+
+    Raises:
+        RuntimeError: If the loader exits with an error
+    """
+    # Path only: importing the loader would pull numpy into the server
+    loader = Path(__file__).with_name("data_loader.py")
+    command = [sys.executable, str(loader), "--force", "--db-path", str(DB_PATH)]
+    with _file_lock(DB_PATH):
+        process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+        last_line = None
+        for line in process.stdout:
+            line = line.rstrip()
+            if line:
+                last_line = line
+                logger.info("Loader: %s", line)
+                progress(line)
+        if process.wait() != 0:
+            raise RuntimeError(f"Database update failed: {last_line}")
+
+def _matrix_error(e):
+    """Map matrix engine failures to the tools' error payload"""
+    if isinstance(e, KeyError):
+        return [{"error": str(e.args[0]) if e.args else str(e)}]
+    if isinstance(e, sqlite3.Error):
+        return [{"error": f"Database error: {str(e)}"}]
+    logger.error("Unexpected error: %s", e)
+    return [{"error": f"Unexpected error: {str(e)}"}]
+
+# Output shapes accepted by the query tool's ``format`` argument
+RESULT_FORMATS = ("records", "table", "columns")
+
+def _execute_query(sql, cursor_token=None, result_format="records"):
+    """Run a SELECT on a pooled connection (blocking, called from executor)
+
+    Returns one page of rows in the requested format. When the result
+    exceeds the row/byte budget, a ``{"truncated": True, "next_cursor": ...}``
+    marker is appended (records) or merged into the result (table/columns).
+    """
+    version = dataset_version()
+    normalized = normalize_sql(sql)
+    offset = decode_cursor(cursor_token, normalized, version) if cursor_token else 0
+
+    key = (version, normalized, offset, result_format)
+    results = result_cache.get(key)
+    if results is not None:
+        return results
+
+    with get_pool().connection() as conn, budget.enforce(conn):
+        cursor = conn.cursor()
+        if result_format != "records":
+            # Plain tuples: no per-row dict or sqlite3.Row allocation
+            cursor.row_factory = None
+        cursor.execute(sql)
+        columns = [d[0] for d in cursor.description or ()]
+        convert = dict if result_format == "records" else list
+        rows, size, has_more = fetch_page(cursor, offset, MAX_ROWS, MAX_BYTES, convert)
+        cursor.close()
+
+    page_info = None
+    if has_more:
+        page_info = {
+            "truncated": True,
+            "rows_returned": len(rows),
+            "next_cursor": encode_cursor(normalized, offset + len(rows), version),
+        }
+
+    if result_format == "records":
+        results = rows + [page_info] if page_info else rows
+    else:
+        if result_format == "table":
+            results = {"columns": columns, "rows": rows}
+        else:
+            values = [list(col) for col in zip(*rows)] if rows else [[] for _ in columns]
+            results = {"columns": columns, "data": dict(zip(columns, values))}
+        if page_info:
+            results.update(page_info)
+    result_cache.put(key, results, size=size)
+    return results
+
 @mcp.tool()
-async def query(sql: str) -> list[dict]:
+async def query(sql: str, cursor: str | None = None, format: str = "records") -> list[dict] | dict:
     """Execute read-only SQL on ANSES Ciqual French food composition database (~3100 foods, 67 nutrients).
 
     ⚠️ USE MAX 2 QUERIES. Most tasks need only 1. NEVER query one nutrient at a time.
@@ -75,13 +276,25 @@ async def query(sql: str) -> list[dict]:
     WHERE c.alim_code = 2028 AND c.const_code = 328;
 
     === FTS TIPS ===
+    - To just find foods by name, use the search_foods tool (ranked, no SQL needed).
     - FTS tokenizes on diacritics: "pâte" matches "pate". Use OR: 'steak OR boeuf'.
     - Prefix search: 'pomm*' matches pomme, pommeau, etc.
     - alim_nom_sci (scientific name) is also indexed.
     - Prefer French food names (alim_nom_fr) — they are more complete.
 
+    === LARGE RESULTS ===
+    Results are capped (default 500 rows / 256KB per call). When capped, the last
+    element is {"truncated": true, "next_cursor": "..."}: call query again with the
+    SAME sql and cursor=<next_cursor> to get the next page. Prefer adding LIMIT/WHERE.
+
+    === COMPACT OUTPUT ===
+    format="records" (default): [{col: value, ...}, ...]
+    format="table": {"columns": [...], "rows": [[...], ...]} — no repeated keys, use for >20 rows
+    format="columns": {"columns": [...], "data": {col: [values...]}} — column-major
+    With table/columns, truncation keys (truncated, next_cursor) are added to the object.
+
     === COMPOUND DISHES ===
-    CIQUAL has ingredients, not recipes. Search each component separately and sum by portion weight (e.g. meat 150g, sauce 30g, bread 50g). You can search multiple components in one FTS query using OR.
+    CIQUAL has ingredients, not recipes. Use the compute_meal tool with each component and its portion weight (e.g. meat 150g, sauce 30g, bread 50g): it returns the summed nutrients in one call.
 
     === KEY NUTRIENT const_code VALUES ===
     Energy: 328 (kcal), 327 (kJ)
@@ -101,29 +314,36 @@ async def query(sql: str) -> list[dict]:
     """
 
     # Ensure database exists
-    if not DB_PATH.exists():
-        logger.warning("Database not found at %s", DB_PATH)
-        return [{"error": "Database not initialized. Please run the server first to download data."}]
+    missing = _database_missing()
+    if missing:
+        return missing
 
     # Validate SQL query (basic safety check)
     sql_lower = sql.strip().lower()
     if not sql_lower.startswith(('select', 'with')):
         return [{"error": "Only SELECT queries are allowed for safety."}]
 
-    # Connect with read-only mode
+    if format not in RESULT_FORMATS:
+        return [{"error": f"Unknown format '{format}'. Use one of: {', '.join(RESULT_FORMATS)}"}]
+
+    # Run on a pooled read-only connection, off the event loop
     try:
         logger.debug("Executing query: %s", sql[:100] + '...' if len(sql) > 100 else sql)
-        conn = sqlite3.connect(f"file:{DB_PATH}?mode=ro", uri=True)
-        conn.row_factory = sqlite3.Row
-
-        # Execute query with timeout
-        conn.execute("PRAGMA query_only = ON")
-        conn.execute("PRAGMA temp_store = MEMORY")
-        cursor = conn.execute(sql)
-        results = [dict(row) for row in cursor.fetchall()]
-        logger.debug("Query returned %d rows", len(results))
+        results = await executor.run(_execute_query, sql, cursor, format)
         return results
 
+    except InvalidCursor as e:
+        return [{"error": f"Invalid cursor: {str(e)}. Re-run the query without a cursor."}]
+    except QueryCancelled as e:
+        cancelled_stats["count"] += 1
+        cancelled_stats["elapsed_ms"] += e.elapsed_ms
+        cancelled_stats["vm_steps"] += e.vm_steps
+        logger.warning("%s: %s", e, sql[:200])
+        return [e.to_dict()]
+    except ExecutorBusy as e:
+        logger.warning("Query rejected: %s", e)
+        return [{"error": f"Server busy: {str(e)}. Retry shortly."}]
+
     except sqlite3.OperationalError as e:
         logger.error("SQL operational error: %s", e)
         if "no such table" in str(e):
@@ -138,106 +358,602 @@ async def query(sql: str) -> list[dict]:
     except Exception as e:
         logger.error("Unexpected error: %s", e)
         return [{"error": f"Unexpected error: {str(e)}"}]
-    finally:
-        if 'conn' in locals():
-            conn.close()
 
-def main():
-    """Main entry point for the MCP server
+def _search_foods(terms, lang, limit):
+    """Ranked name search with results cached per (terms, lang, limit)"""
+    key = ("search_foods", dataset_version(), terms, lang, limit)
+    results = result_cache.get(key)
+    if results is not None:
+        return results
+    with get_pool().connection() as conn, budget.enforce(conn):
+        results = search.search_foods(conn, terms, lang, limit)
+    result_cache.put(key, results)
+    return results
 
-    Initializes the database if needed and starts the MCP server.
+@mcp.tool()
+async def search_foods(text: str, lang: str = "fr", limit: int = 20) -> list[dict]:
+    """Find foods by name, best match first (bm25-ranked full-text search).
+
+    Use this instead of writing foods_fts MATCH queries by hand.
+    text: words of the food name, e.g. "pomme crue" or "chicken breast";
+      accents are optional and the last word may be partial ("pomm").
+      Foods matching all words come first; if none do, any word matches.
+    lang: "fr" (default, most complete), "eng" or "any" — which names to search
+    limit: max results (<= 100)
+
+    Returns [{alim_code, alim_nom_fr, alim_nom_eng, alim_grp_code, score}].
+    Then use alim_code with query, filter_foods or nutrient_stats.
     """
-    # Check and update database if needed
-    from data_loader import initialize_database, should_update_database
-    import sqlite3
+    missing = _database_missing()
+    if missing:
+        return missing
+    if lang not in search.LANG_COLUMNS:
+        return [{"error": f"Unknown lang '{lang}'. Use one of: {', '.join(search.LANG_COLUMNS)}"}]
+    terms = search.search_terms(text)
+    if not terms:
+        return [{"error": "Search text contains no words"}]
+    limit = max(1, min(limit, search.MAX_SEARCH_LIMIT))
+    try:
+        return await executor.run(_search_foods, terms, lang, limit)
+    except QueryCancelled as e:
+        return [e.to_dict()]
+    except ExecutorBusy as e:
+        return [{"error": f"Server busy: {str(e)}. Retry shortly."}]
+    except sqlite3.Error as e:
+        logger.error("Search error: %s", e)
+        return [{"error": f"Database error: {str(e)}"}]
+
+def _get_foods(alim_codes, nutrients):
+    return get_matrix().food_profiles(alim_codes, nutrients)
 
-    def repair_fts5_if_corrupted():
-        """Repair FTS5 index if corrupted (e.g., from concurrent writes)
+def _parse_bounds(conditions, require_bound=True):
+    """Convert {"<const_code>": {"min": x, "max": y}} to {const_code: (min, max)}
 
-        Uses file locking to prevent multiple instances from repairing simultaneously.
-        """
-        lock_file = DB_PATH.parent / ".ciqual.lock"
-        lock_fd = None
+    Args:
+        conditions: Bounds per nutrient as sent by the client
+        require_bound: Reject entries giving neither min nor max
 
+    Raises:
+        ValueError: With a message naming the offending entry
+    """
+    if not isinstance(conditions, dict):
+        raise ValueError('Conditions must be an object like {"25000": {"min": 20}}')
+    bounds = {}
+    for code, bound in conditions.items():
         try:
-            conn = sqlite3.connect(DB_PATH)
-            # Test FTS5 integrity
-            conn.execute("SELECT * FROM foods_fts LIMIT 1").fetchone()
-            conn.close()
-            return False  # No corruption
-        except sqlite3.OperationalError as e:
-            if "fts5" in str(e).lower() or "missing row" in str(e).lower():
-                logger.warning("FTS5 corruption detected, acquiring lock for repair...")
-                print("FTS5 corruption detected, acquiring lock for repair...", file=sys.stderr)
-
-                # Acquire exclusive lock
-                try:
-                    lock_fd = open(lock_file, 'w')
-                    fcntl.flock(lock_fd.fileno(), fcntl.LOCK_EX)
-                    logger.info("Lock acquired, rebuilding FTS5 index...")
-                    print("Lock acquired, rebuilding FTS5 index...", file=sys.stderr)
-
-                    # Double-check corruption still exists (another instance might have fixed it)
-                    try:
-                        conn = sqlite3.connect(DB_PATH)
-                        conn.execute("SELECT * FROM foods_fts LIMIT 1").fetchone()
-                        conn.close()
-                        logger.info("FTS5 already repaired by another instance")
-                        print("FTS5 already repaired by another instance", file=sys.stderr)
-                        return False
-                    except sqlite3.OperationalError:
-                        pass  # Still corrupted, proceed with repair
-
-                    # Rebuild FTS5 index
-                    conn = sqlite3.connect(DB_PATH)
-                    conn.execute("DELETE FROM foods_fts")
-                    conn.execute("INSERT INTO foods_fts SELECT alim_code, alim_nom_fr, alim_nom_eng, alim_nom_sci FROM foods")
-                    conn.commit()
-                    conn.close()
-
-                    logger.info("FTS5 index rebuilt successfully")
-                    print("FTS5 index rebuilt successfully", file=sys.stderr)
-                    return True
-
-                except Exception as repair_error:
-                    logger.error("Failed to repair FTS5 index: %s", repair_error)
-                    print(f"Failed to repair FTS5 index: {repair_error}", file=sys.stderr)
-                    return False
-                finally:
-                    # Release lock
-                    if lock_fd:
-                        fcntl.flock(lock_fd.fileno(), fcntl.LOCK_UN)
-                        lock_fd.close()
-                        try:
-                            lock_file.unlink()
-                        except:
-                            pass
-            raise  # Re-raise if not FTS5-related
+            const_code = int(code)
+        except (TypeError, ValueError):
+            raise ValueError(f"Invalid nutrient const_code: {code!r}")
+        if not isinstance(bound, dict) or set(bound) - {"min", "max"}:
+            raise ValueError(f'Invalid bounds for {code}: use {{"min": x, "max": y}}, got {bound!r}')
+        values = []
+        for key in ("min", "max"):
+            value = bound.get(key)
+            if value is not None and (isinstance(value, bool) or not isinstance(value, (int, float))):
+                raise ValueError(f"Invalid {key} for {code}: expected a number, got {value!r}")
+            values.append(None if value is None else float(value))
+        low, high = values
+        if require_bound and low is None and high is None:
+            raise ValueError(f"Bounds for {code} need min and/or max")
+        if low is not None and high is not None and low > high:
+            raise ValueError(f"Bounds for {code} have min > max")
+        bounds[const_code] = (low, high)
+    return bounds
+
+# Most foods returned by filter_foods
+MAX_FILTER_FOODS = 500
+
+def _filter_foods(bounds, sort_by, descending, group, limit):
+    matrix = get_matrix()
+    mask = matrix.filter(bounds, matrix.group_mask(group))
+    codes = list(bounds)
+    if sort_by is not None:
+        rows = matrix.rank(sort_by, mask, limit, descending)
+        if sort_by not in codes:
+            codes.append(sort_by)
+    else:
+        rows = mask.nonzero()[0][:limit]
+    return [matrix.food_record(row, codes) for row in rows]
+
+def _nutrient_stats(const_codes, group, alim_codes):
+    matrix = get_matrix()
+    mask = matrix.group_mask(group)
+    if alim_codes:
+        mask = mask & matrix.food_mask(alim_codes)
+    return matrix.aggregate(const_codes, mask)
+
+# Largest n accepted by top_foods
+MAX_TOP_FOODS = 500
+
+def _top_foods(const_code, n, group, descending):
+    matrix = get_matrix()
+    column = matrix.nutrient_column(const_code)
+    mask = matrix.group_mask(group) if group else None
+    return [
+        dict(matrix.food_record(row), value=float(matrix.values[row, column]))
+        for row in matrix.rank(const_code, mask, n, descending)
+    ]
 
+@mcp.tool()
+async def top_foods(const_code: int, n: int = 20, group: str | None = None, direction: str = "desc") -> list[dict]:
+    """Foods richest (or poorest) in one nutrient, from presorted indexes (no SQL).
+
+    const_code: nutrient, e.g. 10260 (iron), 55100 (vitamin C), 34100 (fiber)
+    n: number of foods (<= 500)
+    group: restrict to a food group/subgroup code (alim_grp_code, alim_ssgrp_code or alim_ssssgrp_code)
+    direction: "desc" (highest first, default) or "asc" (lowest first)
+
+    Foods without a value are skipped. Returns
+    [{alim_code, alim_nom_fr, alim_nom_eng, alim_grp_code, value}] with value per 100 g.
+    """
+    missing = _database_missing()
+    if missing:
+        return missing
+    if direction not in ("desc", "asc"):
+        return [{"error": "direction must be 'desc' or 'asc'"}]
     try:
-        if not DB_PATH.exists():
-            logger.info("First run: Downloading Ciqual database...")
-            print("First run: Downloading Ciqual database...", file=sys.stderr)
-            initialize_database()
-            logger.info("Database initialized successfully!")
-            print("Database initialized successfully!", file=sys.stderr)
-        elif should_update_database(DB_PATH):
-            logger.info("New CIQUAL version available, updating database...")
-            print("New CIQUAL version available, updating database...", file=sys.stderr)
-            initialize_database()
-            logger.info("Database updated successfully!")
-            print("Database updated successfully!", file=sys.stderr)
-        else:
-            # Auto-repair FTS5 index if corrupted (e.g., from concurrent writes)
-            repair_fts5_if_corrupted()
+        return await executor.run(
+            _top_foods, const_code, max(0, min(n, MAX_TOP_FOODS)), group, direction == "desc"
+        )
+    except ExecutorBusy as e:
+        return [{"error": f"Server busy: {str(e)}. Retry shortly."}]
     except Exception as e:
-        if not DB_PATH.exists():
-            logger.error("Failed to initialize database: %s", e)
-            print(f"Failed to initialize database: {e}", file=sys.stderr)
-            sys.exit(1)
-        else:
-            logger.warning("Failed to update database, using existing version: %s", e)
-            print(f"Failed to update database, using existing version: {e}", file=sys.stderr)
+        return _matrix_error(e)
+
+# Largest k accepted by similar_foods
+MAX_SIMILAR_FOODS = 100
+
+def _similar_foods(alim_code, k, nutrients, metric):
+    matrix = get_matrix()
+    neighbours = matrix.similar(alim_code, k, nutrients, metric)
+    return {
+        "reference": matrix.food_record(matrix.food_index[int(alim_code)]),
+        "metric": metric,
+        "similar": [
+            dict(matrix.food_record(row), distance=round(distance, 4), shared_nutrients=shared)
+            for row, distance, shared in neighbours
+        ],
+    }
+
+@mcp.tool()
+async def similar_foods(
+    alim_code: int,
+    k: int = 10,
+    nutrients: list[int] | None = None,
+    metric: str = "cosine",
+) -> dict | list[dict]:
+    """Foods with the most similar nutrient profile to alim_code (substitutions).
+
+    k: number of foods (<= 100)
+    nutrients: const_codes to compare, e.g. [328, 25000, 40000, 31000] for
+      energy and macros (default: all nutrients known for the food)
+    metric: "cosine" (profile shape, default) or "euclidean" (absolute amounts)
+
+    Nutrients are scaled by their spread across all foods; missing values are
+    ignored. Returns {"reference": {...}, "similar": [{alim_code, alim_nom_fr,
+    alim_nom_eng, alim_grp_code, distance, shared_nutrients}]}, nearest first.
+    """
+    missing = _database_missing()
+    if missing:
+        return missing
+    if metric not in ("cosine", "euclidean"):
+        return [{"error": "metric must be 'cosine' or 'euclidean'"}]
+    try:
+        return await executor.run(
+            _similar_foods, alim_code, max(1, min(k, MAX_SIMILAR_FOODS)), nutrients, metric
+        )
+    except ExecutorBusy as e:
+        return [{"error": f"Server busy: {str(e)}. Retry shortly."}]
+    except ValueError as e:
+        return [{"error": str(e)}]
+    except Exception as e:
+        return _matrix_error(e)
+
+# Most ingredients accepted by compute_meal
+MAX_MEAL_ITEMS = 200
+
+def _resolve_name(conn, name):
+    """Best-ranked alim_code for a food name, or None"""
+    terms = search.search_terms(name)
+    if not terms:
+        return None
+    matches = search.search_foods(conn, terms, "any", 1)
+    return matches[0]["alim_code"] if matches else None
+
+def _meal_item_error(item):
+    """Describe what is wrong with a compute_meal item, or None if it is valid"""
+    if not isinstance(item, dict):
+        return f"expected an object, got {item!r}"
+    grams = item.get("grams")
+    if isinstance(grams, bool) or not isinstance(grams, (int, float)) or not grams >= 0:
+        return f"grams must be a non-negative number, got {grams!r}"
+    code = item.get("alim_code")
+    if code is not None:
+        if isinstance(code, bool) or not isinstance(code, int):
+            return f"alim_code must be an integer, got {code!r}"
+        return None
+    name = item.get("name")
+    if not isinstance(name, str) or not name.strip():
+        return "needs an integer alim_code or a non-empty name"
+    return None
+
+def _compute_meal(items, nutrients):
+    import meals
+    matrix = get_matrix()
+    codes = []
+    with get_pool().connection() as conn, budget.enforce(conn):
+        for item in items:
+            code = item.get("alim_code")
+            if code is None:
+                code = _resolve_name(conn, item["name"])
+                if code is None:
+                    raise KeyError(f"No food matches name: {item['name']}")
+            if int(code) not in matrix.food_index:
+                raise KeyError(f"Unknown alim_code: {code}")
+            codes.append(int(code))
+
+    rows = [matrix.food_index[code] for code in codes]
+    grams = [float(item["grams"]) for item in items]
+    ingredients = []
+    for row, weight, item in zip(rows, grams, items):
+        record = dict(matrix.food_record(row), grams=weight)
+        if item.get("alim_code") is None:
+            record["name"] = item["name"]  # so the client can check the match
+        ingredients.append(record)
+    return {
+        "ingredients": ingredients,
+        "total_grams": sum(grams),
+        "nutrients": meals.meal_totals(matrix, rows, grams, nutrients),
+    }
+
+@mcp.tool()
+async def compute_meal(items: list[dict], nutrients: list[int] | None = None) -> dict | list[dict]:
+    """Nutrient totals of a meal or recipe in one call (no SQL, no arithmetic needed).
+
+    items: [{"alim_code": 2003, "grams": 150}, {"name": "pain baguette", "grams": 50}, ...]
+      Each item gives either alim_code or a food name (resolved to the best
+      search_foods match, check "ingredients" in the result) plus grams.
+    nutrients: const_codes to total (default: all)
+
+    Returns {"ingredients": [{alim_code, alim_nom_fr, ..., grams}], "total_grams",
+             "nutrients": [{const_code, const_nom_fr, unit, total, min, max, missing?}]}
+    min/max propagate CIQUAL's value bounds; "missing" lists ingredients
+    without a value for that nutrient (the total treats them as 0).
+    """
+    missing = _database_missing()
+    if missing:
+        return missing
+    if not items or len(items) > MAX_MEAL_ITEMS:
+        return [{"error": f"Provide between 1 and {MAX_MEAL_ITEMS} items"}]
+    for index, item in enumerate(items):
+        error = _meal_item_error(item)
+        if error:
+            return [{"error": f"Item {index}: {error}"}]
+    try:
+        return await executor.run(_compute_meal, items, nutrients)
+    except QueryCancelled as e:
+        return [e.to_dict()]
+    except ExecutorBusy as e:
+        return [{"error": f"Server busy: {str(e)}. Retry shortly."}]
+    except Exception as e:
+        return _matrix_error(e)
+
+# Most recipes accepted by one evaluate_recipes call (use the meals CLI beyond)
+MAX_RECIPES = 5000
+
+def _evaluate_recipes(recipes, nutrients):
+    import meals
+    matrix = get_matrix()
+    parsed = [meals.recipe_tuple(recipe, i) for i, recipe in enumerate(recipes)]
+    codes = nutrients or [int(code) for code in matrix.nutrient_codes]
+    results = []
+    for recipe_id, totals, unknown in meals.iter_recipe_totals(matrix, parsed, nutrients):
+        result = {"id": recipe_id, "values": totals}
+        if unknown:
+            result["unknown"] = unknown
+        results.append(result)
+    return {"nutrients": codes, "results": results}
+
+@mcp.tool()
+async def evaluate_recipes(recipes: list[dict], nutrients: list[int] | None = None) -> dict | list[dict]:
+    """Nutrient totals for many recipes at once (up to 5000 per call).
+
+    recipes: [{"id": "r1", "foods": {"2003": 150, "4001": 80}}, ...] — grams per alim_code
+    nutrients: const_codes to total (default: all)
+
+    Returns {"nutrients": [const_code, ...], "results": [{id, values: [...], unknown?}]}
+    where values is aligned with "nutrients" (null if no ingredient has a value)
+    and unknown lists alim_codes not in CIQUAL. For one meal use compute_meal.
+    """
+    missing = _database_missing()
+    if missing:
+        return missing
+    if len(recipes) > MAX_RECIPES:
+        return [{"error": f"Too many recipes ({len(recipes)}); at most {MAX_RECIPES} per call"}]
+    try:
+        return await executor.run(_evaluate_recipes, recipes, nutrients)
+    except ExecutorBusy as e:
+        return [{"error": f"Server busy: {str(e)}. Retry shortly."}]
+    except ValueError as e:
+        return [{"error": str(e)}]
+    except Exception as e:
+        return _matrix_error(e)
+
+def _optimize_diet(bounds, objective, allowed_groups, alim_codes, max_grams_per_food, costs):
+    import diet
+    matrix = get_matrix()
+    result = diet.optimize_diet(
+        matrix, bounds, objective, allowed_groups, alim_codes, max_grams_per_food, costs
+    )
+    totals = []
+    for code, total in result["totals"].items():
+        column = matrix.nutrient_column(code)
+        entry = {
+            "const_code": code,
+            "const_nom_fr": matrix.nutrients[column]["const_nom_fr"],
+            "unit": matrix.nutrients[column]["unit"],
+            "total": round(total, 4),
+        }
+        if code in bounds:
+            entry["min"], entry["max"] = bounds[code]
+        totals.append(entry)
+    return {
+        "objective": objective,
+        "objective_value": round(result["objective_value"], 4),
+        "foods": [dict(matrix.food_record(row), grams=round(grams, 1)) for row, grams in result["foods"]],
+        "total_grams": round(result["total_grams"], 1),
+        "totals": totals,
+    }
+
+@mcp.tool()
+async def optimize_diet(
+    constraints: dict[str, dict[str, float]],
+    objective: str = "energy",
+    allowed_groups: list[str] | None = None,
+    alim_codes: list[int] | None = None,
+    max_grams_per_food: float = 300,
+    costs: dict[str, float] | None = None,
+) -> dict | list[dict]:
+    """Find the food quantities meeting nutrient targets at the lowest calories/weight/cost (one call, no SQL).
+
+    constraints: nutrient totals for the whole diet, {"<const_code>": {"min": x, "max": y}}
+      e.g. {"25000": {"min": 60}, "10260": {"min": 14}, "10110": {"max": 2300}}
+      (protein >= 60 g, iron >= 14 mg, sodium <= 2300 mg)
+    objective: "energy" (min kcal, default), "weight" (min total grams),
+      "cost" (min sum of costs), "min:<const_code>" or "max:<const_code>"
+    allowed_groups: food group codes (any level) to pick from, e.g. ["04", "0601"]
+    alim_codes: restrict to these foods
+    max_grams_per_food: upper bound for each food's quantity (default 300 g)
+    costs: {"<alim_code>": price per 100 g}, required for objective "cost";
+      only foods with a price are used (CIQUAL has no prices)
+
+    Foods without a value for a constrained nutrient are not used.
+    Returns {"objective", "objective_value", "foods": [{alim_code, alim_nom_fr, ..., grams}],
+             "total_grams", "totals": [{const_code, const_nom_fr, unit, total, min?, max?}]}
+    """
+    missing = _database_missing()
+    if missing:
+        return missing
+    if not constraints:
+        return [{"error": "Provide at least one nutrient constraint"}]
+    try:
+        bounds = _parse_bounds(constraints)
+    except ValueError as e:
+        return [{"error": str(e)}]
+    if max_grams_per_food <= 0:
+        return [{"error": "max_grams_per_food must be positive"}]
+    try:
+        return await executor.run(
+            _optimize_diet, bounds, objective, allowed_groups, alim_codes, max_grams_per_food, costs
+        )
+    except ExecutorBusy as e:
+        return [{"error": f"Server busy: {str(e)}. Retry shortly."}]
+    except ValueError as e:
+        return [{"error": str(e)}]
+    except Exception as e:
+        return _matrix_error(e)
+
+# Largest alim_codes list accepted by get_foods
+MAX_GET_FOODS = 1000
+
+@mcp.tool()
+async def get_foods(alim_codes: list[int], nutrients: list[int] | None = None) -> dict | list[dict]:
+    """Full nutrient profiles for many foods in one call (no SQL, up to 1000 codes).
+
+    alim_codes: foods to fetch, e.g. from search_foods
+    nutrients: const_codes to include (default: all ~67)
+
+    Returns {"nutrients": [{const_code, const_nom_fr, const_nom_eng, unit}],
+             "foods": [{alim_code, alim_nom_fr, alim_nom_eng, alim_grp_code, values: [...]}],
+             "not_found": [alim_code, ...]}
+    Each food's values list is aligned with "nutrients" (per 100 g, null if unknown).
+    """
+    missing = _database_missing()
+    if missing:
+        return missing
+    if len(alim_codes) > MAX_GET_FOODS:
+        return [{"error": f"Too many alim_codes ({len(alim_codes)}); at most {MAX_GET_FOODS} per call"}]
+    try:
+        return await executor.run(_get_foods, alim_codes, nutrients)
+    except ExecutorBusy as e:
+        return [{"error": f"Server busy: {str(e)}. Retry shortly."}]
+    except Exception as e:
+        return _matrix_error(e)
+
+@mcp.tool()
+async def filter_foods(
+    conditions: dict[str, dict[str, float]],
+    sort_by: int | None = None,
+    descending: bool = True,
+    group: str | None = None,
+    limit: int = 50,
+) -> list[dict]:
+    """Filter and rank all foods by nutrient bounds in one vectorized pass (no SQL).
+
+    conditions: {const_code: {"min": x, "max": y}} per 100 g, either bound optional.
+      e.g. {"25000": {"min": 20}, "40000": {"max": 5}} = protein >= 20 g AND fat <= 5 g
+    sort_by: const_code to rank by (descending unless descending=false)
+    group: food group/subgroup code (alim_grp_code, alim_ssgrp_code or alim_ssssgrp_code)
+    limit: most foods to return (at most 500)
+
+    Foods with no value for a constrained nutrient are excluded. Returns
+    [{alim_code, alim_nom_fr, alim_nom_eng, alim_grp_code, values: {const_code: teneur}}].
+    """
+    missing = _database_missing()
+    if missing:
+        return missing
+    try:
+        bounds = _parse_bounds(conditions, require_bound=False)
+    except ValueError as e:
+        return [{"error": str(e)}]
+    try:
+        return await executor.run(_filter_foods, bounds, sort_by, descending, group, max(0, min(limit, MAX_FILTER_FOODS)))
+    except ExecutorBusy as e:
+        return [{"error": f"Server busy: {str(e)}. Retry shortly."}]
+    except Exception as e:
+        return _matrix_error(e)
+
+@mcp.tool()
+async def nutrient_stats(
+    const_codes: list[int] | None = None,
+    group: str | None = None,
+    alim_codes: list[int] | None = None,
+) -> list[dict]:
+    """Aggregate nutrient values (count, mean, median, min, max, std per 100 g) over many foods.
+
+    const_codes: nutrients to summarize (default: all)
+    group: restrict to a food group/subgroup code
+    alim_codes: restrict to these foods
+    """
+    missing = _database_missing()
+    if missing:
+        return missing
+    try:
+        return await executor.run(_nutrient_stats, const_codes, group, alim_codes)
+    except ExecutorBusy as e:
+        return [{"error": f"Server busy: {str(e)}. Retry shortly."}]
+    except Exception as e:
+        return _matrix_error(e)
+
+@mcp.tool()
+async def server_status() -> dict:
+    """Report query executor load, pool and cache usage, and cancelled queries.
+
+    Returns running/queued/completed/rejected query counts, pool size, result
+    cache hit/miss counts and the accumulated cost of queries cancelled by the
+    time/VM-step budget.
+    """
+    return {
+        "executor": executor.stats(),
+        "pool": get_pool().stats(),
+        "cache": result_cache.stats(),
+        "cancelled": dict(cancelled_stats),
+    }
+
+@mcp.tool()
+async def refresh_status() -> dict:
+    """Report the background database version check / update.
+
+    state: idle (no check needed yet), checking, updating, up_to_date,
+    updated or failed.
+    message is the latest loader progress line; record_id identifies the
+    CIQUAL release currently served (null until the first download finishes,
+    or when the server is too busy to look it up; "busy" is then true).
+    """
+    status = _refresh.status() if _refresh is not None else {"state": "idle"}
+    status["record_id"] = None
+    if DB_PATH.exists():
+        try:
+            status["record_id"] = await executor.run(dataset_version)
+        except ExecutorBusy:
+            status["busy"] = True
+    return status
+
+@contextmanager
+def _file_lock(db_path):
+    """Hold the exclusive lock serializing writers of ``db_path`` across processes"""
+    lock_file = Path(db_path).parent / ".ciqual.lock"
+    lock_file.parent.mkdir(parents=True, exist_ok=True)
+    with open(lock_file, "w") as lock_fd:
+        fcntl.flock(lock_fd.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_fd.fileno(), fcntl.LOCK_UN)
+
+def _fts_index_consistent(db_path):
+    conn = sqlite3.connect(db_path)
+    try:
+        return search.index_consistent(conn)
+    finally:
+        conn.close()
+
+def repair_fts5_if_corrupted(db_path):
+    """Rebuild the FTS5 index if it is corrupted or out of step with foods
+
+    Besides corruption (e.g. from concurrent writes), this catches indexes
+    built before foods_fts rowids were keyed on alim_code, on which ranked
+    search finds nothing. Uses file locking to prevent multiple instances
+    from repairing simultaneously.
+
+    Returns:
+        True if the index was rebuilt
+    """
+    if _fts_index_consistent(db_path):
+        return False
+    logger.warning("FTS5 index corrupted or stale, acquiring lock for repair...")
+    print("FTS5 index corrupted or stale, acquiring lock for repair...", file=sys.stderr)
+
+    try:
+        with _file_lock(db_path):
+            # Another instance might have repaired it while we waited
+            if _fts_index_consistent(db_path):
+                logger.info("FTS5 already repaired by another instance")
+                print("FTS5 already repaired by another instance", file=sys.stderr)
+                return False
+
+            logger.info("Lock acquired, rebuilding FTS5 index...")
+            conn = sqlite3.connect(db_path)
+            try:
+                conn.execute("INSERT INTO foods_fts(foods_fts) VALUES ('rebuild')")
+                conn.commit()
+            finally:
+                conn.close()
+    except sqlite3.Error as e:
+        logger.error("Failed to repair FTS5 index: %s", e)
+        print(f"Failed to repair FTS5 index: {e}", file=sys.stderr)
+        return False
+
+    logger.info("FTS5 index rebuilt successfully")
+    print("FTS5 index rebuilt successfully", file=sys.stderr)
+    return True
+
+def main():
+    """Main entry point for the MCP server
+
+    Starts serving immediately from the existing database while a
+    background thread checks for (and installs) a new CIQUAL release.
+    """
+    global _refresh
+
+    if DB_PATH.exists():
+        try:
+            # Auto-repair FTS5 index if corrupted (e.g., from concurrent writes)
+            repair_fts5_if_corrupted(DB_PATH)
+        except Exception as e:
+            logger.warning("FTS5 check failed: %s", e)
+    else:
+        logger.info("First run: downloading Ciqual database in the background...")
+        print("First run: downloading Ciqual database in the background...", file=sys.stderr)
+
+    if DB_PATH.exists() and checked_recently(DB_PATH):
+        # Fast path: no thread, no loader/lxml import
+        logger.info("Database checked for updates recently, skipping version check")
+    else:
+        # Version check and rebuild run off the startup path; the pool picks up
+        # the new file once the loader has swapped it in
+        _refresh = DatabaseRefresh(DB_PATH, _needs_update, _run_loader)
+        _refresh.start()
 
     logger.info("Starting Ciqual MCP server")
     print("Ciqual MCP server running", flush=True)
@@ -3,6 +3,7 @@
 import unittest
 import tempfile
 import shutil
+import json
 import sqlite3
 import sys
 import os
@@ -14,6 +15,65 @@ from database import SCHEMA_SQL
 from server import query
 import server
 
+def build_sample_database(path):
+    """Create a small Ciqual database with groups, bounds and confidence codes"""
+    conn = sqlite3.connect(path)
+    conn.executescript(SCHEMA_SQL)
+    conn.executemany(
+        "INSERT INTO nutrients (const_code, const_nom_fr, const_nom_eng, unit) VALUES (?, ?, ?, ?)",
+        [
+            (328, 'Energie (kcal/100g)', 'Energy (kcal/100g)', 'kcal/100g'),
+            (25000, 'Protéines (g/100g)', 'Protein (g/100g)', 'g/100g'),
+            (40000, 'Lipides (g/100g)', 'Fat (g/100g)', 'g/100g'),
+            (10260, 'Fer (mg/100g)', 'Iron (mg/100g)', 'mg/100g'),
+            (55100, 'Vitamine C (mg/100g)', 'Vitamin C (mg/100g)', 'mg/100g'),
+        ],
+    )
+    conn.executemany(
+        """INSERT INTO foods (alim_code, alim_nom_fr, alim_nom_eng, alim_grp_code,
+                              alim_ssgrp_code, alim_ssssgrp_code)
+           VALUES (?, ?, ?, ?, ?, ?)""",
+        [
+            (2028, 'Orange, pulpe, crue', 'Orange, raw', '02', '0204', '000000'),
+            (2003, 'Pomme, pulpe, crue', 'Apple, raw', '02', '0204', '000000'),
+            (2004, 'Pomme, cuite', 'Apple, cooked', '02', '0204', '000000'),
+            (3001, 'Boeuf, steak haché 15% MG, cru', 'Beef, minced, 15% fat, raw', '04', '0401', '040101'),
+            (3002, 'Boeuf, steak haché 5% MG, cru', 'Beef, minced, 5% fat, raw', '04', '0401', '040101'),
+            (4001, 'Lentille, cuite', 'Lentil, cooked', '02', '0203', '000000'),
+        ],
+    )
+    conn.executemany(
+        """INSERT INTO composition (alim_code, const_code, teneur, code_confiance, min, max)
+           VALUES (?, ?, ?, ?, ?, ?)""",
+        [
+            (2028, 328, 47, 'A', 40, 52), (2028, 25000, 0.9, 'A', None, None),
+            (2028, 40000, 0.1, 'B', None, None), (2028, 55100, 53.2, 'A', 45, 60),
+            (2028, 10260, 0.1, 'B', None, None),
+            (2003, 328, 52, 'A', None, None), (2003, 25000, 0.3, 'A', None, None),
+            (2003, 40000, 0.2, 'B', None, None), (2003, 55100, 4.6, 'B', None, None),
+            (2004, 328, 60, 'C', None, None), (2004, 25000, 0.3, 'C', None, None),
+            (2004, 55100, 2.0, 'C', None, None),
+            (3001, 328, 198, 'A', 180, 210), (3001, 25000, 18.6, 'A', 17, 20),
+            (3001, 40000, 15, 'A', None, None), (3001, 10260, 2.1, 'A', None, None),
+            (3002, 328, 125, 'A', None, None), (3002, 25000, 21.0, 'A', None, None),
+            (3002, 40000, 5, 'A', None, None), (3002, 10260, 2.4, 'A', None, None),
+            (4001, 328, 116, 'B', None, None), (4001, 25000, 9.0, 'B', None, None),
+            (4001, 40000, 0.4, 'B', None, None), (4001, 10260, 3.3, 'B', None, None),
+        ],
+    )
+    conn.execute("INSERT INTO foods_fts(foods_fts) VALUES ('rebuild')")
+    conn.execute("INSERT INTO metadata (key, value) VALUES ('zenodo_record_id', 'sample')")
+    conn.commit()
+    conn.close()
+
+def index_fts_like_baseline(path):
+    """Reindex foods_fts the way the original loader did (rowids 1..N, not alim_code)"""
+    conn = sqlite3.connect(path)
+    conn.execute("INSERT INTO foods_fts(foods_fts) VALUES ('delete-all')")
+    conn.execute("INSERT INTO foods_fts SELECT alim_code, alim_nom_fr, alim_nom_eng, alim_nom_sci FROM foods")
+    conn.commit()
+    conn.close()
+
 class TestCiqualFunctional(unittest.TestCase):
     
     @classmethod
@@ -57,7 +117,7 @@ class TestCiqualFunctional(unittest.TestCase):
         """)
         
         # Build FTS index
-        conn.execute("INSERT INTO foods_fts SELECT alim_code, alim_nom_fr, alim_nom_eng, alim_nom_sci FROM foods")
+        conn.execute("INSERT INTO foods_fts(foods_fts) VALUES ('rebuild')")
         
         conn.commit()
         conn.close()
@@ -160,6 +220,941 @@ class TestCiqualFunctional(unittest.TestCase):
         result = await query("SELECT COUNT(*) as count FROM foods")
         self.assertEqual(result[0]['count'], 3)
 
+class TestConnectionPool(unittest.TestCase):
+
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.db_path = Path(self.test_dir) / "pool.db"
+        self._write_db(self.db_path, rows=1)
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    @staticmethod
+    def _write_db(path, rows):
+        conn = sqlite3.connect(path)
+        conn.execute("CREATE TABLE t (x INTEGER)")
+        conn.executemany("INSERT INTO t VALUES (?)", [(i,) for i in range(rows)])
+        conn.commit()
+        conn.close()
+
+    def test_connections_are_reused(self):
+        """Test that a released connection is handed out again"""
+        from pool import ConnectionPool
+        pool = ConnectionPool(self.db_path, size=2)
+        with pool.connection() as first:
+            pass
+        with pool.connection() as second:
+            self.assertIs(first, second)
+        self.assertEqual(pool.stats()["open"], 1)
+        pool.close()
+
+    def test_connections_are_read_only(self):
+        """Test that pooled connections reject writes"""
+        from pool import ConnectionPool
+        pool = ConnectionPool(self.db_path, size=1)
+        with self.assertRaises(sqlite3.OperationalError):
+            with pool.connection() as conn:
+                conn.execute("INSERT INTO t VALUES (99)")
+        pool.close()
+
+    def test_recycles_after_database_swap(self):
+        """Test that replacing the database file recycles idle connections"""
+        from pool import ConnectionPool
+        pool = ConnectionPool(self.db_path, size=2)
+        with pool.connection() as conn:
+            self.assertEqual(conn.execute("SELECT COUNT(*) FROM t").fetchone()[0], 1)
+        generation = pool.generation
+
+        new_path = Path(self.test_dir) / "pool.new.db"
+        self._write_db(new_path, rows=5)
+        os.replace(new_path, self.db_path)
+
+        with pool.connection() as conn:
+            self.assertEqual(conn.execute("SELECT COUNT(*) FROM t").fetchone()[0], 5)
+        self.assertGreater(pool.generation, generation)
+        pool.close()
+
+    def test_waiter_wakes_when_stale_connection_is_discarded(self):
+        """Test that a caller blocked on a full pool gets the slot freed by a swap"""
+        import threading
+        import time
+        from pool import ConnectionPool
+        pool = ConnectionPool(self.db_path, size=1, timeout=10)
+        results = []
+
+        def wait_for_connection():
+            with pool.connection() as conn:
+                results.append(conn.execute("SELECT COUNT(*) FROM t").fetchone()[0])
+
+        with pool.connection():
+            waiter = threading.Thread(target=wait_for_connection)
+            waiter.start()
+            time.sleep(0.1)
+            new_path = Path(self.test_dir) / "pool.new.db"
+            self._write_db(new_path, rows=3)
+            os.replace(new_path, self.db_path)
+            pool.generation  # the leased connection is now stale
+        started = time.monotonic()
+        waiter.join(timeout=10)
+        self.assertLess(time.monotonic() - started, 2)
+        self.assertEqual(results, [3])
+        pool.close()
+
+    def test_in_memory_pool_serves_from_ram(self):
+        """Test that in-memory connections read a RAM copy and pick up swaps"""
+        from pool import ConnectionPool
+        pool = ConnectionPool(self.db_path, size=2, in_memory=True)
+        with pool.connection() as conn:
+            self.assertNotEqual(conn.execute("PRAGMA database_list").fetchone()["file"], str(self.db_path))
+            self.assertEqual(conn.execute("SELECT COUNT(*) FROM t").fetchone()[0], 1)
+            with self.assertRaises(sqlite3.OperationalError):
+                conn.execute("INSERT INTO t VALUES (99)")
+        self.assertGreater(pool.stats()["image_bytes"], 0)
+
+        new_path = Path(self.test_dir) / "pool.new.db"
+        self._write_db(new_path, rows=5)
+        os.replace(new_path, self.db_path)
+        with pool.connection() as conn:
+            self.assertEqual(conn.execute("SELECT COUNT(*) FROM t").fetchone()[0], 5)
+        pool.close()
+
+class TestQueryBudget(unittest.TestCase):
+
+    RUNAWAY_SQL = """
+        WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n)
+        SELECT COUNT(*) FROM n
+    """
+
+    def test_timeout_cancels_statement(self):
+        """Test that a runaway statement is interrupted by the wall-clock budget"""
+        from budget import QueryBudget, QueryCancelled
+        conn = sqlite3.connect(":memory:")
+        budget = QueryBudget(timeout=0.1)
+        with self.assertRaises(QueryCancelled) as ctx:
+            with budget.enforce(conn):
+                conn.execute(self.RUNAWAY_SQL).fetchall()
+        self.assertEqual(ctx.exception.reason, "timeout")
+        self.assertTrue(ctx.exception.to_dict()["cancelled"])
+        # Handler is removed so the connection is reusable
+        self.assertEqual(conn.execute("SELECT 1").fetchone()[0], 1)
+        conn.close()
+
+    def test_vm_step_limit_cancels_statement(self):
+        """Test that the instruction budget stops a statement"""
+        from budget import QueryBudget, QueryCancelled
+        conn = sqlite3.connect(":memory:")
+        budget = QueryBudget(timeout=0, max_steps=100_000)
+        with self.assertRaises(QueryCancelled) as ctx:
+            with budget.enforce(conn):
+                conn.execute(self.RUNAWAY_SQL).fetchall()
+        self.assertEqual(ctx.exception.reason, "vm_steps")
+        self.assertGreater(ctx.exception.vm_steps, 100_000)
+        conn.close()
+
+class TestQueryCaching(unittest.TestCase):
+
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.db_path = Path(self.test_dir) / "ciqual.db"
+        self._write_db(self.db_path, "1", ["Pomme"])
+        self.original_db_path = server.DB_PATH
+        server.DB_PATH = self.db_path
+        server.result_cache.clear()
+
+    def tearDown(self):
+        server.DB_PATH = self.original_db_path
+        server.result_cache.clear()
+        shutil.rmtree(self.test_dir)
+
+    @staticmethod
+    def _write_db(path, record_id, names):
+        conn = sqlite3.connect(path)
+        conn.executescript(SCHEMA_SQL)
+        conn.executemany(
+            "INSERT INTO foods (alim_code, alim_nom_fr) VALUES (?, ?)",
+            list(enumerate(names, start=1)),
+        )
+        conn.execute("INSERT INTO metadata VALUES ('zenodo_record_id', ?)", (record_id,))
+        conn.commit()
+        conn.close()
+
+    def test_repeated_query_hits_cache(self):
+        """Test that reformatted repeats of a query are served from cache"""
+        import asyncio
+        first = asyncio.run(query("SELECT alim_nom_fr FROM foods"))
+        hits = server.result_cache.stats()["hits"]
+        second = asyncio.run(query("SELECT alim_nom_fr\n   FROM foods;"))
+        self.assertEqual(first, second)
+        self.assertEqual(server.result_cache.stats()["hits"], hits + 1)
+
+    def test_database_swap_invalidates_cache(self):
+        """Test that swapping in a new database drops cached results"""
+        import asyncio
+        self.assertEqual(asyncio.run(query("SELECT COUNT(*) AS n FROM foods"))[0]["n"], 1)
+
+        new_path = Path(self.test_dir) / "ciqual.new.db"
+        self._write_db(new_path, "2", ["Pomme", "Poire"])
+        os.replace(new_path, self.db_path)
+
+        self.assertEqual(asyncio.run(query("SELECT COUNT(*) AS n FROM foods"))[0]["n"], 2)
+        self.assertEqual(server.dataset_version(), "2")
+
+class TestQueryPagination(unittest.TestCase):
+
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.db_path = Path(self.test_dir) / "ciqual.db"
+        conn = sqlite3.connect(self.db_path)
+        conn.executescript(SCHEMA_SQL)
+        conn.executemany(
+            "INSERT INTO foods (alim_code, alim_nom_fr) VALUES (?, ?)",
+            [(i, f"Aliment {i}") for i in range(1, 26)],
+        )
+        conn.commit()
+        conn.close()
+        self.saved = (server.DB_PATH, server.MAX_ROWS)
+        server.DB_PATH = self.db_path
+        server.MAX_ROWS = 10
+        server.result_cache.clear()
+
+    def tearDown(self):
+        server.DB_PATH, server.MAX_ROWS = self.saved
+        server.result_cache.clear()
+        shutil.rmtree(self.test_dir)
+
+    def test_pages_through_large_result(self):
+        """Test that capped results can be paged with the continuation cursor"""
+        import asyncio
+        sql = "SELECT alim_code FROM foods ORDER BY alim_code"
+        codes = []
+        cursor = None
+        pages = 0
+        while True:
+            page = asyncio.run(query(sql, cursor))
+            pages += 1
+            if page and page[-1].get("truncated"):
+                cursor = page[-1]["next_cursor"]
+                page = page[:-1]
+            else:
+                cursor = None
+            codes.extend(row["alim_code"] for row in page)
+            if cursor is None:
+                break
+        self.assertEqual(pages, 3)
+        self.assertEqual(codes, list(range(1, 26)))
+
+    def test_table_format_pages(self):
+        """Test that table format returns column names once and row arrays"""
+        import asyncio
+        sql = "SELECT alim_code, alim_nom_fr FROM foods ORDER BY alim_code"
+        page = asyncio.run(query(sql, format="table"))
+        self.assertEqual(page["columns"], ["alim_code", "alim_nom_fr"])
+        self.assertEqual(page["rows"][0], [1, "Aliment 1"])
+        self.assertEqual(len(page["rows"]), 10)
+        self.assertTrue(page["truncated"])
+
+        columns = asyncio.run(query(sql, format="columns"))
+        self.assertEqual(columns["data"]["alim_code"][:3], [1, 2, 3])
+
+    def test_cursor_rejected_for_other_query(self):
+        """Test that a cursor cannot be replayed against different SQL"""
+        import asyncio
+        page = asyncio.run(query("SELECT alim_code FROM foods"))
+        token = page[-1]["next_cursor"]
+        result = asyncio.run(query("SELECT alim_nom_fr FROM foods", token))
+        self.assertIn("Invalid cursor", result[0]["error"])
+
+class TestSearchFoods(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.test_dir = tempfile.mkdtemp()
+        cls.db_path = Path(cls.test_dir) / "ciqual.db"
+        build_sample_database(cls.db_path)
+        cls.original_db_path = server.DB_PATH
+        server.DB_PATH = cls.db_path
+
+    @classmethod
+    def tearDownClass(cls):
+        server.DB_PATH = cls.original_db_path
+        server.result_cache.clear()
+        shutil.rmtree(cls.test_dir)
+
+    def test_repair_rebuilds_index_with_foreign_rowids(self):
+        """Test that an index from the original loader is detected and rebuilt at startup"""
+        import search
+        path = Path(self.test_dir) / "baseline.db"
+        build_sample_database(path)
+        self.assertFalse(server.repair_fts5_if_corrupted(path))
+
+        index_fts_like_baseline(path)
+        conn = sqlite3.connect(path)
+        self.assertEqual(search.search_foods(conn, ("pomme",)), [])
+        conn.close()
+
+        self.assertTrue(server.repair_fts5_if_corrupted(path))
+        conn = sqlite3.connect(path)
+        self.assertEqual([r["alim_code"] for r in search.search_foods(conn, ("pomme",))], [2004, 2003])
+        conn.close()
+
+    def test_ranked_prefix_search(self):
+        """Test that all words must match, accents are optional and shorter names rank first"""
+        import asyncio
+        results = asyncio.run(server.search_foods("pomm"))
+        self.assertEqual([r["alim_code"] for r in results], [2004, 2003])
+        self.assertEqual(set(results[0]), {"alim_code", "alim_nom_fr", "alim_nom_eng", "alim_grp_code", "score"})
+
+        results = asyncio.run(server.search_foods("boeuf hache 5"))
+        self.assertEqual([r["alim_code"] for r in results], [3002])
+
+    def test_language_and_fallback(self):
+        """Test English-only matching and the any-word fallback"""
+        import asyncio
+        self.assertEqual([r["alim_code"] for r in asyncio.run(server.search_foods("apple", lang="eng"))], [2004, 2003])
+        self.assertEqual(asyncio.run(server.search_foods("apple", lang="fr")), [])
+        fallback = asyncio.run(server.search_foods("orange lentille"))
+        self.assertEqual(sorted(r["alim_code"] for r in fallback), [2028, 4001])
+
+    def test_syntax_is_not_passed_through(self):
+        """Test that FTS5 operators in the text cannot cause query errors"""
+        import asyncio
+        self.assertEqual([r["alim_code"] for r in asyncio.run(server.search_foods('"orange* NEAR( OR'))], [2028])
+        self.assertIn("error", asyncio.run(server.search_foods("  ()  "))[0])
+        self.assertIn("error", asyncio.run(server.search_foods("pomme", lang="de"))[0])
+
+    def test_results_are_cached_per_term(self):
+        """Test that a repeated search is answered from the result cache"""
+        import asyncio
+        server.result_cache.clear()
+        asyncio.run(server.search_foods("Orange"))
+        hits = server.result_cache.stats()["hits"]
+        asyncio.run(server.search_foods("orange,"))
+        self.assertEqual(server.result_cache.stats()["hits"], hits + 1)
+
+class TestNutrientMatrix(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.test_dir = tempfile.mkdtemp()
+        cls.db_path = Path(cls.test_dir) / "ciqual.db"
+        build_sample_database(cls.db_path)
+        cls.original_db_path = server.DB_PATH
+        server.DB_PATH = cls.db_path
+
+    @classmethod
+    def tearDownClass(cls):
+        server.DB_PATH = cls.original_db_path
+        shutil.rmtree(cls.test_dir)
+
+    def test_matrix_shape_and_missing_values(self):
+        """Test that composition is pivoted with NaN for missing values"""
+        import math
+        matrix = server.get_matrix()
+        self.assertEqual(matrix.shape, (6, 5))
+        row = matrix.food_index[2004]
+        self.assertTrue(math.isnan(matrix.values[row, matrix.nutrient_column(40000)]))
+        self.assertEqual(matrix.mins[matrix.food_index[3001], matrix.nutrient_column(25000)], 17)
+        self.assertEqual(matrix.confidence[row, matrix.nutrient_column(328)], 3)
+        self.assertEqual(matrix.version, "sample")
+
+    def test_sidecar_round_trip(self):
+        """Test that the matrix sidecar maps back to identical arrays"""
+        import numpy as np
+        from matrix import NutrientMatrix, dataset_stamp
+        conn = sqlite3.connect(self.db_path)
+        built = NutrientMatrix.from_connection(conn)
+        sidecar = Path(self.test_dir) / "roundtrip.matrix"
+        built.save(sidecar, dataset_stamp(conn))
+
+        loaded, stamp = NutrientMatrix.load(sidecar)
+        self.assertEqual(stamp, dataset_stamp(conn))
+        np.testing.assert_array_equal(loaded.values, built.values)
+        np.testing.assert_array_equal(loaded.confidence, built.confidence)
+        self.assertFalse(loaded.values.flags.writeable)
+        self.assertEqual(loaded.food_index, built.food_index)
+        self.assertEqual(list(loaded.food_names["fr"]), list(built.food_names["fr"]))
+
+        # A sidecar from another dataset is rebuilt instead of mapped
+        conn.execute("UPDATE metadata SET value = 'other' WHERE key = 'zenodo_record_id'")
+        rebuilt = NutrientMatrix.load_or_build(conn, sidecar)
+        self.assertEqual(rebuilt.version, "other")
+        self.assertEqual(NutrientMatrix.load(sidecar)[1]["zenodo_record_id"], "other")
+        conn.close()
+
+    def test_filter_foods_tool(self):
+        """Test filtering by nutrient bounds and ranking by another nutrient"""
+        import asyncio
+        result = asyncio.run(server.filter_foods(
+            {"25000": {"min": 5}, "40000": {"max": 10}}, sort_by=10260,
+        ))
+        self.assertEqual([r["alim_code"] for r in result], [4001, 3002])
+        self.assertEqual(result[0]["values"]["10260"], 3.3)
+
+    def test_filter_foods_group_and_unknown_nutrient(self):
+        """Test group restriction and error for unknown nutrients"""
+        import asyncio
+        from unittest.mock import patch
+        result = asyncio.run(server.filter_foods({}, sort_by=328, descending=False, group="0204", limit=2))
+        self.assertEqual([r["alim_code"] for r in result], [2028, 2003])
+        with patch.object(server, "MAX_FILTER_FOODS", 1):
+            self.assertEqual(len(asyncio.run(server.filter_foods({}, limit=10**9))), 1)
+        result = asyncio.run(server.filter_foods({"99999": {"min": 1}}))
+        self.assertIn("99999", result[0]["error"])
+        for conditions, message in [
+            ({"25000": 5}, "Invalid bounds for 25000"),
+            ({"protein": {"min": 5}}, "Invalid nutrient const_code"),
+            ({"25000": {"min": "high"}}, "Invalid min for 25000"),
+            ({"25000": {"minimum": 5}}, "Invalid bounds for 25000"),
+            ({"25000": {"min": 10, "max": 5}}, "min > max"),
+        ]:
+            self.assertIn(message, asyncio.run(server.filter_foods(conditions))[0]["error"])
+
+    def test_nutrient_stats_tool(self):
+        """Test aggregation over a food group"""
+        import asyncio
+        result = asyncio.run(server.nutrient_stats([25000], group="04"))
+        self.assertEqual(result[0]["count"], 2)
+        self.assertAlmostEqual(result[0]["mean"], 19.8)
+        self.assertEqual(result[0]["max"], 21.0)
+
+    def test_top_foods_tool(self):
+        """Test presorted top-N in both directions, with a group filter"""
+        import asyncio
+        result = asyncio.run(server.top_foods(25000, n=3))
+        self.assertEqual([(r["alim_code"], r["value"]) for r in result], [(3002, 21.0), (3001, 18.6), (4001, 9.0)])
+        result = asyncio.run(server.top_foods(25000, n=2, direction="asc"))
+        self.assertEqual([r["alim_code"] for r in result], [2003, 2004])
+        result = asyncio.run(server.top_foods(40000, n=10, group="0204"))
+        # 2004 has no fat value and is skipped
+        self.assertEqual([r["alim_code"] for r in result], [2003, 2028])
+        self.assertIn("error", asyncio.run(server.top_foods(25000, direction="up"))[0])
+
+    def test_rank_matches_full_sort(self):
+        """Test that the presorted walk agrees with sorting the masked column"""
+        import numpy as np
+        matrix = server.get_matrix()
+        column = matrix.values[:, matrix.nutrient_column(328)]
+        mask = matrix.group_mask("02")
+        expected = [r for r in np.argsort(-column, kind="stable") if mask[r] and not np.isnan(column[r])]
+        self.assertEqual(list(matrix.rank(328, mask, n=10)), expected)
+        with self.assertRaises(ValueError):
+            mask[0] = False  # cached group masks are read-only
+
+    def test_similar_foods_tool(self):
+        """Test nearest neighbours by profile, skipping the reference food"""
+        import asyncio
+        result = asyncio.run(server.similar_foods(3001, k=2, nutrients=[328, 25000, 40000], metric="euclidean"))
+        self.assertEqual(result["reference"]["alim_code"], 3001)
+        self.assertEqual(result["similar"][0]["alim_code"], 3002)
+        self.assertEqual(result["similar"][0]["shared_nutrients"], 3)
+        self.assertEqual(len(result["similar"]), 2)
+
+        # Apple raw vs cooked: same shape; 2004 lacks fat but still shares 2 of 3 nutrients
+        result = asyncio.run(server.similar_foods(2003, k=1, nutrients=[328, 25000, 40000]))
+        self.assertEqual(result["similar"][0]["alim_code"], 2004)
+
+        self.assertIn("9999", asyncio.run(server.similar_foods(9999))[0]["error"])
+        self.assertIn("error", asyncio.run(server.similar_foods(2003, metric="manhattan"))[0])
+
+    def test_compute_meal_tool(self):
+        """Test weighted totals, name resolution and bound propagation"""
+        import asyncio
+        result = asyncio.run(server.compute_meal(
+            [{"alim_code": 3001, "grams": 150}, {"name": "lentille", "grams": 200}],
+            nutrients=[328, 25000, 55100],
+        ))
+        self.assertEqual([i["alim_code"] for i in result["ingredients"]], [3001, 4001])
+        self.assertEqual(result["ingredients"][1]["name"], "lentille")
+        self.assertEqual(result["total_grams"], 350)
+        energy, protein, vitamin_c = result["nutrients"]
+        self.assertAlmostEqual(energy["total"], 1.5 * 198 + 2 * 116)
+        # 3001 has bounds 180-210; 4001 has none and uses its value
+        self.assertAlmostEqual(energy["min"], 1.5 * 180 + 2 * 116)
+        self.assertAlmostEqual(energy["max"], 1.5 * 210 + 2 * 116)
+        self.assertEqual(energy["unit"], "kcal")
+        self.assertAlmostEqual(protein["total"], 1.5 * 18.6 + 2 * 9.0)
+        self.assertIsNone(vitamin_c["total"])
+
+        self.assertIn("error", asyncio.run(server.compute_meal([{"name": "zzzz", "grams": 10}]))[0])
+        self.assertIn("error", asyncio.run(server.compute_meal([{"alim_code": 2003}]))[0])
+        for item, message in [
+            ({"alim_code": None, "grams": 10}, "non-empty name"),
+            ({"alim_code": "abc", "grams": 10}, "alim_code must be an integer"),
+            ({"name": "  ", "grams": 10}, "non-empty name"),
+            ({"alim_code": 2003, "grams": "10"}, "grams must be a non-negative number"),
+            ({"alim_code": 2003, "grams": -5}, "grams must be a non-negative number"),
+            ("2003", "expected an object"),
+        ]:
+            error = asyncio.run(server.compute_meal([{"alim_code": 3001, "grams": 100}, item]))[0]["error"]
+            self.assertTrue(error.startswith("Item 1:"), error)
+            self.assertIn(message, error)
+
+    def test_recipe_batches_match_meal_totals(self):
+        """Test chunked sparse totals against compute_meal, including empty and unknown recipes"""
+        import asyncio
+        import io
+        import meals
+        recipes = [
+            {"id": "a", "foods": {"3001": 150, "4001": 200}},
+            {"id": "empty", "foods": {}},
+            {"id": "b", "foods": {"2003": 100, "9999": 50}},
+            {"id": "c", "foods": {"2004": 80}},
+        ]
+        result = asyncio.run(server.evaluate_recipes(recipes, nutrients=[328, 40000]))
+        self.assertEqual(result["nutrients"], [328, 40000])
+        by_id = {r["id"]: r for r in result["results"]}
+        self.assertAlmostEqual(by_id["a"]["values"][0], 1.5 * 198 + 2 * 116)
+        self.assertEqual(by_id["empty"]["values"], [None, None])
+        self.assertEqual(by_id["b"]["unknown"], [9999])
+        self.assertEqual(by_id["c"]["values"], [48.0, None])
+
+        # Chunk boundaries do not change results
+        matrix = server.get_matrix()
+        streamed = list(meals.iter_recipe_totals(matrix, map(meals.recipe_tuple, recipes), [328, 40000], chunk_size=1))
+        self.assertEqual([totals for _, totals, _ in streamed], [r["values"] for r in result["results"]])
+
+        csv_rows = io.StringIO("recipe_id,alim_code,grams\na,3001,150\na,4001,200\nc,2004,80\n")
+        self.assertEqual(
+            [(rid, codes) for rid, codes, _ in meals.read_csv_recipes(csv_rows)],
+            [("a", [3001, 4001]), ("c", [2004])],
+        )
+
+    def test_optimize_diet_tool(self):
+        """Test lowest-energy diets, the per-food bound, objectives and infeasibility"""
+        import asyncio
+        import diet
+        import numpy as np
+        # 3002 has the most protein per kcal; 60 g protein fits under 300 g of it
+        result = asyncio.run(server.optimize_diet({"25000": {"min": 60}}))
+        self.assertEqual([(f["alim_code"], f["grams"]) for f in result["foods"]], [(3002, 285.7)])
+        self.assertAlmostEqual(result["objective_value"], 60 / 21.0 * 125, places=3)
+        self.assertEqual(result["totals"][0]["min"], 60)
+
+        # 70 g needs the next best food once 3002 hits max_grams_per_food
+        result = asyncio.run(server.optimize_diet({"25000": {"min": 70}}))
+        grams = {f["alim_code"]: f["grams"] for f in result["foods"]}
+        self.assertEqual(grams, {3002: 300.0, 3001: round(7 / 18.6 * 100, 1)})
+        self.assertAlmostEqual(result["totals"][1]["total"], 375 + 7 / 18.6 * 198, places=3)
+
+        result = asyncio.run(server.optimize_diet(
+            {"25000": {"min": 10}}, objective="cost", costs={"4001": 0.2, "3001": 1.5}
+        ))
+        self.assertEqual([f["alim_code"] for f in result["foods"]], [4001])
+        result = asyncio.run(server.optimize_diet({"328": {"max": 100}}, objective="max:25000", allowed_groups=["0204"]))
+        self.assertEqual([f["alim_code"] for f in result["foods"]], [2028])
+
+        # Reloading the matrix drops the blocks cached for the old one
+        self.assertGreater(diet.candidate_block.cache_info().currsize, 0)
+        server._matrix["matrix"] = None
+        server.get_matrix()
+        self.assertEqual(diet.candidate_block.cache_info().currsize, 0)
+
+        self.assertIn("error", asyncio.run(server.optimize_diet({"25000": {"min": 500}}))[0])
+        self.assertIn("error", asyncio.run(server.optimize_diet({"25000": {"min": 5}}, objective="cost"))[0])
+        self.assertIn("error", asyncio.run(server.optimize_diet({"12345": {"min": 5}}))[0])
+        for kwargs, message in [
+            ({"objective": "min:abc"}, "Invalid objective 'min:abc'"),
+            ({"objective": "cheapest"}, "Unknown objective: cheapest"),
+            ({"objective": "cost", "costs": {"apple": 1.0}}, "Invalid alim_code in costs: 'apple'"),
+            ({"objective": "cost", "costs": {"4001": "cheap"}}, "Invalid cost for 4001"),
+        ]:
+            error = asyncio.run(server.optimize_diet({"25000": {"min": 5}}, **kwargs))[0]["error"]
+            self.assertIn(message, error)
+
+        # The bundled simplex handles range rows and upper-bound flips
+        A = np.array([[1.0, 2.0, 0.5], [3.0, 1.0, 4.0]])
+        x = diet.simplex(np.array([1.0, 1.5, 2.0]), A, np.array([4.0, -np.inf]), np.array([6.0, 9.0]),
+                         np.array([2.0, 2.0, 2.0]))
+        self.assertAlmostEqual(float(np.array([1.0, 1.5, 2.0]) @ x), 3.0)
+        self.assertTrue(np.all(A @ x <= [6 + 1e-9, 9 + 1e-9]) and A[0] @ x >= 4 - 1e-9)
+
+    def test_get_foods_tool(self):
+        """Test batch profiles aligned with the nutrient list, in request order"""
+        import asyncio
+        result = asyncio.run(server.get_foods([3002, 2004, 9999, 3002], nutrients=[25000, 40000]))
+        self.assertEqual([n["const_code"] for n in result["nutrients"]], [25000, 40000])
+        self.assertEqual([f["alim_code"] for f in result["foods"]], [3002, 2004])
+        self.assertEqual(result["foods"][0]["values"], [21.0, 5.0])
+        self.assertEqual(result["foods"][1]["values"], [0.3, None])
+        self.assertEqual(result["not_found"], [9999])
+
+        full = asyncio.run(server.get_foods([2028]))
+        self.assertEqual(len(full["foods"][0]["values"]), 5)
+        self.assertIn("error", asyncio.run(server.get_foods([2028], nutrients=[12345]))[0])
+
+class TestAtomicRebuild(unittest.TestCase):
+
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.db_path = Path(self.test_dir) / "ciqual.db"
+        build_sample_database(self.db_path)
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def test_failed_import_leaves_live_database_untouched(self):
+        """Test that a failing rebuild never replaces or corrupts the live file"""
+        from unittest.mock import patch
+        import data_loader
+
+        inode = os.stat(self.db_path).st_ino
+        meta = {
+            "record_id": "new",
+            "version": "2025",
+            "files": [
+                {"name": "alim_2025.xml", "download_url": "http://stand-in/alim"},
+                {"name": "const_2025.xml", "download_url": "http://stand-in/const"},
+                {"name": "compo_2025.xml", "download_url": "http://stand-in/compo"},
+            ],
+        }
+        with patch.object(data_loader, "_fetch_zenodo_metadata", return_value=meta), \
+             patch.object(data_loader, "_download_file", side_effect=IOError("connection reset")):
+            with self.assertRaises(IOError):
+                data_loader.initialize_database(force_update=True, db_path=self.db_path)
+
+        self.assertEqual(os.stat(self.db_path).st_ino, inode)
+        self.assertFalse([n for n in os.listdir(self.test_dir) if n.startswith(".ciqual-")])
+        conn = sqlite3.connect(self.db_path)
+        self.assertEqual(conn.execute("SELECT COUNT(*) FROM foods").fetchone()[0], 6)
+        conn.close()
+
+class TestArtifact(unittest.TestCase):
+
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.source = Path(self.test_dir) / "build" / "ciqual.db"
+        self.source.parent.mkdir()
+        build_sample_database(self.source)
+        self.target = Path(self.test_dir) / "node" / "ciqual.db"
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def test_build_and_install_round_trip(self):
+        """Test that an xz artifact installs the same database and matrix without XML"""
+        from unittest.mock import patch
+        import data_loader
+        from artifact import build_artifact
+        from matrix import NutrientMatrix, dataset_stamp, matrix_path
+
+        conn = sqlite3.connect(self.source)
+        NutrientMatrix.from_connection(conn).save(matrix_path(self.source), dataset_stamp(conn))
+        conn.close()
+        manifest = build_artifact(self.source, Path(self.test_dir) / "dist")
+        self.assertEqual(manifest.name, "ciqual-sample.json")
+
+        with patch.object(data_loader, "_fetch_zenodo_metadata") as fetch:
+            data_loader.initialize_database(db_path=self.target, artifact=manifest.parent)
+            fetch.assert_not_called()
+
+        self.assertEqual(self.target.read_bytes(), self.source.read_bytes())
+        conn = sqlite3.connect(self.target)
+        loaded, stamp = NutrientMatrix.load(matrix_path(self.target))
+        self.assertEqual(stamp, dataset_stamp(conn))
+        conn.close()
+        self.assertEqual(sorted(os.listdir(self.target.parent)), ["ciqual.db", "ciqual.matrix"])
+
+    def test_first_run_uses_environment_artifact(self):
+        """Test that CIQUAL_ARTIFACT is installed when no database exists yet"""
+        from unittest.mock import patch
+        import data_loader
+        from artifact import build_artifact, find_artifact
+        with patch.dict(os.environ):
+            os.environ.pop("CIQUAL_ARTIFACT", None)
+            self.assertIsNone(find_artifact())
+        manifest = build_artifact(self.source, Path(self.test_dir) / "dist")
+        with patch.dict(os.environ, {"CIQUAL_ARTIFACT": str(manifest)}):
+            data_loader.initialize_database(db_path=self.target)
+        conn = sqlite3.connect(self.target)
+        self.assertEqual(conn.execute("SELECT COUNT(*) FROM foods").fetchone()[0], 6)
+        conn.close()
+
+    def test_corrupt_artifact_is_rejected(self):
+        """Test that a checksum mismatch leaves the current database untouched"""
+        from artifact import ArtifactError, build_artifact, install_artifact
+        manifest = build_artifact(self.source, Path(self.test_dir) / "dist")
+        compressed = manifest.parent / "ciqual-sample.db.xz"
+        data = bytearray(compressed.read_bytes())
+        data[-20] ^= 0xFF
+        compressed.write_bytes(bytes(data))
+
+        self.target.parent.mkdir()
+        self.target.write_bytes(b"current")
+        with self.assertRaises(ArtifactError):
+            install_artifact(manifest, self.target)
+        self.assertEqual(self.target.read_bytes(), b"current")
+        self.assertEqual(os.listdir(self.target.parent), ["ciqual.db"])
+
+class ZenodoStandIn:
+    """Local HTTP server imitating the Zenodo API and file downloads"""
+
+    def __init__(self, record_id, payloads, delay=0.0):
+        import hashlib
+        import http.server
+        import json
+        import threading
+        import time
+
+        self.requests = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        lock = threading.Lock()
+        stand_in = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                with lock:
+                    stand_in.requests.append(self.path)
+                    stand_in.in_flight += 1
+                    stand_in.max_in_flight = max(stand_in.max_in_flight, stand_in.in_flight)
+                try:
+                    if self.path == "/api/latest":
+                        files = [
+                            {
+                                "key": name,
+                                "checksum": "md5:" + hashlib.md5(body).hexdigest(),
+                                "links": {"self": f"{stand_in.url}/files/{name}"},
+                            }
+                            for name, body in payloads.items()
+                        ]
+                        body = json.dumps({"id": record_id, "metadata": {"version": "test"}, "files": files}).encode()
+                    elif self.path.startswith("/files/") and self.path[7:] in payloads:
+                        time.sleep(delay)
+                        body = payloads[self.path[7:]]
+                    else:
+                        self.send_error(404)
+                        return
+                    etag = '"' + hashlib.md5(body).hexdigest() + '"'
+                    if self.headers.get("If-None-Match") == etag:
+                        self.send_response(304)
+                        self.send_header("ETag", etag)
+                        self.end_headers()
+                        return
+                    self.send_response(200)
+                    self.send_header("ETag", etag)
+                    self.send_header("Content-Length", str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+                finally:
+                    with lock:
+                        stand_in.in_flight -= 1
+
+        self.server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+def sample_xml_payloads():
+    """Fixture XML files in the CIQUAL layout (windows-1252 encoded)"""
+    def document(records):
+        return ('<?xml version="1.0" encoding="windows-1252"?>\n<TABLE>' + records + "</TABLE>").encode("windows-1252")
+
+    return {
+        "const_2025_01_01.xml": document(
+            "<CONST><const_code>328</const_code><const_nom_fr>Energie (kcal/100 g)</const_nom_fr>"
+            "<const_nom_eng>Energy (kcal/100 g)</const_nom_eng><code_INFOODS>ENERC</code_INFOODS></CONST>"
+            "<CONST><const_code>25000</const_code><const_nom_fr>Protéines (g/100 g)</const_nom_fr></CONST>"
+        ),
+        "alim_grp_2025_01_01.xml": document(
+            "<ALIM_GRP><alim_grp_code>02</alim_grp_code><alim_grp_nom_fr>fruits</alim_grp_nom_fr>"
+            "<alim_ssgrp_code>0204</alim_ssgrp_code><alim_ssssgrp_code>000000</alim_ssssgrp_code></ALIM_GRP>"
+        ),
+        "sources_2025_01_01.xml": document(
+            "<SOURCE><source_code>7</source_code><ref_citation>ANSES 2025</ref_citation></SOURCE>"
+        ),
+        "alim_2025_01_01.xml": document(
+            "<ALIM><alim_code>13000</alim_code><alim_nom_fr>Pomme, crue</alim_nom_fr>"
+            "<alim_nom_eng>Apple, raw</alim_nom_eng><alim_grp_code>02</alim_grp_code>"
+            "<alim_ssgrp_code>0204</alim_ssgrp_code><alim_ssssgrp_code>000000</alim_ssssgrp_code></ALIM>"
+            "<ALIM><alim_code>13001</alim_code><alim_nom_fr>Pâte de coing</alim_nom_fr>"
+            "<alim_grp_code>02</alim_grp_code><facteur_Jones>6,25</facteur_Jones></ALIM>"
+        ),
+        "compo_2025_01_01.xml": document(
+            "<COMPO><alim_code>13000</alim_code><const_code>328</const_code><teneur>52,3</teneur>"
+            "<min>48</min><max>55</max><code_confiance>A</code_confiance><source_code>7</source_code></COMPO>"
+            "<COMPO><alim_code>13000</alim_code><const_code>25000</const_code><teneur>traces</teneur></COMPO>"
+            "<COMPO><alim_code>13001</alim_code><const_code>328</const_code><teneur>250</teneur></COMPO>"
+        ),
+    }
+
+class TestZenodoImport(unittest.TestCase):
+
+    def setUp(self):
+        from unittest.mock import patch
+        import data_loader
+        self.test_dir = tempfile.mkdtemp()
+        self.db_path = Path(self.test_dir) / "ciqual.db"
+        self.stand_in = ZenodoStandIn("424242", sample_xml_payloads(), delay=0.2)
+        self.api_patch = patch.object(data_loader, "ZENODO_API_URL", f"{self.stand_in.url}/api/latest")
+        self.api_patch.start()
+
+    def tearDown(self):
+        self.api_patch.stop()
+        self.stand_in.close()
+        shutil.rmtree(self.test_dir)
+
+    def test_import_downloads_files_concurrently(self):
+        """Test a full import against the local stand-in, with parallel downloads"""
+        import data_loader
+        data_loader.initialize_database(force_update=True, db_path=self.db_path)
+
+        # All five files were in flight at the same time
+        self.assertGreaterEqual(self.stand_in.max_in_flight, 2)
+        self.assertEqual(len([p for p in self.stand_in.requests if p.startswith("/files/")]), 5)
+
+        conn = sqlite3.connect(self.db_path)
+        self.assertEqual(conn.execute("SELECT COUNT(*) FROM foods").fetchone()[0], 2)
+        self.assertEqual(conn.execute("SELECT COUNT(*) FROM composition").fetchone()[0], 2)
+        self.assertEqual(
+            conn.execute("SELECT teneur, min, code_confiance FROM composition WHERE alim_code = 13000").fetchone(),
+            (52.3, 48.0, 'A'),
+        )
+        self.assertEqual(conn.execute("SELECT unit FROM nutrients WHERE const_code = 328").fetchone()[0], "kcal/100g")
+        self.assertEqual(
+            conn.execute("SELECT alim_code FROM foods_fts WHERE foods_fts MATCH 'pate'").fetchall(),
+            [(13001,)],
+        )
+        self.assertEqual(
+            conn.execute("SELECT value FROM metadata WHERE key = 'zenodo_record_id'").fetchone()[0],
+            "424242",
+        )
+        conn.close()
+        self.assertTrue((Path(self.test_dir) / "ciqual.matrix").exists())
+
+    def test_concurrent_downloads_of_one_file_do_not_collide(self):
+        """Test that loaders fetching the same cache entry use separate temp files"""
+        import threading
+        import data_loader
+        dest = Path(self.test_dir) / "alim_2025_01_01.xml"
+        url = f"{self.stand_in.url}/files/alim_2025_01_01.xml"
+        threads = [threading.Thread(target=data_loader._download_file, args=(url, dest)) for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(dest.read_bytes(), sample_xml_payloads()["alim_2025_01_01.xml"])
+        self.assertEqual(sorted(p.name for p in Path(self.test_dir).iterdir()), [dest.name, dest.name + ".etag"])
+
+    def test_reimport_uses_download_cache(self):
+        """Test that unchanged files are served from the checksum cache"""
+        import data_loader
+        data_loader.initialize_database(force_update=True, db_path=self.db_path)
+        self.stand_in.requests.clear()
+        data_loader.initialize_database(force_update=True, db_path=self.db_path)
+
+        self.assertEqual(self.stand_in.requests, ["/api/latest"])
+        conn = sqlite3.connect(self.db_path)
+        self.assertEqual(conn.execute("SELECT COUNT(*) FROM foods").fetchone()[0], 2)
+        conn.close()
+
+    def test_corrupt_cache_entry_is_downloaded_again(self):
+        """Test that a cached file failing its checksum is replaced"""
+        import data_loader
+        data_loader.initialize_database(force_update=True, db_path=self.db_path)
+        cached = next((Path(self.test_dir) / "cache").glob("md5-*/alim_2025_01_01.xml"))
+        cached.write_bytes(b"<TABLE></TABLE>")
+        self.stand_in.requests.clear()
+
+        data_loader.initialize_database(force_update=True, db_path=self.db_path)
+
+        self.assertEqual(self.stand_in.requests, ["/api/latest", "/files/alim_2025_01_01.xml"])
+        conn = sqlite3.connect(self.db_path)
+        self.assertEqual(conn.execute("SELECT COUNT(*) FROM foods").fetchone()[0], 2)
+        conn.close()
+
+    def test_import_from_source_dir(self):
+        """Test an offline import from a directory of XML files"""
+        import data_loader
+        source_dir = Path(self.test_dir) / "xml"
+        source_dir.mkdir()
+        for name, body in sample_xml_payloads().items():
+            (source_dir / name).write_bytes(body)
+
+        data_loader.initialize_database(db_path=self.db_path, source_dir=source_dir)
+
+        self.assertEqual(self.stand_in.requests, [])
+        conn = sqlite3.connect(self.db_path)
+        self.assertEqual(conn.execute("SELECT COUNT(*) FROM foods").fetchone()[0], 2)
+        record_id = conn.execute("SELECT value FROM metadata WHERE key = 'zenodo_record_id'").fetchone()[0]
+        self.assertTrue(record_id.startswith("local-"))
+        conn.close()
+
+    def test_new_release_is_applied_as_delta(self):
+        """Test that an update only writes the rows that changed"""
+        import data_loader
+        source_dir = Path(self.test_dir) / "xml"
+        source_dir.mkdir()
+        payloads = sample_xml_payloads()
+        for name, body in payloads.items():
+            (source_dir / name).write_bytes(body)
+        data_loader.initialize_database(db_path=self.db_path, source_dir=source_dir)
+
+        # Rename one food, add another, drop a composition row and change a value
+        foods = payloads["alim_2025_01_01.xml"].replace(
+            b"Pomme, crue", b"Pomme, crue, sans peau"
+        ).replace(
+            b"</TABLE>",
+            b"<ALIM><alim_code>13002</alim_code><alim_nom_fr>Poire, crue</alim_nom_fr>"
+            b"<alim_grp_code>02</alim_grp_code></ALIM></TABLE>",
+        )
+        compo = payloads["compo_2025_01_01.xml"].replace(
+            b"<teneur>250</teneur>", b"<teneur>251</teneur>"
+        ).replace(
+            b"<COMPO><alim_code>13000</alim_code><const_code>328</const_code><teneur>52,3</teneur>"
+            b"<min>48</min><max>55</max><code_confiance>A</code_confiance><source_code>7</source_code></COMPO>", b""
+        )
+        (source_dir / "alim_2025_01_01.xml").write_bytes(foods)
+        (source_dir / "compo_2025_01_01.xml").write_bytes(compo)
+        data_loader.initialize_database(db_path=self.db_path, source_dir=source_dir)
+
+        conn = sqlite3.connect(self.db_path)
+        delta = json.loads(conn.execute("SELECT value FROM metadata WHERE key = 'last_delta'").fetchone()[0])
+        self.assertEqual(delta["foods"], {"inserted": 1, "updated": 1, "deleted": 0})
+        self.assertEqual(delta["composition"], {"inserted": 0, "updated": 1, "deleted": 1})
+        self.assertEqual(delta["nutrients"], {"inserted": 0, "updated": 0, "deleted": 0})
+        self.assertEqual(delta["foods_fts"], 2)
+        self.assertEqual(
+            conn.execute("SELECT alim_code FROM foods_fts WHERE foods_fts MATCH 'peau OR poire' ORDER BY alim_code").fetchall(),
+            [(13000,), (13002,)],
+        )
+        self.assertEqual(conn.execute("SELECT teneur FROM composition WHERE alim_code = 13001").fetchone()[0], 251.0)
+        self.assertEqual(conn.execute("SELECT COUNT(*) FROM composition").fetchone()[0], 1)
+        self.assertEqual(conn.execute("PRAGMA integrity_check").fetchone()[0], "ok")
+        conn.execute("INSERT INTO foods_fts(foods_fts, rank) VALUES ('integrity-check', 1)")
+        conn.close()
+
+    def test_database_with_old_fts_rowids_is_rebuilt_in_full(self):
+        """Test that a release is not applied as a delta onto an index keyed 1..N"""
+        import data_loader
+        source_dir = Path(self.test_dir) / "xml"
+        source_dir.mkdir()
+        payloads = sample_xml_payloads()
+        for name, body in payloads.items():
+            (source_dir / name).write_bytes(body)
+        data_loader.initialize_database(db_path=self.db_path, source_dir=source_dir)
+        self.assertTrue(data_loader._can_apply_delta(self.db_path))
+        index_fts_like_baseline(self.db_path)
+        self.assertFalse(data_loader._can_apply_delta(self.db_path))
+
+        (source_dir / "alim_2025_01_01.xml").write_bytes(
+            payloads["alim_2025_01_01.xml"].replace(b"Pomme, crue", b"Pomme, crue, sans peau")
+        )
+        data_loader.initialize_database(db_path=self.db_path, source_dir=source_dir)
+
+        conn = sqlite3.connect(self.db_path)
+        self.assertIsNone(conn.execute("SELECT value FROM metadata WHERE key = 'last_delta'").fetchone())
+        self.assertEqual(conn.execute("SELECT rowid FROM foods_fts WHERE foods_fts MATCH 'peau'").fetchall(), [(13000,)])
+        conn.execute("INSERT INTO foods_fts(foods_fts, rank) VALUES ('integrity-check', 1)")
+        conn.close()
+
 if __name__ == '__main__':
     import asyncio
     
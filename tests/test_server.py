@@ -64,6 +64,245 @@ class TestCiqualServer(unittest.TestCase):
         self.assertIn('error', result[0])
         self.assertIn('read-only', result[0]['error'])
 
+class TestQueryExecutor(unittest.TestCase):
+
+    def test_runs_off_event_loop(self):
+        """Test that blocking work does not stall other coroutines"""
+        import asyncio
+        import threading
+        import time
+        from executor import QueryExecutor
+
+        executor = QueryExecutor(max_workers=2)
+        loop_thread = threading.get_ident()
+
+        def blocking():
+            time.sleep(0.2)
+            return threading.get_ident()
+
+        async def scenario():
+            ticks = 0
+            task = asyncio.ensure_future(executor.run(blocking))
+            while not task.done():
+                ticks += 1
+                await asyncio.sleep(0.01)
+            return await task, ticks
+
+        worker_thread, ticks = asyncio.run(scenario())
+        executor.shutdown()
+        self.assertNotEqual(worker_thread, loop_thread)
+        self.assertGreater(ticks, 5)
+
+    def test_rejects_when_queue_full(self):
+        """Test that submissions beyond workers + queue are rejected"""
+        import asyncio
+        import threading
+        from executor import QueryExecutor, ExecutorBusy
+
+        executor = QueryExecutor(max_workers=1, max_queue=1)
+        release = threading.Event()
+
+        async def scenario():
+            first = asyncio.ensure_future(executor.run(release.wait))
+            second = asyncio.ensure_future(executor.run(release.wait))
+            await asyncio.sleep(0.05)
+            with self.assertRaises(ExecutorBusy):
+                await executor.run(release.wait)
+            stats = executor.stats()
+            release.set()
+            await asyncio.gather(first, second)
+            return stats
+
+        stats = asyncio.run(scenario())
+        executor.shutdown()
+        self.assertEqual(stats["running"], 1)
+        self.assertEqual(stats["queued"], 1)
+        self.assertEqual(stats["rejected"], 1)
+
+    def test_cancelled_queued_calls_leave_the_queue(self):
+        """Test that callers cancelled before their work starts free their queue slots"""
+        import asyncio
+        import threading
+        from executor import QueryExecutor
+
+        executor = QueryExecutor(max_workers=1, max_queue=2)
+        release = threading.Event()
+
+        async def scenario():
+            running = asyncio.ensure_future(executor.run(release.wait))
+            queued = [asyncio.ensure_future(executor.run(release.wait)) for _ in range(2)]
+            await asyncio.sleep(0.05)
+            for task in queued:
+                task.cancel()
+            await asyncio.gather(*queued, return_exceptions=True)
+            stats = executor.stats()
+            # The freed slots accept new work
+            again = asyncio.ensure_future(executor.run(release.wait))
+            await asyncio.sleep(0.01)
+            release.set()
+            await asyncio.gather(running, again)
+            return stats
+
+        stats = asyncio.run(scenario())
+        executor.shutdown()
+        self.assertEqual((stats["running"], stats["queued"]), (1, 0))
+        self.assertEqual(executor.stats()["queued"], 0)
+
+class TestResultCache(unittest.TestCase):
+
+    def test_normalize_sql(self):
+        """Test that formatting differences map to the same cache key"""
+        from cache import normalize_sql
+        self.assertEqual(
+            normalize_sql("SELECT  *\n  FROM foods -- comment\n WHERE x = 1;"),
+            "SELECT * FROM foods WHERE x = 1",
+        )
+        # Whitespace inside literals is significant
+        self.assertEqual(
+            normalize_sql("SELECT 'a  b' AS Label"),
+            "SELECT 'a  b' AS Label",
+        )
+
+    def test_lru_eviction_by_bytes(self):
+        """Test that least recently used entries are evicted over budget"""
+        from cache import ResultCache
+        cache = ResultCache(max_bytes=100, max_entry_bytes=100)
+        cache.put("a", [1], size=40)
+        cache.put("b", [2], size=40)
+        self.assertEqual(cache.get("a"), [1])  # a becomes most recent
+        cache.put("c", [3], size=40)
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("a"), [1])
+        self.assertEqual(cache.get("c"), [3])
+        self.assertLessEqual(cache.stats()["bytes"], 100)
+
+    def test_oversized_entries_are_skipped(self):
+        """Test that results above the per-entry limit are not cached"""
+        from cache import ResultCache
+        cache = ResultCache(max_bytes=100)
+        cache.put("big", ["x" * 200])
+        self.assertIsNone(cache.get("big"))
+
+class TestDatabaseRefresh(unittest.TestCase):
+
+    def test_update_runs_in_background(self):
+        """Test that start() returns at once and the update reports progress"""
+        import threading
+        from pathlib import Path
+        from refresh import DatabaseRefresh
+        release = threading.Event()
+
+        def update(progress):
+            progress("Loading foods...")
+            release.wait(5)
+
+        refresh = DatabaseRefresh(Path("/nonexistent/ciqual.db"), Mock(), update)
+        refresh.start()
+        self.assertTrue(refresh.running)
+        release.set()
+        self.assertTrue(refresh.wait(5))
+
+        status = refresh.status()
+        self.assertEqual(status["state"], "updated")
+        self.assertEqual(status["message"], "Loading foods...")
+        self.assertIsNotNone(status["finished_at"])
+
+    def test_up_to_date_and_failure_states(self):
+        """Test that the check result and update errors are reported"""
+        import tempfile
+        from pathlib import Path
+        from refresh import DatabaseRefresh
+        with tempfile.NamedTemporaryFile() as db:
+            update = Mock()
+            refresh = DatabaseRefresh(Path(db.name), Mock(return_value=False), update)
+            refresh.start()
+            refresh.wait(5)
+            self.assertEqual(refresh.status()["state"], "up_to_date")
+            update.assert_not_called()
+
+            refresh = DatabaseRefresh(Path(db.name), Mock(return_value=True), Mock(side_effect=RuntimeError("offline")))
+            refresh.start()
+            refresh.wait(5)
+            self.assertEqual(refresh.status()["state"], "failed")
+            self.assertEqual(refresh.status()["error"], "offline")
+
+    def test_refresh_status_when_executor_is_busy(self):
+        """Test that refresh_status still answers when no worker is free"""
+        import asyncio
+        import tempfile
+        from pathlib import Path
+        import server
+        from executor import ExecutorBusy
+        with tempfile.NamedTemporaryFile() as db, \
+                patch.object(server, "DB_PATH", Path(db.name)), \
+                patch.object(server.executor, "run", side_effect=ExecutorBusy("full")):
+            status = asyncio.run(server.refresh_status())
+        self.assertEqual(status["state"], "idle")
+        self.assertIsNone(status["record_id"])
+        self.assertTrue(status["busy"])
+
+    def test_loader_runs_under_the_database_lock(self):
+        """Test that a loader waits while another process holds the database lock"""
+        import io
+        import shutil
+        import tempfile
+        import threading
+        import time
+        from pathlib import Path
+        import server
+        test_dir = tempfile.mkdtemp()
+        started = threading.Event()
+
+        def fake_popen(command, **kwargs):
+            fake_popen.command = command
+            started.set()
+            return Mock(stdout=io.StringIO("done\n"), wait=Mock(return_value=0))
+
+        try:
+            with patch.object(server, "DB_PATH", Path(test_dir) / "ciqual.db"), \
+                    patch("server.subprocess.Popen", side_effect=fake_popen):
+                with server._file_lock(server.DB_PATH):
+                    loader = threading.Thread(target=server._run_loader, args=(Mock(),))
+                    loader.start()
+                    time.sleep(0.2)
+                    self.assertFalse(started.is_set())
+                loader.join(5)
+                self.assertTrue(started.is_set())
+            self.assertTrue(Path(fake_popen.command[1]).is_file())
+        finally:
+            shutil.rmtree(test_dir)
+
+class TestStartupImports(unittest.TestCase):
+
+    # Cumulative import time allowed for the server's own modules (fastmcp excluded)
+    IMPORT_BUDGET_US = 150_000
+
+    def test_server_import_is_lazy(self):
+        """Test that importing the server and launching the loader skip the loader, lxml and numpy"""
+        import subprocess
+        src = os.path.join(os.path.dirname(__file__), '..', 'src')
+        code = (
+            "import sys, io, tempfile, subprocess; from pathlib import Path; sys.path.insert(0, %r); import server; "
+            "server.DB_PATH = Path(tempfile.mkdtemp()) / 'ciqual.db'; "
+            "subprocess.Popen = lambda *a, **k: type('P', (), {'stdout': io.StringIO(''), 'wait': lambda self: 0})(); "
+            "server._run_loader(lambda line: None); "
+            "print(','.join(m for m in ('data_loader', 'lxml', 'numpy', 'matrix') if m in sys.modules))"
+        ) % src
+        result = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", code],
+            capture_output=True, text=True, timeout=60,
+        )
+        self.assertEqual(result.returncode, 0, result.stderr[-2000:])
+        self.assertEqual(result.stdout.strip(), "")
+
+        own_modules = {"server", "pool", "executor", "budget", "cache", "paging", "refresh"}
+        own_us = 0
+        for line in result.stderr.splitlines():
+            parts = line.split("|")
+            if len(parts) == 3 and parts[2].strip() in own_modules:
+                own_us += int(parts[0].split(":")[1])  # self time only
+        self.assertLess(own_us, self.IMPORT_BUDGET_US)
+
 class TestDataLoader(unittest.TestCase):
 
     def test_clean_text(self):
@@ -122,6 +361,31 @@ class TestDataLoader(unittest.TestCase):
         self.assertEqual(_get_element_text(root, "code_INFOODS"), "ENER")
         self.assertIsNone(_get_element_text(root, "missing_tag"))
 
+    def test_iter_xml_elements_streams_records(self):
+        """Test incremental parsing of a windows-1252 XML stream"""
+        import io
+        from data_loader import iter_xml_elements
+        xml = (
+            '<?xml version="1.0" encoding="windows-1252"?>\n<TABLE>'
+            + "".join(
+                f"<ALIM><alim_code>{i}</alim_code><alim_nom_fr>Pâté {i}</alim_nom_fr></ALIM>"
+                for i in range(50)
+            )
+            + "</TABLE>"
+        ).encode("windows-1252")
+
+        seen = []
+        for elem in iter_xml_elements(io.BytesIO(xml), "ALIM"):
+            seen.append((_get_element_text(elem, "alim_code"), _get_element_text(elem, "alim_nom_fr")))
+            # Records consumed before the previous one have been released
+            previous = elem.getprevious() if hasattr(elem, "getprevious") else None
+            if previous is not None:
+                self.assertEqual(len(previous), 0)
+                self.assertIsNone(previous.getprevious())
+
+        self.assertEqual(len(seen), 50)
+        self.assertEqual(seen[3], ("3", "Pâté 3"))
+
     def test_parse_number_new_fields(self):
         """Test number parsing for min/max/source_code values"""
         self.assertEqual(parse_number("0,5"), 0.5)
@@ -129,12 +393,18 @@ class TestDataLoader(unittest.TestCase):
         self.assertIsNone(parse_number(None))
         self.assertIsNone(parse_number("  "))
 
+    @patch('data_loader._verify_database')
+    @patch('data_loader.NutrientMatrix')
     @patch('data_loader._fetch_zenodo_metadata')
-    @patch('data_loader._download_xml')
+    @patch('data_loader._download_file')
     @patch('sqlite3.connect')
-    def test_initialize_database_calls_zenodo(self, mock_connect, mock_download, mock_fetch):
+    def test_initialize_database_calls_zenodo(self, mock_connect, mock_download, mock_fetch, mock_matrix, mock_verify):
         """Test that initialize_database uses Zenodo API"""
+        import tempfile
+        from pathlib import Path
         from data_loader import initialize_database
+        test_dir = tempfile.mkdtemp()
+        db_path = Path(test_dir) / "ciqual.db"
 
         mock_fetch.return_value = {
             "record_id": "123456",
@@ -148,19 +418,20 @@ class TestDataLoader(unittest.TestCase):
             ],
         }
 
-        # Create mock XML roots for each file type
-        import xml.etree.ElementTree as ET
-
-        def make_xml_root(tag, children_xml):
-            return ET.fromstring(f"<ROOT>{children_xml}</ROOT>")
+        # XML payload served for each file type
+        payloads = {
+            "https://zenodo.org/const": "<CONST><const_code>328</const_code><const_nom_fr>Energie (kcal/100g)</const_nom_fr><code_INFOODS>ENER</code_INFOODS></CONST>",
+            "https://zenodo.org/grp": "<ALIM_GRP><alim_grp_code>01</alim_grp_code><alim_grp_nom_fr>Entrées</alim_grp_nom_fr></ALIM_GRP>",
+            "https://zenodo.org/sources": "<SOURCE><source_code>1</source_code><ref_citation>Test ref</ref_citation></SOURCE>",
+            "https://zenodo.org/alim": "<ALIM><alim_code>1001</alim_code><alim_nom_fr>Pomme</alim_nom_fr><alim_grp_code>01</alim_grp_code></ALIM>",
+            "https://zenodo.org/compo": "<COMPO><alim_code>1001</alim_code><const_code>328</const_code><teneur>52</teneur><source_code>1</source_code></COMPO>",
+        }
 
-        nutrients_root = make_xml_root("ROOT", "<CONST><const_code>328</const_code><const_nom_fr>Energie (kcal/100g)</const_nom_fr><code_INFOODS>ENER</code_INFOODS></CONST>")
-        groups_root = make_xml_root("ROOT", "<ALIM_GRP><alim_grp_code>01</alim_grp_code><alim_grp_nom_fr>Entrées</alim_grp_nom_fr></ALIM_GRP>")
-        sources_root = make_xml_root("ROOT", "<SOURCE><source_code>1</source_code><ref_citation>Test ref</ref_citation></SOURCE>")
-        foods_root = make_xml_root("ROOT", "<ALIM><alim_code>1001</alim_code><alim_nom_fr>Pomme</alim_nom_fr><alim_grp_code>01</alim_grp_code></ALIM>")
-        compo_root = make_xml_root("ROOT", "<COMPO><alim_code>1001</alim_code><const_code>328</const_code><teneur>52</teneur><source_code>1</source_code></COMPO>")
+        def fake_download(url, dest, etag=None):
+            Path(dest).write_text(f"<ROOT>{payloads[url]}</ROOT>", encoding="utf-8")
+            return Path(dest)
 
-        mock_download.side_effect = [nutrients_root, groups_root, sources_root, foods_root, compo_root]
+        mock_download.side_effect = fake_download
 
         # Mock DB connection
         mock_conn = MagicMock()
@@ -170,12 +441,48 @@ class TestDataLoader(unittest.TestCase):
         mock_connect.return_value = mock_conn
 
         # Run with force_update to skip cache check
-        initialize_database(force_update=True)
+        initialize_database(force_update=True, db_path=db_path)
 
         # Verify Zenodo API was called
         mock_fetch.assert_called_once()
         # Verify XMLs were downloaded (5 files)
         self.assertEqual(mock_download.call_count, 5)
+        # Verify every table was loaded from its file
+        self.assertEqual(mock_conn.cursor.return_value.executemany.call_count, 5)
+        # Verify the matrix sidecar was written
+        mock_matrix.from_connection.return_value.save.assert_called_once()
+        # Verify the checked build was swapped into place, leaving no temp files
+        mock_verify.assert_called_once()
+        self.assertEqual(sorted(os.listdir(test_dir)), ["cache", "ciqual.db"])
+        import shutil
+        shutil.rmtree(test_dir)
+
+    @patch('data_loader._fetch_zenodo_metadata')
+    def test_matching_record_id_needs_no_update(self, mock_fetch):
+        """Test that an up-to-date database is reported current and the check is recorded"""
+        import shutil
+        import sqlite3
+        import tempfile
+        from pathlib import Path
+        from data_loader import should_update_database
+        from refresh import checked_recently
+        test_dir = tempfile.mkdtemp()
+        db_path = Path(test_dir) / "ciqual.db"
+        conn = sqlite3.connect(db_path)
+        conn.execute("CREATE TABLE metadata (key TEXT PRIMARY KEY, value TEXT)")
+        conn.execute("INSERT INTO metadata VALUES ('zenodo_record_id', '123456')")
+        conn.commit()
+        conn.close()
+        try:
+            from pool import db_signature
+            signature = db_signature(db_path)
+            mock_fetch.return_value = {"record_id": "123456", "version": "2024", "files": []}
+            self.assertFalse(should_update_database(db_path))
+            self.assertTrue(checked_recently(db_path))
+            # The check is recorded beside the database, so pools see the same file
+            self.assertEqual(db_signature(db_path), signature)
+        finally:
+            shutil.rmtree(test_dir)
 
 if __name__ == '__main__':
     # Import sqlite3 for the error type